@@ -0,0 +1,63 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+LANGUAGES = ["C", "CXX"]
+
+# Names of the counters in the output of "ccache --print-stats". ccache 3.7
+# used different names than ccache 4.
+_HIT_COUNTERS = ["direct_cache_hit", "preprocessed_cache_hit",
+                 "cache_hit_direct", "cache_hit_preprocessed"]
+_MISS_COUNTERS = ["cache_miss"]
+
+
+def get_environment(cache_dir, base_dir):
+    # With base_dir, ccache hashes paths below it as relative paths, so that
+    # builds in different directories can share the cache
+    env = {"CCACHE_BASEDIR": base_dir}
+    if cache_dir is not None:
+        env["CCACHE_DIR"] = cache_dir
+    return env
+
+
+def get_launcher(env):
+    # Compilers also get run outside of dh_ctest_build, so the settings are
+    # part of the launcher rather than the environment
+    return ["env", *("%s=%s" % item for item in sorted(env.items())),
+            "ccache"]
+
+
+def read_stats(f):
+    counters = {}
+    for line in f:
+        fields = line.split("\t")
+        if len(fields) == 2:
+            try:
+                counters[fields[0]] = int(fields[1])
+            except ValueError:
+                pass
+
+    hits = sum(counters.get(c, 0) for c in _HIT_COUNTERS)
+    misses = sum(counters.get(c, 0) for c in _MISS_COUNTERS)
+    return _make_stats(hits, misses)
+
+
+def subtract_stats(after, before):
+    # The counters only go down if someone zeroed them in between
+    return _make_stats(max(after["hits"] - before["hits"], 0),
+                       max(after["misses"] - before["misses"], 0))
+
+
+def _make_stats(hits, misses):
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else None,
+    }
+
+
+def format_stats(stats):
+    line = "ccache: %i hits, %i misses" % (stats["hits"], stats["misses"])
+    if stats["hit_rate"] is not None:
+        line += " (%.1f%% hit rate)" % (stats["hit_rate"] * 100)
+    return line
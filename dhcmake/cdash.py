@@ -0,0 +1,239 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import base64
+import concurrent.futures
+import glob
+import gzip
+import hashlib
+import http.client
+import os
+import queue
+import re
+import time
+import urllib.parse
+import xml.etree.ElementTree
+
+
+PART_FILES = {
+    "Update": ["Update.xml"],
+    "Configure": ["Configure.xml"],
+    "Build": ["Build.xml"],
+    "Test": ["Test.xml"],
+    "Coverage": ["Coverage.xml", "CoverageLog-*.xml"],
+    "MemCheck": ["DynamicAnalysis.xml"],
+    "Notes": ["Notes.xml"],
+    "Upload": ["Upload.xml"],
+    "Done": ["Done.xml"],
+}
+
+PARTS = list(PART_FILES)
+
+
+class CDashError(Exception):
+    pass
+
+
+def get_part_files(testing_dir, part):
+    result = []
+    for pattern in PART_FILES.get(part, []):
+        result.extend(sorted(glob.glob(os.path.join(testing_dir, pattern))))
+    return result
+
+
+def read_site(path):
+    # Only the root element is needed, so don't parse all of Test.xml
+    with open(path, "rb") as f:
+        for event, element in xml.etree.ElementTree.iterparse(
+                f, events=("start",)):
+            if element.tag == "Site":
+                return dict(element.attrib)
+            return None
+    return None
+
+
+def write_notes_xml(f, site, notes_files):
+    root = xml.etree.ElementTree.Element("Site", site)
+    notes = xml.etree.ElementTree.SubElement(root, "Notes")
+    for path in notes_files:
+        with open(path, "r", errors="replace") as nf:
+            text = nf.read()
+        mtime = os.stat(path).st_mtime
+        note = xml.etree.ElementTree.SubElement(notes, "Note", Name=path)
+        xml.etree.ElementTree.SubElement(note, "Time").text = \
+            "%i" % mtime
+        xml.etree.ElementTree.SubElement(note, "DateTime").text = \
+            time.strftime("%b %d %H:%M %Z", time.localtime(mtime))
+        xml.etree.ElementTree.SubElement(note, "Text").text = text
+
+    tree = xml.etree.ElementTree.ElementTree(root)
+    xml.etree.ElementTree.indent(tree, space="\t")
+    tree.write(f, encoding="UTF-8", xml_declaration=True)
+
+
+def write_done_xml(f, build_id):
+    root = xml.etree.ElementTree.Element("Done")
+    xml.etree.ElementTree.SubElement(root, "buildId").text = build_id or ""
+    xml.etree.ElementTree.SubElement(root, "time").text = \
+        "%i" % time.time()
+
+    tree = xml.etree.ElementTree.ElementTree(root)
+    xml.etree.ElementTree.indent(tree, space="\t")
+    tree.write(f, encoding="UTF-8", xml_declaration=True)
+
+
+class Uploader:
+    def __init__(self, url, jobs=4, retries=4, backoff=1.0, timeout=60,
+                 compress=False):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme == "http":
+            self.connection_class = http.client.HTTPConnection
+        elif parsed.scheme == "https":
+            self.connection_class = http.client.HTTPSConnection
+        else:
+            raise CDashError("Unsupported submit URL: %s" % url)
+
+        self.host = parsed.netloc.rpartition("@")[2]
+        self.path = parsed.path or "/"
+        if parsed.query:
+            self.path += "?" + parsed.query
+        self.headers = {"Content-Type": "text/xml"}
+        if parsed.username is not None:
+            credentials = "%s:%s" % (urllib.parse.unquote(parsed.username),
+                                     urllib.parse.unquote(
+                                         parsed.password or ""))
+            self.headers["Authorization"] = "Basic " + base64.b64encode(
+                credentials.encode("utf-8")).decode("ascii")
+
+        self.jobs = jobs
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # CDash's submit.php stores the body as it is, so this only works
+        # with servers that are known to decode it
+        self.compress = compress
+        self.build_id = None
+
+        # Idle keep-alive connections, shared by the upload threads
+        self.connections = queue.LifoQueue()
+
+    def close(self):
+        while True:
+            try:
+                self.connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _request(self, url, body, headers):
+        try:
+            conn = self.connections.get_nowait()
+        except queue.Empty:
+            conn = self.connection_class(self.host, timeout=self.timeout)
+
+        try:
+            conn.request("PUT", url, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.connections.put(conn)
+        return response.status, data
+
+    def upload(self, path, remote_name):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        query = urllib.parse.urlencode({
+            "FileName": remote_name,
+            "MD5": hashlib.md5(data).hexdigest(),
+        })
+        url = self.path + ("&" if "?" in self.path else "?") + query
+
+        headers = dict(self.headers)
+        body = data
+        if self.compress:
+            body = gzip.compress(data)
+            headers["Content-Encoding"] = "gzip"
+
+        attempt = 0
+        while True:
+            try:
+                status, response = self._request(url, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                error = str(e)
+            else:
+                if 200 <= status < 300:
+                    self._check_response(path, response)
+                    return
+                error = "HTTP status %i" % status
+                if status < 500 and status not in (408, 429):
+                    raise CDashError("Failed to submit %s: %s"
+                                     % (path, error))
+
+            attempt += 1
+            if attempt > self.retries:
+                raise CDashError("Failed to submit %s: %s" % (path, error))
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def _check_response(self, path, response):
+        response = response.decode("utf-8", "replace")
+        if re.search("<status>\\s*ERROR\\s*</status>", response):
+            message = re.search("<message>(.*?)</message>", response,
+                                re.DOTALL)
+            raise CDashError("Failed to submit %s: %s" % (
+                path, message.group(1).strip() if message else "ERROR"))
+
+        build_id = re.search("<buildId>\\s*([0-9]+)\\s*</buildId>", response)
+        if build_id:
+            self.build_id = build_id.group(1)
+
+    def submit(self, testing_dir, parts=None, notes_files=None):
+        if parts is None:
+            parts = PARTS
+
+        paths = [path for part in parts if part not in ("Notes", "Done")
+                 for path in get_part_files(testing_dir, part)]
+        site = None
+        for path in paths:
+            site = read_site(path)
+            if site is not None:
+                break
+        else:
+            return []
+        prefix = "%s___%s___%s___XML___" % (
+            site.get("Name"), site.get("BuildName"), site.get("BuildStamp"))
+
+        if "Notes" in parts and notes_files:
+            notes = os.path.join(testing_dir, "Notes.xml")
+            with open(notes, "wb") as f:
+                write_notes_xml(f, site, notes_files)
+            paths.append(notes)
+
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            futures = [executor.submit(self.upload, path,
+                                       prefix + os.path.basename(path))
+                       for path in paths]
+            for future in futures:
+                future.result()
+
+        # Done tells CDash that the build is complete, so it goes last
+        if "Done" in parts:
+            done = os.path.join(testing_dir, "Done.xml")
+            with open(done, "wb") as f:
+                write_done_xml(f, self.build_id)
+            self.upload(done, prefix + "Done.xml")
+            paths.append(done)
+
+        return paths
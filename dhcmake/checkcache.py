@@ -0,0 +1,97 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import hashlib
+import json
+import os
+import re
+
+
+CHECK_CACHE_SUFFIX = ".cmake"
+
+# Anything that changes the outcome of a check has to be part of the key
+ARCH_VARIABLES = ["DEB_BUILD_GNU_TYPE", "DEB_HOST_GNU_TYPE",
+                  "DEB_HOST_ARCH"]
+TOOLCHAIN_VARIABLES = ["CC", "CXX"]
+TOOLCHAIN_PACKAGES = ["cmake", "dpkg-dev", "gcc", "g++", "libc6-dev"]
+
+_CACHE_ENTRY = re.compile("^(\"[^\"]*\"|[^:=]+):([A-Z]+)=(.*)$")
+_CHECK_NAME = re.compile("^[A-Za-z0-9_.+]+$")
+
+# CMake's own bookkeeping, which CMake has to compute itself
+_SKIPPED_PREFIXES = ["CMAKE_", "_", "FIND_PACKAGE_MESSAGE_DETAILS_"]
+_KEPT_PREFIXES = ["CMAKE_HAVE_"]
+
+
+def get_key(components):
+    return hashlib.sha256(json.dumps(components, sort_keys=True)
+                          .encode("utf-8")).hexdigest()
+
+
+def get_check_cache_file(directory, key):
+    return os.path.join(directory, key + CHECK_CACHE_SUFFIX)
+
+
+def configure_succeeded(build_dir):
+    # CMake saves the cache even if the configure fails, but it only
+    # generates the build system after a successful one
+    try:
+        return os.path.getmtime(
+            os.path.join(build_dir, "CMakeFiles/TargetDirectories.txt")) >= \
+            os.path.getmtime(os.path.join(build_dir, "CMakeCache.txt"))
+    except FileNotFoundError:
+        return False
+
+
+def read_cmake_cache(f):
+    entries = []
+    help_lines = []
+    for line in f:
+        line = line.rstrip("\n")
+        # CMake wraps long help strings, and marks actual line breaks with
+        # "\n"
+        if line.startswith("//"):
+            help_lines.append(line[2:])
+            continue
+        match = _CACHE_ENTRY.match(line)
+        if match:
+            entries.append({
+                "name": match.group(1).strip("\""),
+                "type": match.group(2),
+                "value": match.group(3),
+                "help": "".join(help_lines).replace("\\n", "\n"),
+            })
+        help_lines = []
+    return entries
+
+
+def select_check_results(entries, exclude=()):
+    # check_include_file(), check_symbol_exists(), try_compile() and friends
+    # store their results as internal entries. Leave out anything that
+    # mentions the source or build directory, as those may move.
+    results = []
+    for entry in entries:
+        name = entry["name"]
+        if entry["type"] != "INTERNAL" or not _CHECK_NAME.match(name):
+            continue
+        if any(name.startswith(p) for p in _SKIPPED_PREFIXES) and \
+                not any(name.startswith(p) for p in _KEPT_PREFIXES):
+            continue
+        if any(e in entry["value"] for e in exclude):
+            continue
+        results.append(entry)
+    return results
+
+
+def _quote(value):
+    equals = ""
+    while "]%s]" % equals in value:
+        equals += "="
+    return "[%s[%s]%s]" % (equals, value, equals)
+
+
+def format_initial_cache(results):
+    return "".join("set(%s %s CACHE INTERNAL %s)\n"
+                   % (e["name"], _quote(e["value"]), _quote(e["help"]))
+                   for e in results)
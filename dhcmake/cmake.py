@@ -2,8 +2,10 @@
 # BSD 3-Clause license. See top-level LICENSE file or
 # https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
 
+import os.path
 import re
-from dhcmake import common
+import sys
+from dhcmake import common, fileindex
 
 
 class DHCMake(common.DHCommon):
@@ -26,7 +28,7 @@ class DHCMake(common.DHCommon):
                  " dh_missing)",
             default="debian/tmp")
 
-    @common.DHEntryPoint("dh_cmake_install")
+    @common.DHEntryPoint("dh_cmake_install", record_history=True)
     def install(self, args=None):
         self.parse_args(args, make_arg_parser=self.install_make_arg_parser)
         if self.options.component:
@@ -44,7 +46,71 @@ class DHCMake(common.DHCommon):
                     self.do_cmake_install(self.get_build_directory(), p,
                                           component=c)
 
+    def installed_make_arg_parser(self, parser):
+        self.make_arg_parser(parser)
+        parser.add_argument(
+            "--unclaimed", action="store_true",
+            help="List the staged files that dh-cmake did not install into "
+                 "any package")
+        parser.add_argument(
+            "--sourcedir", action="store",
+            help="Staging directory to check for unclaimed files",
+            default="debian/tmp")
+        parser.add_argument(
+            "paths", nargs="*",
+            help="Installed paths to look up")
+
+    def format_installed_record(self, record):
+        path, package, component, tool = record
+        if component:
+            return "%s (%s, %s): %s" % (package, component, tool, path)
+        else:
+            return "%s (%s): %s" % (package, tool, path)
+
+    @common.DHEntryPoint("dh_cmake_installed")
+    def installed(self, args=None):
+        self.parse_args(args, make_arg_parser=self.installed_make_arg_parser)
+
+        try:
+            index = fileindex.InstalledFilesIndex(
+                common.INSTALLED_FILES_INDEX)
+        except FileNotFoundError:
+            index = None
+
+        found_all = True
+        try:
+            for path in self.options.paths:
+                if os.path.isabs(path):
+                    key = os.path.relpath(path, "/")
+                else:
+                    key = os.path.normpath(path)
+
+                records = index.lookup(key) if index is not None else []
+                for record in records:
+                    print(self.format_installed_record(record),
+                          file=self.stdout)
+                if not records:
+                    print("%s: not installed by dh-cmake" % path,
+                          file=self.stderr)
+                    found_all = False
+
+            if self.options.unclaimed:
+                for path in fileindex.find_unclaimed(index,
+                                                     self.options.sourcedir):
+                    print(path, file=self.stdout)
+        finally:
+            if index is not None:
+                index.close()
+
+        return found_all
+
 
 def install():
     dhcmake = DHCMake()
     dhcmake.install()
+
+
+def installed():
+    dhcmake = DHCMake()
+    if not dhcmake.installed():
+        sys.exit(1)
@@ -5,16 +5,21 @@
 import argparse
 import io
 import os.path
+import sqlite3
 import subprocess
 import sys
+import time
 
-from dhcmake import deb822, arch
+from dhcmake import deb822, arch, fileindex, history
+import debian.changelog
 import debian.deb822
 
 
 MIN_COMPAT = 1
 MAX_COMPAT = 1
 
+INSTALLED_FILES_INDEX = "debian/.debhelper/dh-cmake/installed-files.idx"
+
 
 class CompatError(Exception):
     pass
@@ -42,12 +47,26 @@ def escape_substvar(value):
     return value
 
 
-def DHEntryPoint(tool_name):
+def DHEntryPoint(tool_name, record_history=False):
     def wrapper(func):
         def wrapped(self, *args, **kargs):
             self.tool_name = tool_name
             self.compat()
-            return func(self, *args, **kargs)
+            started = time.time()
+            start = time.monotonic()
+            usage = history.get_usage()
+            outcome = history.FAILED
+            try:
+                result = func(self, *args, **kargs)
+                outcome = history.PASSED
+                return result
+            finally:
+                self.write_installed_files_index()
+                self.start_background_work()
+                if record_history:
+                    self.record_history(started, time.monotonic() - start,
+                                        history.get_usage_since(usage),
+                                        outcome)
 
         return wrapped
     return wrapper
@@ -62,6 +81,8 @@ class DHCommon:
         self.stderr = sys.stderr
         self.stderr_b = sys.stderr
         self._compat = None
+        self._installed_files = []
+        self.history_tests = []
 
     def _parse_args(self, parser, args, known):
         if known:
@@ -187,6 +208,56 @@ class DHCommon:
             subprocess.run(args, stdout=self.stdout, stderr=self.stderr,
                            env=env, cwd=cwd, check=True)
 
+    def get_source_package(self):
+        with open("debian/control", "r") as f:
+            source, packages = deb822.read_control(f)
+
+        return source["source"]
+
+    def get_cache_directory(self):
+        try:
+            cache_dir = os.environ["DH_CMAKE_CACHE_DIR"]
+        except KeyError:
+            return None
+
+        return os.path.join(cache_dir, self.get_source_package())
+
+    def get_history_file(self):
+        # Shared by every source package, so that they can be compared
+        try:
+            cache_dir = os.environ["DH_CMAKE_CACHE_DIR"]
+        except KeyError:
+            return None
+
+        return os.path.join(cache_dir, history.HISTORY_FILE)
+
+    def get_history_key(self):
+        with open("debian/changelog", "r") as f:
+            changelog = debian.changelog.Changelog(f, max_blocks=1)
+
+        return {
+            "source": self.get_source_package(),
+            "version": str(changelog.version),
+            "arch": arch.dpkg_architecture()["DEB_HOST_ARCH"],
+        }
+
+    def record_history(self, started, duration, usage, outcome,
+                       tool_name=None):
+        if tool_name is None:
+            tool_name = self.tool_name
+        tests = self.history_tests
+        self.history_tests = []
+        path = self.get_history_file()
+        if path is None or getattr(self.options, "no_act", False):
+            return
+
+        try:
+            history.record_step(path, self.get_history_key(), tool_name,
+                                started, duration, usage, outcome, tests)
+        except (OSError, sqlite3.Error) as e:
+            print("%s: warning: could not record build history: %s"
+                  % (self.tool_name, e), file=self.stderr)
+
     def get_all_packages(self):
         with open("debian/control", "r") as f:
             source, packages = deb822.read_control(f)
@@ -275,12 +346,40 @@ class DHCommon:
         else:
             return os.path.join("debian", package)
 
-    def write_substvar(self, name, value, package=None):
+    def get_substvars_file(self, package=None):
         if package:
-            filename = "debian/%s.substvars" % package
+            return "debian/%s.substvars" % package
         else:
-            filename = "debian/substvars"
+            return "debian/substvars"
+
+    def read_substvar(self, name, package=None):
+        try:
+            with open(self.get_substvars_file(package), "r") as f:
+                for l in f:
+                    key, sep, value = l.rstrip("\n").partition("=")
+                    if sep and key == name:
+                        return value
+        except FileNotFoundError:
+            pass
+        return None
+
+    def remove_substvar(self, name, package=None):
+        filename = self.get_substvars_file(package)
+        self.print_cmd(["sed", "-i", "/^%s=/d" % name, filename])
+        if not self.options.no_act:
+            try:
+                with open(filename, "r") as f:
+                    lines = [l for l in f if not l.startswith(name + "=")]
+            except FileNotFoundError:
+                return
+            with open(filename, "w") as f:
+                f.writelines(lines)
+
+    def write_substvar(self, name, value, package=None, replace=False):
+        if replace:
+            self.remove_substvar(name, package)
 
+        filename = self.get_substvars_file(package)
         line = "%s=%s" % (name, value)
         self.print_cmd(["echo", line, ">>", filename])
         if not self.options.no_act:
@@ -297,6 +396,23 @@ class DHCommon:
             for p in paths:
                 f.write("%s\n" % p)
 
+    def index_installed_files(self, package, paths, component=None):
+        if self.options.no_act:
+            return
+        self._installed_files.extend(
+            (p, package, component or "", self.tool_name) for p in paths)
+
+    def write_installed_files_index(self):
+        if not self._installed_files:
+            return
+        os.makedirs(os.path.dirname(INSTALLED_FILES_INDEX), exist_ok=True)
+        fileindex.update_index(INSTALLED_FILES_INDEX, self._installed_files)
+        self._installed_files = []
+
+    def start_background_work(self):
+        # Anything that should outlive the command, once it is done
+        pass
+
     def do_cmake_install(self, builddir, package, component=None, subdir=None,
                          extra_args=None):
         build_subdir = builddir
@@ -315,14 +431,14 @@ class DHCommon:
             install_manifest = "install_manifest_%s.txt" % component
         else:
             install_manifest = "install_manifest.txt"
-        have_manifest = True
         try:
             with open(os.path.join(builddir, install_manifest)) as f:
-                files = [os.path.join(self.options.sourcedir,
-                                      os.path.relpath(l.rstrip("\n"), "/"))
-                         for l in f]
+                installed = [os.path.relpath(l.rstrip("\n"), "/") for l in f]
         except FileNotFoundError:
-            have_manifest = False
-        if have_manifest:
-            os.unlink(os.path.join(builddir, install_manifest))
-            self.log_installed_files(package, files)
+            return []
+        os.unlink(os.path.join(builddir, install_manifest))
+        self.log_installed_files(
+            package, [os.path.join(self.options.sourcedir, p)
+                      for p in installed])
+        self.index_installed_files(package, installed, component)
+        return installed
@@ -0,0 +1,88 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import heapq
+
+
+def read_cost_data(f):
+    costs = {}
+    failed = set()
+
+    lines = iter(f)
+    for line in lines:
+        line = line.rstrip("\n")
+        if line == "---":
+            break
+        fields = line.rsplit(" ", 2)
+        if len(fields) != 3:
+            continue
+        name, runs, cost = fields
+        try:
+            costs[name] = (int(runs), float(cost))
+        except ValueError:
+            continue
+
+    for line in lines:
+        name = line.rstrip("\n")
+        if name:
+            failed.add(name)
+
+    return costs, failed
+
+
+def write_cost_data(f, costs, failed):
+    for name, (runs, cost) in costs.items():
+        f.write("%s %i %g\n" % (name, runs, cost))
+    f.write("---\n")
+    for name in sorted(failed):
+        f.write("%s\n" % name)
+
+
+def merge_cost_data(cost_data):
+    # Every copy started from the same history, so the copy that actually
+    # ran a test is the one with the most runs
+    costs = {}
+    failed = set()
+    for c, f in cost_data:
+        for name, (runs, cost) in c.items():
+            if name not in costs or runs > costs[name][0]:
+                costs[name] = (runs, cost)
+        failed |= f
+
+    return costs, failed
+
+
+def get_cost(costs, test):
+    return costs.get(test, (0, 0.0))[1]
+
+
+def select_for_budget(tests, costs, failed, budget):
+    # Previously failing tests first, then tests that have never run, then
+    # the rest from cheapest to most expensive
+    def priority(test):
+        return (test not in failed, test in costs, get_cost(costs, test))
+
+    total = 0.0
+    selected = set()
+    for test in sorted(tests, key=priority):
+        cost = get_cost(costs, test)
+        if total + cost <= budget:
+            selected.add(test)
+            total += cost
+
+    return ([t for t in tests if t in selected],
+            [t for t in tests if t not in selected])
+
+
+def assign_shards(tests, costs, count):
+    # Longest processing time first: each test goes to the shard with the
+    # least total cost so far, and ties go to the shard with fewer tests
+    loads = [(0.0, 0, i) for i in range(count)]
+    assignment = {}
+    for test in sorted(tests, key=lambda t: (-get_cost(costs, t), t)):
+        load, size, i = heapq.heappop(loads)
+        assignment[test] = i
+        heapq.heappush(loads, (load + get_cost(costs, test), size + 1, i))
+
+    return [[t for t in tests if assignment[t] == i] for i in range(count)]
@@ -2,17 +2,60 @@
 # BSD 3-Clause license. See top-level LICENSE file or
 # https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
 
+import concurrent.futures
+import hashlib
 import json
+import os
 import os.path
 import re
 
-from dhcmake import common
+from dhcmake import common, elf, metadata
+
+
+CPACK_METADATA_DIR = "debian/.cpack"
+CPACK_METADATA_FILE = os.path.join(CPACK_METADATA_DIR, "cpack-metadata.json")
+CPACK_FLAVOR_DEPENDENCIES_FILE = "debian/cpack-flavor-dependencies"
+CPACK_SUBSTVARS_STATE_FILE = os.path.join(CPACK_METADATA_DIR,
+                                          "substvars-state.json")
+
+
+def format_cpack_depends(packages):
+    return ", ".join(p + " (= ${binary:Version})" for p in sorted(packages))
+
+
+def fingerprint_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 
 class DHCPack(common.DHCommon):
     def read_cpack_metadata(self):
-        with open("debian/.cpack/cpack-metadata.json", "r") as f:
-            self.cpack_metadata = json.load(f)
+        self.cpack_metadata = metadata.load(
+            CPACK_METADATA_FILE, write_sidecar=not self.options.no_act)
+
+    def get_flavors(self):
+        flavors = []
+        for flavor in self.options.flavor or []:
+            name, sep, builddir = flavor.partition("=")
+            if not sep or not name or not builddir or ":" in name:
+                raise ValueError("Invalid flavor: %s" % flavor)
+            flavors.append((name, builddir))
+        return flavors
+
+    def get_cpack_flavor_dependencies(self):
+        dependencies = {}
+        try:
+            with open(CPACK_FLAVOR_DEPENDENCIES_FILE, "r") as f:
+                for l in f:
+                    if not re.search("^\\s*($|#)", l):
+                        component, *deps = l.split()
+                        dependencies.setdefault(component, []).extend(deps)
+        except FileNotFoundError:
+            pass
+        return dependencies
 
     def get_cpack_components(self, package):
         opened_file = self.read_package_file(package, "cpack-components")
@@ -22,7 +65,7 @@ class DHCPack(common.DHCommon):
                 for l in f:
                     if not re.search("^($|#)", l):
                         group = l.rstrip()
-                        if group in self.cpack_metadata["components"]:
+                        if group in self.cpack_metadata.components:
                             retval.append(group)
                         else:
                             raise ValueError(
@@ -39,7 +82,7 @@ class DHCPack(common.DHCommon):
                 for l in f:
                     if not re.search("^($|#)", l):
                         group = l.rstrip()
-                        if group in self.cpack_metadata["componentGroups"]:
+                        if group in self.cpack_metadata.component_groups:
                             retval.append(group)
                         else:
                             raise ValueError(
@@ -57,10 +100,10 @@ class DHCPack(common.DHCommon):
             return set()
         visited.add(group)
 
-        all_components = set(self.cpack_metadata["componentGroups"][group]
-                             ["components"])
+        component_group = self.cpack_metadata.component_groups[group]
+        all_components = set(component_group.components)
 
-        for sub_group in self.cpack_metadata["componentGroups"][group]["subgroups"]:
+        for sub_group in component_group.subgroups:
             all_components.update(
                 self.get_all_cpack_components_for_group(
                     sub_group, visited))
@@ -76,70 +119,258 @@ class DHCPack(common.DHCommon):
 
         return all_components
 
-    def get_package_dependencies(self, package):
+    def get_component_dependencies(self, package):
         deps = set()
 
         for component in self.get_all_cpack_components(package):
-            for component_dep in self.cpack_metadata["components"][component]["dependencies"]:
-                for other_package in self.get_packages():
-                    if component_dep in \
-                            self.get_all_cpack_components(other_package):
-                        deps.add(other_package)
+            deps.update(self.cpack_metadata.components[component].dependencies)
 
         return deps
 
-    @common.DHEntryPoint("dh_cpack_generate")
-    def generate(self, args=None):
-        self.parse_args(args)
+    def get_component_owners(self):
+        owners = {}
+
+        for package in self.get_packages():
+            for component in self.get_all_cpack_components(package):
+                owners.setdefault(component, set()).add(package)
+
+        return owners
+
+    def get_package_dependencies(self, package, owners=None):
+        if owners is None:
+            owners = self.get_component_owners()
+
+        deps = set()
+
+        for component_dep in self.get_component_dependencies(package):
+            deps.update(owners.get(component_dep, ()))
+
+        return deps
+
+    def get_package_config_fingerprint(self, package):
+        config = [self.get_cpack_components(package),
+                  self.get_cpack_component_groups(package)]
+        return hashlib.sha256(json.dumps(config).encode("utf-8")).hexdigest()
+
+    def read_substvars_state(self):
+        try:
+            with open(CPACK_SUBSTVARS_STATE_FILE, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
 
+    def write_substvars_state(self, state):
+        if not self.options.no_act:
+            with open(CPACK_SUBSTVARS_STATE_FILE, "w") as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+
+    def flavor_make_arg_parser(self, parser):
+        self.make_arg_parser(parser)
+        parser.add_argument(
+            "--flavor", action="append",
+            help="Use the build directory of a flavor, in the form "
+                 "NAME=BUILDDIR (may be given more than once)")
+
+    def run_cpack_external(self, builddir, outputdir):
         cmd_args = [
             "cpack",
             "--config",
-            os.path.join(self.get_build_directory(), "CPackConfig.cmake"),
+            os.path.join(builddir, "CPackConfig.cmake"),
             "-G", "External",
             "-D", "CPACK_PACKAGE_FILE_NAME=cpack-metadata",
             "-D", "CPACK_EXT_REQUESTED_VERSIONS=1.0",
-            "-B", "debian/.cpack",
+            "-B", outputdir,
         ]
         self.do_cmd(cmd_args)
 
+    def merge_flavor_metadata(self, flavors):
+        flavor_data = []
+        for name, _ in flavors:
+            with open(os.path.join(CPACK_METADATA_DIR, name,
+                                   "cpack-metadata.json"), "r") as f:
+                flavor_data.append((name, json.load(f)))
+
+        merged = metadata.merge_json_data(
+            flavor_data, self.get_cpack_flavor_dependencies())
+        with open(CPACK_METADATA_FILE, "w") as f:
+            json.dump(merged, f, indent=2, sort_keys=True)
+
+    @common.DHEntryPoint("dh_cpack_generate", record_history=True)
+    def generate(self, args=None):
+        self.parse_args(args, make_arg_parser=self.flavor_make_arg_parser)
+        flavors = self.get_flavors()
+
+        try:
+            os.unlink(metadata.get_sidecar_path(CPACK_METADATA_FILE))
+        except FileNotFoundError:
+            pass
+
+        if flavors:
+            with concurrent.futures.ThreadPoolExecutor(len(flavors)) \
+                    as executor:
+                futures = [
+                    executor.submit(self.run_cpack_external, builddir,
+                                    os.path.join(CPACK_METADATA_DIR, name))
+                    for name, builddir in flavors
+                ]
+                for future in futures:
+                    future.result()
+
+            if not self.options.no_act:
+                self.merge_flavor_metadata(flavors)
+        else:
+            self.run_cpack_external(self.get_build_directory(),
+                                    CPACK_METADATA_DIR)
+
+        if not self.options.no_act:
+            self.read_cpack_metadata()
+
     @common.DHEntryPoint("dh_cpack_substvars")
     def substvars(self, args=None):
         self.parse_args(args)
         self.read_cpack_metadata()
 
+        metadata_fingerprint = fingerprint_file(CPACK_METADATA_FILE)
+        old_state = self.read_substvars_state()
+        if old_state.get("metadata") == metadata_fingerprint:
+            old_packages = old_state["packages"]
+        else:
+            old_packages = {}
+
+        packages = {}
         for package in self.get_packages():
-            depends = ", ".join(dep + " (= ${binary:Version})" for dep in
-                                sorted(self.get_package_dependencies(package)))
-            if depends:
-                self.write_substvar("cpack:Depends", depends, package)
+            packages[package] = {
+                "config": self.get_package_config_fingerprint(package),
+                "components": sorted(self.get_all_cpack_components(package)),
+            }
+
+        changed_components = set()
+        for package in set(packages) | set(old_packages):
+            old = old_packages.get(package, {})
+            new = packages.get(package, {})
+            if old.get("config") != new.get("config"):
+                changed_components.update(old.get("components", ()))
+                changed_components.update(new.get("components", ()))
+
+        owners = None
+        for package, new in packages.items():
+            old = old_packages.get(package)
+            if old is not None and old["config"] == new["config"] and \
+                    changed_components.isdisjoint(
+                        old["component_dependencies"]):
+                new["component_dependencies"] = old["component_dependencies"]
+                new["depends"] = old["depends"]
+                if new["depends"] and self.read_substvar(
+                        "cpack:Depends", package) != new["depends"]:
+                    self.write_substvar("cpack:Depends", new["depends"],
+                                        package, replace=True)
+                continue
+
+            if owners is None:
+                owners = self.get_component_owners()
+            new["component_dependencies"] = sorted(
+                self.get_component_dependencies(package))
+            new["depends"] = format_cpack_depends(
+                self.get_package_dependencies(package, owners))
+            if new["depends"]:
+                self.write_substvar("cpack:Depends", new["depends"], package,
+                                    replace=True)
+            elif self.read_substvar("cpack:Depends", package) is not None:
+                self.remove_substvar("cpack:Depends", package)
+
+        self.write_substvars_state({
+            "metadata": metadata_fingerprint,
+            "packages": packages,
+        })
+
+    def infer_elf_dependencies(self, installed):
+        owners = {}
+        for package, components in installed.items():
+            tmpdir = self.get_tmpdir(package)
+            for component, files in components.items():
+                for f in files:
+                    path = os.path.join(tmpdir, f)
+                    if os.path.isfile(path) and not os.path.islink(path):
+                        owners[path] = (package, component)
+
+        objects = elf.scan(owners)
+
+        providers = {}
+        for path, (soname, _) in objects.items():
+            providers[soname or os.path.basename(path)] = owners[path]
+
+        inferred = {}
+        for path, (_, needed) in objects.items():
+            package, component = owners[path]
+            package_deps = inferred.setdefault(package, {})
+            for soname in needed:
+                try:
+                    other_package, other_component = providers[soname]
+                except KeyError:
+                    continue
+                if other_package != package:
+                    package_deps.setdefault(other_package, set()).add(
+                        "%s (%s) needs %s (%s)" % (
+                            os.path.basename(path), component, soname,
+                            other_component))
+
+        return inferred
+
+    def check_elf_dependencies(self, installed):
+        owners = self.get_component_owners()
+        for package, inferred in sorted(
+                self.infer_elf_dependencies(installed).items()):
+            declared = self.get_package_dependencies(package, owners) - \
+                {package}
+            missing = set(inferred) - declared
+
+            for dep in sorted(missing):
+                for reason in sorted(inferred[dep]):
+                    print("%s: warning: %s: dependency on %s is not declared "
+                          "in CPack: %s" % (self.tool_name, package, dep,
+                                            reason),
+                          file=self.stderr)
+            if self.options.elf_depends == "warn":
+                for dep in sorted(declared - set(inferred)):
+                    print("%s: warning: %s: declared dependency on %s is not "
+                          "needed by any ELF object" %
+                          (self.tool_name, package, dep), file=self.stderr)
+            elif missing:
+                self.write_substvar("cpack:Depends",
+                                    format_cpack_depends(declared | missing),
+                                    package, replace=True)
 
     def install_make_arg_parser(self, parser):
-        self.make_arg_parser(parser)
+        self.flavor_make_arg_parser(parser)
         parser.add_argument(
             "--sourcedir", action="store",
             help="Source directory for installation (not used except to notify"
                  " dh_missing)",
             default="debian/tmp")
+        parser.add_argument(
+            "--elf-depends", action="store", choices=["add", "warn"],
+            help="Infer dependencies between packages from the DT_NEEDED "
+                 "entries of the installed ELF objects, and either add them "
+                 "to ${cpack:Depends} or warn about differences")
 
-    @common.DHEntryPoint("dh_cpack_install")
+    @common.DHEntryPoint("dh_cpack_install", record_history=True)
     def install(self, args=None):
         self.parse_args(args, make_arg_parser=self.install_make_arg_parser)
         self.read_cpack_metadata()
+        flavor_builddirs = dict(self.get_flavors())
+        installed = {}
 
         for package in self.get_packages():
             for component in self.get_all_cpack_components(package):
-                for project in self.cpack_metadata["projects"]:
-                    if component in project["components"]:
+                for project in self.cpack_metadata.projects:
+                    if component in project.components:
                         extra_args = []
 
-                        try:
+                        if project.build_type is not None:
                             extra_args.extend([
                                 "--config",
-                                self.cpack_metadata["buildType"]
+                                project.build_type
                             ])
-                        except KeyError:
-                            pass
 
                         # TODO Fix this in CMake (https://gitlab.kitware.com/cmake/cmake/-/issues/20700)
                         # try:
@@ -151,13 +382,21 @@ class DHCPack(common.DHCommon):
                         # except KeyError:
                         #    pass
 
-                        if self.cpack_metadata["stripFiles"]:
+                        if project.strip_files:
                             extra_args.append("--strip")
 
-                        self.do_cmake_install(
-                            project["directory"], package,
-                            component=component,
+                        files = self.do_cmake_install(
+                            flavor_builddirs.get(project.flavor,
+                                                 project.directory),
+                            package,
+                            component=project.get_install_component(
+                                component),
                             extra_args=extra_args)
+                        installed.setdefault(package, {}).setdefault(
+                            component, []).extend(files)
+
+        if self.options.elf_depends and not self.options.no_act:
+            self.check_elf_dependencies(installed)
 
 
 def generate():
@@ -2,11 +2,45 @@
 # BSD 3-Clause license. See top-level LICENSE file or
 # https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
 
+import concurrent.futures
+import contextlib
+import debian.deb822
+import json
 import os.path
 import pkg_resources
 import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 
-from dhcmake import common
+from dhcmake import arch, ccache, cdash, checkcache, common, costdata, deb822
+from dhcmake import gcov, history, ninjalog, resourcespec, rusage, spool
+from dhcmake import testcache
+from dhcmake import testoutput, testxml
+
+
+CTEST_COST_DATA_FILE = "Testing/Temporary/CTestCostData.txt"
+CTEST_LAST_TESTS_FAILED_FILE = "Testing/Temporary/LastTestsFailed%s.log"
+
+# Number of previous builds whose peak memory use is remembered
+BUILD_MEMORY_HISTORY = 5
+
+RUN_STEPS = ["start", "update", "configure", "build", "test", "coverage",
+             "submit"]
+
+STEP_COMMANDS = {
+    "configure": "dh_auto_configure",
+    "build": "dh_auto_build",
+}
+
+# The commands whose history dh_ctest_run records its steps under
+HISTORY_TOOLS = {
+    "configure": "dh_ctest_configure",
+    "build": "dh_ctest_build",
+    "test": "dh_ctest_test",
+}
 
 
 def format_arg_for_ctest(arg):
@@ -69,7 +103,161 @@ def get_deb_ctest_option(name):
     return None
 
 
+def _remove_option(args, name):
+    result = []
+    args = iter(args)
+    for arg in args:
+        if arg == "--":
+            result.append(arg)
+            result.extend(args)
+        elif arg == name:
+            next(args, None)
+        elif not arg.startswith(name + "="):
+            result.append(arg)
+    return result
+
+
+def _add_cmake_args(args, cmake_args):
+    # dh_auto_configure passes everything after "--" on to cmake
+    if not cmake_args:
+        return list(args)
+    if "--" in args:
+        return [*args, *cmake_args]
+    return [*args, "--", *cmake_args]
+
+
+def _add_dh_args(args, dh_args):
+    # Options for the dh_auto_* command itself go before "--"
+    if "--" in args:
+        index = args.index("--")
+        return [*args[:index], *dh_args, *args[index:]]
+    return [*args, *dh_args]
+
+
+def _get_deb_build_options():
+    try:
+        deb_build_options = os.environ["DEB_BUILD_OPTIONS"]
+    except KeyError:
+        return []
+
+    return [o for o in re.split("[\\s,]+", deb_build_options) if o]
+
+
+def _parse_positive_int(value, description):
+    if not isinstance(value, str) or not re.match("^[1-9][0-9]*$", value):
+        raise ValueError("Invalid %s: %s" % (description, value))
+    return int(value)
+
+
+def _get_deb_build_parallel():
+    level = None
+    for item in _get_deb_build_options():
+        eq_split = item.split("=", 1)
+        if eq_split[0] == "parallel" and len(eq_split) > 1:
+            level = eq_split[1]
+    return level
+
+
+def get_parallel_level():
+    level = get_deb_ctest_option("parallel")
+    if level is None:
+        level = _get_deb_build_parallel()
+
+    if level is None:
+        return None
+    return _parse_positive_int(level, "parallel level")
+
+
+def get_build_parallel_level():
+    level = _get_deb_build_parallel()
+    if level is None:
+        return None
+    return _parse_positive_int(level, "parallel level")
+
+
+def get_build_job_memory():
+    memory = get_deb_ctest_option("buildmemory")
+    if memory is None or memory is True:
+        return memory
+    return _parse_positive_int(memory, "build job memory")
+
+
+def get_coverage_job_memory():
+    memory = get_deb_ctest_option("coverage")
+    if memory is None or memory is True:
+        return None
+    return _parse_positive_int(memory, "coverage job memory")
+
+
+def get_output_size(status):
+    size = get_deb_ctest_option(status + "outputsize")
+    if size is None:
+        return None
+    return _parse_positive_int(size, "%s test output size" % status)
+
+
+def get_budget():
+    budget = get_deb_ctest_option("budget")
+    if budget is None:
+        return None
+
+    try:
+        if not isinstance(budget, str):
+            raise ValueError
+        value = float(budget)
+        if not value > 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Invalid test budget: %s" % budget)
+    return value
+
+
+def parse_ctest_version(text):
+    match = re.match("ctest version ([0-9]+)\\.([0-9]+)", text)
+    if not match:
+        raise ValueError("Could not read the CTest version")
+    return int(match.group(1)), int(match.group(2))
+
+
+def get_shards():
+    shards = get_deb_ctest_option("shards")
+    shard = get_deb_ctest_option("shard")
+    if shards is None:
+        if shard is not None:
+            raise ValueError("shard requires shards")
+        return None
+
+    count = _parse_positive_int(shards, "shard count")
+    if shard is None:
+        return count, None
+
+    index = _parse_positive_int(shard, "shard")
+    if index > count:
+        raise ValueError("Invalid shard: %s" % shard)
+    return count, index
+
+
 class DHCTest(common.DHCommon):
+    def __init__(self):
+        super().__init__()
+        self._ctest_version = None
+        self._spooled = False
+        self._ccache_stats = None
+
+    def get_ctest_version(self):
+        if self._ctest_version is None:
+            result = subprocess.run(["ctest", "--version"],
+                                    stdout=subprocess.PIPE, check=True,
+                                    universal_newlines=True)
+            self._ctest_version = parse_ctest_version(result.stdout)
+        return self._ctest_version
+
+    def require_ctest_version(self, option, version):
+        found = self.get_ctest_version()
+        if found < version:
+            raise ValueError("%s requires CTest %i.%i or newer, found %i.%i"
+                             % (option, *version, *found))
+
     def make_arg_parser(self, parser):
         super().make_arg_parser(parser)
 
@@ -92,61 +280,1089 @@ class DHCTest(common.DHCommon):
         return pkg_resources.resource_filename(__name__,
                                                "dh_ctest_driver.cmake")
 
-    def do_ctest_step(self, step, cmd=None):
+    def do_ctest_step(self, step, cmd=None, ctest_args=None,
+                      ctest_testing_dir=None):
+        return self.do_ctest_steps([(step, cmd)], ctest_args=ctest_args,
+                                   ctest_testing_dir=ctest_testing_dir)
+
+    def do_ctest_steps(self, steps, ctest_args=None, ctest_testing_dir=None):
+        if not steps:
+            return False
+
         dashboard_model = get_deb_ctest_option("model")
         if dashboard_model is None:
-            if cmd is not None:
-                self.do_cmd([cmd, *self.parsed_args])
+            for step, cmd in steps:
+                if cmd is not None:
+                    self.do_cmd(self.get_step_command(step, cmd))
             return False
         else:
-            args = [
-                "ctest", "-VV", "-S", self.get_dh_ctest_driver(),
-                "-DDH_CTEST_SRCDIR:PATH=" + os.getcwd(),
-                "-DDH_CTEST_CTESTDIR:PATH=" + os.path.join(
-                    os.getcwd(), self.options.ctest_testing_dir),
-                "-DDH_CTEST_BUILDDIR:PATH=" + self.get_build_directory(),
-                "-DDH_CTEST_DASHBOARD_MODEL:STRING=" + dashboard_model,
-                "-DDH_CTEST_STEP:STRING=" + step,
-            ]
-            if cmd:
-                args.append("-DDH_CTEST_RUN_CMD:STRING="
-                            + format_args_for_ctest([cmd, *self.parsed_args]))
-            if get_deb_ctest_option("submit") and not self.options.no_submit:
-                args.append("-DDH_CTEST_STEP_SUBMIT:BOOL=ON")
-
-            site = get_deb_ctest_option("site")
-            if isinstance(site, str):
-                args.append("-DDH_CTEST_SITE:STRING=" + site)
-
-            track = get_deb_ctest_option("track")
-            if isinstance(track, str):
-                args.append("-DDH_CTEST_TRACK:STRING=" + track)
-
-            revision = get_deb_ctest_option("revision")
-            if isinstance(revision, str):
-                args.append("-DDH_CTEST_VERSION_OVERRIDE:STRING=" + revision)
-
-            build = get_deb_ctest_option("build")
-            if self.options.ctest_build:
-                build = self.options.ctest_build
-            if self.options.ctest_build_suffix:
-                build += self.options.ctest_build_suffix
-            if isinstance(build, str):
-                args.append("-DDH_CTEST_BUILD:STRING=" + build)
-
-            catchfailed = "0"
-            if get_deb_ctest_option("catchfailed"):
-                catchfailed = "1"
-            args.append("-DDH_CTEST_CATCHFAILED:BOOL=" + catchfailed)
-
-            if step == "submit" and self.options.parts:
+            args = self.get_ctest_step_args(steps, dashboard_model,
+                                            ctest_testing_dir)
+
+            if any(s == "submit" for s, c in steps) and \
+                    getattr(self.options, "parts", None):
                 args.append("-DDH_CTEST_SUBMIT_PARTS:STRING=" +
                             ";".join(self.options.parts))
 
+            if ctest_args:
+                args.extend(ctest_args)
             args.extend(self.options.extra_args)
+            if any(s not in ("submit", "submit_url") for s, c in steps):
+                self._spooled = True
             self.do_cmd(args)
             return True
 
+    def get_configure_cmake_args(self):
+        args = []
+        if get_deb_ctest_option("rusage"):
+            args.append("-DCMAKE_PROJECT_INCLUDE:FILEPATH=" +
+                        pkg_resources.resource_filename(
+                            __name__, "dh_ctest_rusage_project.cmake"))
+
+        ccache_env = self.get_ccache_environment()
+        if ccache_env is not None:
+            launcher = ";".join(ccache.get_launcher(ccache_env))
+            for lang in ccache.LANGUAGES:
+                args.append("-DCMAKE_%s_COMPILER_LAUNCHER:STRING=%s"
+                            % (lang, launcher))
+
+        check_cache = self.get_check_cache_file()
+        if check_cache is not None and os.path.exists(check_cache):
+            args.extend(["-C", check_cache])
+        return args
+
+    def get_step_command(self, step, cmd):
+        if step == "configure":
+            return [cmd, *_add_cmake_args(self.parsed_args,
+                                          self.get_configure_cmake_args())]
+        if step == "build":
+            args = [cmd, *self.parsed_args]
+            jobs = self.select_build_jobs()
+            if jobs is not None:
+                args = [cmd, *_add_dh_args(self.parsed_args,
+                                           ["--max-parallel=%i" % jobs])]
+            if self.get_build_memory_file() is not None and \
+                    get_deb_ctest_option("buildmemory") is not None:
+                args = [*self.get_build_rusage_launcher(), *args]
+            return args
+        return [cmd, *self.parsed_args]
+
+    def get_ctest_step_args(self, steps, dashboard_model,
+                            ctest_testing_dir=None):
+        if ctest_testing_dir is None:
+            ctest_testing_dir = self.options.ctest_testing_dir
+        args = ["ctest", "-VV"]
+        # Test output goes to the dashboard, and to the output directory,
+        # so don't show it here. The output of the failed tests is printed
+        # from Test.xml afterwards.
+        if get_deb_ctest_option("quiet") and \
+                all(s in ("test", "test_merged") for s, c in steps):
+            args = ["ctest", "--output-on-failure"]
+        args += [
+            "-S", self.get_dh_ctest_driver(),
+            "-DDH_CTEST_SRCDIR:PATH=" + os.getcwd(),
+            "-DDH_CTEST_CTESTDIR:PATH=" + os.path.join(
+                os.getcwd(), ctest_testing_dir),
+            "-DDH_CTEST_BUILDDIR:PATH=" + self.get_build_directory(),
+            "-DDH_CTEST_DASHBOARD_MODEL:STRING=" + dashboard_model,
+            "-DDH_CTEST_STEP:STRING=" + ";".join(s for s, c in steps),
+        ]
+        for step, cmd in steps:
+            if cmd:
+                args.append("-DDH_CTEST_RUN_CMD_%s:STRING=" % step
+                            + format_args_for_ctest(
+                                self.get_step_command(step, cmd)))
+        if get_deb_ctest_option("submit") and not self.options.no_submit:
+            args.append("-DDH_CTEST_STEP_SUBMIT:BOOL=ON")
+            if get_deb_ctest_option("spool"):
+                args.append("-DDH_CTEST_SPOOL_DIR:PATH=" +
+                            os.path.abspath(self.get_spool_directory()))
+
+        site = get_deb_ctest_option("site")
+        if isinstance(site, str):
+            args.append("-DDH_CTEST_SITE:STRING=" + site)
+
+        track = get_deb_ctest_option("track")
+        if isinstance(track, str):
+            args.append("-DDH_CTEST_TRACK:STRING=" + track)
+
+        revision = get_deb_ctest_option("revision")
+        if isinstance(revision, str):
+            args.append("-DDH_CTEST_VERSION_OVERRIDE:STRING=" + revision)
+
+        build = get_deb_ctest_option("build")
+        if self.options.ctest_build:
+            build = self.options.ctest_build
+        if self.options.ctest_build_suffix:
+            build += self.options.ctest_build_suffix
+        if isinstance(build, str):
+            args.append("-DDH_CTEST_BUILD:STRING=" + build)
+
+        catchfailed = "0"
+        if get_deb_ctest_option("catchfailed"):
+            catchfailed = "1"
+        args.append("-DDH_CTEST_CATCHFAILED:BOOL=" + catchfailed)
+
+        if get_deb_ctest_option("failfast"):
+            self.require_ctest_version("failfast", (3, 18))
+            args.append("-DDH_CTEST_STOP_ON_FAILURE:BOOL=ON")
+
+        if any(s == "coverage" for s, c in steps):
+            args += [
+                "-DDH_CTEST_COVERAGE_COMMAND:FILEPATH=" + sys.executable,
+                "-DDH_CTEST_COVERAGE_EXTRA_FLAGS:STRING=" + " ".join(
+                    "\"%s\"" % a for a in [
+                        pkg_resources.resource_filename(__name__,
+                                                        "gcov.py"),
+                        os.path.abspath(self.get_coverage_directory()),
+                        gcov.GCOV_COMMAND,
+                    ]),
+            ]
+
+        for status in ["passed", "failed"]:
+            output_size = get_output_size(status)
+            if output_size is not None:
+                args.append("-DDH_CTEST_%s_OUTPUT_SIZE:STRING=%i"
+                            % (status.upper(), output_size))
+
+        notes_files = self.get_notes_files(
+            os.path.join(ctest_testing_dir, "notes"))
+        if notes_files:
+            args.append("-DDH_CTEST_NOTES_FILES:STRING=" +
+                        ";".join(notes_files))
+
+        return args
+
+    def get_spool_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "spool")
+
+    def get_spool_submit_args(self, ctest_testing_dir=None):
+        return [*self.get_ctest_step_args([("submit", None)],
+                                          get_deb_ctest_option("model"),
+                                          ctest_testing_dir),
+                "-DDH_CTEST_SUBMIT_SPOOLED:BOOL=ON"]
+
+    def snapshot_testing_directory(self, spool_dir):
+        tag = self.read_tag(self.options.ctest_testing_dir)
+        if tag is None:
+            return None
+
+        snapshot = tempfile.mkdtemp(prefix=".testing-", dir=spool_dir)
+        testing_dir = os.path.join(self.options.ctest_testing_dir, "Testing")
+        os.mkdir(os.path.join(snapshot, "Testing"))
+        shutil.copyfile(os.path.join(testing_dir, "TAG"),
+                        os.path.join(snapshot, "Testing", "TAG"))
+        if os.path.exists(os.path.join(testing_dir, tag[0])):
+            shutil.copytree(os.path.join(testing_dir, tag[0]),
+                            os.path.join(snapshot, "Testing", tag[0]))
+        if os.path.exists(self.get_notes_directory()):
+            shutil.copytree(self.get_notes_directory(),
+                            os.path.join(snapshot, "notes"))
+        return snapshot
+
+    def start_spool_worker(self):
+        spool_dir = self.get_spool_directory()
+        if self.options.no_act or not spool.list_parts(spool_dir):
+            return
+
+        # The worker submits from a copy of the results, so that it never
+        # gets in the way of the steps that run after it started
+        snapshot = self.snapshot_testing_directory(spool_dir)
+        if snapshot is None:
+            return
+        spool.tag_parts(spool_dir, os.path.basename(snapshot))
+        spool.start_worker(spool_dir, [
+            sys.executable,
+            pkg_resources.resource_filename(__name__, "spool.py"),
+            os.path.abspath(spool_dir), os.path.basename(snapshot),
+            *self.get_spool_submit_args(os.path.abspath(snapshot))])
+
+    def start_background_work(self):
+        super().start_background_work()
+        if self._spooled:
+            self._spooled = False
+            self.start_spool_worker()
+
+    def replay_spool(self):
+        spool_dir = self.get_spool_directory()
+        if self.options.no_act or not os.path.exists(spool_dir):
+            return
+
+        args = self.get_spool_submit_args()
+
+        def submit(part):
+            self.do_cmd([*args, "-DDH_CTEST_SUBMIT_PARTS:STRING=" + part])
+            return True
+
+        # Waits for the background worker to finish, then submits whatever
+        # it could not
+        with spool.lock(spool_dir):
+            spool.drain(spool_dir, submit)
+
+    def get_notes_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "notes")
+
+    def write_note(self, path, lines):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for line in lines:
+                f.write("%s\n" % line)
+
+    def get_notes_files(self, notes_dir=None):
+        if notes_dir is None:
+            notes_dir = self.get_notes_directory()
+        try:
+            names = sorted(os.listdir(notes_dir))
+        except FileNotFoundError:
+            return []
+
+        return [os.path.abspath(os.path.join(notes_dir, n)) for n in names]
+
+    def get_cost_data_file(self):
+        if get_deb_ctest_option("model") is None:
+            return os.path.join(self.get_build_directory(),
+                                CTEST_COST_DATA_FILE)
+        else:
+            return os.path.join(self.options.ctest_testing_dir,
+                                CTEST_COST_DATA_FILE)
+
+    def get_cached_cost_data_file(self):
+        cache_dir = self.get_cache_directory()
+        if cache_dir is None:
+            return None
+        return os.path.join(cache_dir, "ctest", "CTestCostData.txt")
+
+    def import_cost_data(self):
+        cached = self.get_cached_cost_data_file()
+        cost_data = self.get_cost_data_file()
+        if cached is None or not os.path.exists(cached) \
+                or os.path.exists(cost_data):
+            return
+
+        self.do_cmd(["mkdir", "-p", os.path.dirname(cost_data)])
+        self.do_cmd(["cp", cached, cost_data])
+
+    def export_cost_data(self):
+        cached = self.get_cached_cost_data_file()
+        cost_data = self.get_cost_data_file()
+        if cached is None or not os.path.exists(cost_data):
+            return
+
+        self.do_cmd(["mkdir", "-p", os.path.dirname(cached)])
+        self.do_cmd(["cp", cost_data, cached + ".tmp"])
+        self.do_cmd(["mv", cached + ".tmp", cached])
+
+    def get_check_cache_directory(self):
+        option = get_deb_ctest_option("checkcache")
+        if option is None:
+            return None
+
+        if option is True:
+            cache_dir = self.get_cache_directory()
+            if cache_dir is None:
+                return None
+            return os.path.join(cache_dir, "ctest", "checks")
+        return os.path.abspath(option)
+
+    def get_build_depends_versions(self):
+        with open("debian/control", "r") as f:
+            source, packages = deb822.read_control(f)
+
+        names = set(checkcache.TOOLCHAIN_PACKAGES)
+        for field in ["Build-Depends", "Build-Depends-Arch",
+                      "Build-Depends-Indep"]:
+            deps = source.get(field)
+            if deps:
+                for dep in debian.deb822.PkgRelation.parse_relations(deps):
+                    names.update(subdep["name"] for subdep in dep)
+
+        # Packages that are not installed are simply left out
+        proc = subprocess.run(
+            ["dpkg-query", "-W", "-f", "${binary:Package}\t${Version}\n",
+             *sorted(names)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+        versions = {}
+        for line in proc.stdout.splitlines():
+            name, _, version = line.partition("\t")
+            if version:
+                versions[name] = version
+        return versions
+
+    def get_build_environment(self):
+        arch_values = arch.dpkg_architecture()
+        buildflags = subprocess.run(
+            ["dpkg-buildflags"], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+        return {
+            "arch": {v: arch_values.get(v)
+                     for v in checkcache.ARCH_VARIABLES},
+            "toolchain": {v: os.environ.get(v)
+                          for v in checkcache.TOOLCHAIN_VARIABLES},
+            "buildflags": buildflags.splitlines(),
+            "packages": self.get_build_depends_versions(),
+        }
+
+    def get_check_cache_key(self):
+        return checkcache.get_key({
+            **self.get_build_environment(),
+            "args": self.parsed_args,
+        })
+
+    def get_check_cache_file(self):
+        directory = self.get_check_cache_directory()
+        if directory is None:
+            return None
+        return checkcache.get_check_cache_file(directory,
+                                               self.get_check_cache_key())
+
+    def save_check_cache(self):
+        path = self.get_check_cache_file()
+        build_dir = self.get_build_directory()
+        if path is None or self.options.no_act or \
+                not checkcache.configure_succeeded(build_dir):
+            return
+
+        with open(os.path.join(build_dir, "CMakeCache.txt"), "r") as f:
+            entries = checkcache.read_cmake_cache(f)
+        results = checkcache.select_check_results(
+            entries, exclude=[os.getcwd(), os.path.abspath(build_dir)])
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write(checkcache.format_initial_cache(results))
+        os.replace(path + ".tmp", path)
+
+        # Results for any other key are out of date now
+        for name in os.listdir(directory):
+            other = os.path.join(directory, name)
+            if name.endswith(checkcache.CHECK_CACHE_SUFFIX) and other != path:
+                os.unlink(other)
+
+    def get_build_memory_file(self):
+        cache_dir = self.get_cache_directory()
+        if cache_dir is None:
+            return None
+        return os.path.join(cache_dir, "ctest", "build-memory.json")
+
+    def read_build_memory(self):
+        path = self.get_build_memory_file()
+        if path is None:
+            return []
+        try:
+            with open(path, "r") as f:
+                return json.load(f)["peak_memory"]
+        except FileNotFoundError:
+            return []
+
+    def get_build_rusage_launcher(self):
+        # Measures the build command alone, so that the configure step and
+        # anything else that ran in the same process don't count
+        return [
+            sys.executable,
+            pkg_resources.resource_filename(__name__, "rusage.py"),
+            "--quiet",
+            os.path.abspath(self.options.ctest_testing_dir),
+            "build-rusage",
+        ]
+
+    def record_build_memory(self):
+        path = self.get_build_memory_file()
+        if get_deb_ctest_option("buildmemory") is None or path is None \
+                or self.options.no_act:
+            return
+
+        # The largest process of the build is the largest build job.
+        # ru_maxrss is in kilobytes.
+        try:
+            peak = rusage.read_usage(self.options.ctest_testing_dir,
+                                     "build-rusage")["max_rss"]
+        except FileNotFoundError:
+            # The build never ran
+            return
+        os.unlink(rusage.get_rusage_file(self.options.ctest_testing_dir,
+                                         "build-rusage"))
+
+        history = self.read_build_memory()
+        history.append(-(-peak // 1024))
+        history = history[-BUILD_MEMORY_HISTORY:]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"peak_memory": history}, f)
+            f.write("\n")
+        os.replace(path + ".tmp", path)
+
+    def get_build_note_file(self):
+        return os.path.join(self.get_notes_directory(), "build-jobs.txt")
+
+    def select_build_jobs(self):
+        if not self.options.no_act and \
+                os.path.exists(self.get_build_note_file()):
+            os.unlink(self.get_build_note_file())
+
+        job_memory = get_build_job_memory()
+        jobs = get_build_parallel_level()
+        if job_memory is None or jobs is None:
+            return None
+
+        # What previous builds needed beats a guess
+        history = self.read_build_memory()
+        if history:
+            job_memory = max(history)
+        elif job_memory is True:
+            return None
+
+        available = resourcespec.get_available_memory()
+        selected = max(min(jobs, available // job_memory), 1)
+        line = "Building with %i of %i jobs: %i MiB available, %i MiB per " \
+            "job" % (selected, jobs, available, job_memory)
+        if not self.options.no_act:
+            self.write_note(self.get_build_note_file(), [line])
+        print(line, file=self.stdout)
+
+        return selected
+
+    def get_ninja_report_file(self):
+        return os.path.join(self.options.ctest_testing_dir, "ninja-log.json")
+
+    def get_ninja_note_file(self):
+        return os.path.join(self.get_notes_directory(), "ninja-log.txt")
+
+    def read_ninja_graph(self):
+        try:
+            result = subprocess.run(
+                ["ninja", "-C", self.get_build_directory(), "-t", "graph"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return ninjalog.read_ninja_graph(result.stdout.splitlines())
+
+    def analyze_build(self):
+        if not get_deb_ctest_option("ninjalog") or self.options.no_act:
+            return
+        if os.path.exists(self.get_ninja_note_file()):
+            os.unlink(self.get_ninja_note_file())
+
+        try:
+            with open(os.path.join(self.get_build_directory(),
+                                   ninjalog.NINJA_LOG_FILE), "r") as f:
+                steps = ninjalog.read_ninja_log(f)
+        except FileNotFoundError:
+            return
+
+        report = ninjalog.analyze_ninja_log(steps, self.read_ninja_graph())
+        os.makedirs(self.options.ctest_testing_dir, exist_ok=True)
+        with open(self.get_ninja_report_file(), "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+        lines = ninjalog.format_summary(report)
+        if get_deb_ctest_option("model") is not None:
+            self.write_note(self.get_ninja_note_file(), lines)
+        for line in lines:
+            print(line, file=self.stdout)
+
+    def get_coverage_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "coverage")
+
+    def select_coverage_jobs(self):
+        jobs = get_parallel_level() or 1
+        job_memory = get_coverage_job_memory()
+        if job_memory is None:
+            return jobs
+
+        available = resourcespec.get_available_memory()
+        return max(min(jobs, available // job_memory), 1)
+
+    def run_gcov(self):
+        coverage_dir = self.get_coverage_directory()
+        if os.path.exists(coverage_dir):
+            self.do_cmd(["rm", "-rf", coverage_dir + "/"])
+        if self.options.no_act:
+            return
+
+        # ctest_coverage() only looks for .gcda files in the targets listed
+        # in its own binary directory
+        target_dirs = os.path.join("CMakeFiles", "TargetDirectories.txt")
+        if os.path.exists(os.path.join(self.get_build_directory(),
+                                       target_dirs)):
+            os.makedirs(os.path.join(self.options.ctest_testing_dir,
+                                     "CMakeFiles"), exist_ok=True)
+            shutil.copyfile(
+                os.path.join(self.get_build_directory(), target_dirs),
+                os.path.join(self.options.ctest_testing_dir, target_dirs))
+
+        # Object directories are independent of each other, so they get
+        # processed side by side. ctest_coverage() then only has to pick up
+        # the results.
+        directories = gcov.find_gcda_files(
+            os.path.abspath(self.get_build_directory()))
+        if not directories:
+            return
+        coverage_dir = os.path.abspath(coverage_dir)
+        with concurrent.futures.ThreadPoolExecutor(
+                self.select_coverage_jobs()) as executor:
+            list(executor.map(
+                lambda f: gcov.run_directory(coverage_dir, gcov.GCOV_COMMAND,
+                                             f),
+                directories.values()))
+
+    def run_coverage_step(self):
+        if get_deb_ctest_option("model") is not None:
+            self.run_gcov()
+        self.do_ctest_step("coverage")
+
+    def get_ccache_environment(self):
+        option = get_deb_ctest_option("ccache")
+        if option is None:
+            return None
+
+        if option is True:
+            cache_dir = self.get_cache_directory()
+            if cache_dir is not None:
+                cache_dir = os.path.join(cache_dir, "ccache")
+        else:
+            cache_dir = os.path.abspath(option)
+        return ccache.get_environment(cache_dir, os.getcwd())
+
+    def get_ccache_report_file(self):
+        return os.path.join(self.options.ctest_testing_dir, "ccache.json")
+
+    def get_ccache_note_file(self):
+        return os.path.join(self.get_notes_directory(), "ccache.txt")
+
+    def get_ccache_stats_environment(self):
+        # The statistics of a shared cache, such as ~/.ccache, count every
+        # other build that uses it as well, so they are left alone
+        ccache_env = self.get_ccache_environment()
+        if ccache_env is None or "CCACHE_DIR" not in ccache_env:
+            return None
+        return ccache_env
+
+    def read_ccache_stats(self, ccache_env):
+        result = subprocess.run(["ccache", "--print-stats"],
+                                stdout=subprocess.PIPE,
+                                env={**os.environ, **ccache_env},
+                                universal_newlines=True, check=True)
+        return ccache.read_stats(result.stdout.splitlines())
+
+    def snapshot_ccache_stats(self):
+        # The statistics are compared with this afterwards rather than
+        # zeroed, so that nothing else that looks at them is disturbed
+        self._ccache_stats = None
+        ccache_env = self.get_ccache_stats_environment()
+        if ccache_env is not None and not self.options.no_act:
+            self._ccache_stats = self.read_ccache_stats(ccache_env)
+
+    def report_ccache_stats(self):
+        ccache_env = self.get_ccache_stats_environment()
+        if ccache_env is None or self._ccache_stats is None:
+            return
+        if os.path.exists(self.get_ccache_note_file()):
+            os.unlink(self.get_ccache_note_file())
+
+        stats = ccache.subtract_stats(self.read_ccache_stats(ccache_env),
+                                      self._ccache_stats)
+        os.makedirs(self.options.ctest_testing_dir, exist_ok=True)
+        with open(self.get_ccache_report_file(), "w") as f:
+            json.dump(stats, f, indent=2)
+            f.write("\n")
+
+        # CDash can only chart the measurements of tests, not of builds, so
+        # the dashboard gets the numbers as a note. ccache.json is there for
+        # tools that track them over time.
+        line = ccache.format_stats(stats)
+        if get_deb_ctest_option("model") is not None:
+            self.write_note(self.get_ccache_note_file(), [line])
+        print(line, file=self.stdout)
+
+    def get_tests(self):
+        result = subprocess.run(["ctest", "--show-only=json-v1"],
+                                stdout=subprocess.PIPE, check=True,
+                                cwd=self.get_build_directory())
+        return json.loads(result.stdout)["tests"]
+
+    def get_test_names(self):
+        return [t["name"] for t in self.get_tests()]
+
+    def read_cost_data(self):
+        try:
+            with open(self.get_cost_data_file(), "r") as f:
+                return costdata.read_cost_data(f)
+        except FileNotFoundError:
+            return {}, set()
+
+    def get_budget_note_file(self):
+        return os.path.join(self.get_notes_directory(), "budget-skipped.txt")
+
+    def remove_note(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+
+    def select_budget_tests(self, tests, costs, failed, budget):
+        selected, skipped = costdata.select_for_budget(
+            tests, costs, failed, budget)
+
+        lines = ["Skipped %i of %i tests to fit in a budget of %g seconds"
+                 % (len(skipped), len(tests), budget)]
+        lines.extend(skipped)
+        self.write_note(self.get_budget_note_file(), lines)
+        for line in lines:
+            print(line, file=self.stdout)
+
+        return selected
+
+    def get_test_cache_file(self):
+        option = get_deb_ctest_option("testcache")
+        # Tests that are not run under nocheck must not count as passed
+        if option is None or "nocheck" in _get_deb_build_options():
+            return None
+
+        if option is True:
+            cache_dir = self.get_cache_directory()
+            if cache_dir is None:
+                return None
+            directory = os.path.join(cache_dir, "ctest")
+        else:
+            directory = os.path.abspath(option)
+        return os.path.join(directory, testcache.TEST_RESULTS_FILE)
+
+    def get_test_cache_note_file(self):
+        return os.path.join(self.get_notes_directory(), "test-cache.txt")
+
+    def read_test_results(self, path):
+        try:
+            with open(path, "r") as f:
+                return testcache.read_results(f)
+        except FileNotFoundError:
+            return {}
+
+    def get_test_fingerprints(self, tests):
+        build_dir = os.path.abspath(self.get_build_directory())
+        fingerprinter = testcache.Fingerprinter(
+            build_dir, testcache.find_objects(build_dir),
+            self.get_build_environment())
+        return {t["name"]: fingerprinter.get_fingerprint(t) for t in tests}
+
+    def select_uncached_tests(self, tests, fingerprints, results):
+        selected, cached = testcache.select_uncached(
+            tests, fingerprints, results)
+
+        lines = ["Skipped %i of %i tests with a cached pass"
+                 % (len(cached), len(tests))]
+        lines.extend(cached)
+        self.write_note(self.get_test_cache_note_file(), lines)
+        for line in lines:
+            print(line, file=self.stdout)
+
+        return selected
+
+    def save_test_results(self, path, fingerprints, results, costs):
+        new_costs, failed = self.read_cost_data()
+        results = testcache.update_results(
+            results, fingerprints, costs, new_costs, failed)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            testcache.write_results(f, results)
+        os.replace(path + ".tmp", path)
+
+    def write_tests_file(self, path, tests, selected):
+        # -I with explicit test numbers; test 0 does not exist, so an empty
+        # selection runs nothing rather than everything. ctest -S treats
+        # that as an error unless told otherwise.
+        selected = set(selected)
+        numbers = [str(i + 1) for i, t in enumerate(tests) if t in selected]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write("0,0,0,%s\n" % ",".join(numbers or ["0"]))
+
+        return ["-I", os.path.abspath(path), "--no-tests=ignore"]
+
+    def get_shards_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "shards")
+
+    def get_shard_directory(self, shard):
+        return os.path.join(self.get_shards_directory(), str(shard))
+
+    def read_tag(self, ctest_testing_dir):
+        try:
+            with open(os.path.join(ctest_testing_dir, "Testing/TAG"),
+                      "r") as f:
+                return [line.rstrip("\n") for line in f]
+        except FileNotFoundError:
+            return None
+
+    def get_test_xml_file(self, ctest_testing_dir):
+        tag = self.read_tag(ctest_testing_dir)
+        if tag is None:
+            return None
+        return os.path.join(ctest_testing_dir, "Testing", tag[0], "Test.xml")
+
+    def run_shard(self, shard, tests, selected, ctest_args):
+        shard_dir = self.get_shard_directory(shard)
+
+        # Results copied in from another builder are used as they are
+        test_xml = self.get_test_xml_file(shard_dir)
+        if test_xml is not None and os.path.exists(test_xml):
+            return
+
+        self.run_partial_tests(shard_dir, tests, selected, ctest_args)
+
+    def run_partial_tests(self, directory, tests, selected, ctest_args):
+        # Runs some of the tests in a testing directory of their own, which
+        # is not submitted until the results are merged
+        self.do_cmd(["mkdir", "-p", os.path.join(directory,
+                                                 "Testing/Temporary")])
+        self.do_cmd(["cp", os.path.join(self.options.ctest_testing_dir,
+                                        "Testing/TAG"),
+                     os.path.join(directory, "Testing/TAG")])
+        if os.path.exists(self.get_cost_data_file()):
+            self.do_cmd(["cp", self.get_cost_data_file(),
+                         os.path.join(directory, CTEST_COST_DATA_FILE)])
+
+        tests_args = self.write_tests_file(
+            os.path.join(directory, "tests.txt"), tests, selected)
+        self.do_ctest_step("test",
+                           ctest_args=["-DDH_CTEST_SHARD:BOOL=ON",
+                                       *ctest_args, *tests_args],
+                           ctest_testing_dir=directory)
+
+    def merge_shards(self, count):
+        shard_dirs = [self.get_shard_directory(i + 1) for i in range(count)]
+
+        test_xmls = []
+        for shard_dir in shard_dirs:
+            test_xml = self.get_test_xml_file(shard_dir)
+            if test_xml is not None and os.path.exists(test_xml):
+                test_xmls.append(test_xml)
+
+        # Without any results there is no Test part to submit
+        tag, group = self.read_tag(self.options.ctest_testing_dir)[:2]
+        output = self.get_test_xml_file(self.options.ctest_testing_dir)
+        failed = 0
+        if test_xmls:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, "wb") as f:
+                failed = testxml.merge_test_xml(
+                    test_xmls, f, build_stamp="%s-%s" % (tag, group))
+        elif os.path.exists(output):
+            os.unlink(output)
+
+        # Shards number their tests the same way, so a rerun can use these
+        last_failed = []
+        for shard_dir in shard_dirs:
+            path = self.get_last_tests_failed_file(shard_dir)
+            if path is None:
+                continue
+            try:
+                with open(path, "r") as f:
+                    last_failed.extend(line.rstrip("\n") for line in f
+                                       if line.strip())
+            except FileNotFoundError:
+                pass
+        last_failed_file = self.get_last_tests_failed_file(
+            self.options.ctest_testing_dir)
+        if last_failed:
+            os.makedirs(os.path.dirname(last_failed_file), exist_ok=True)
+            with open(last_failed_file, "w") as f:
+                for line in sorted(last_failed,
+                                   key=lambda x: int(x.split(":")[0])):
+                    f.write("%s\n" % line)
+        elif os.path.exists(last_failed_file):
+            os.unlink(last_failed_file)
+
+        cost_data = []
+        for shard_dir in shard_dirs:
+            try:
+                with open(os.path.join(shard_dir, CTEST_COST_DATA_FILE),
+                          "r") as f:
+                    cost_data.append(costdata.read_cost_data(f))
+            except FileNotFoundError:
+                pass
+        if cost_data:
+            os.makedirs(os.path.dirname(self.get_cost_data_file()),
+                        exist_ok=True)
+            with open(self.get_cost_data_file(), "w") as f:
+                costdata.write_cost_data(
+                    f, *costdata.merge_cost_data(cost_data))
+
+        return failed
+
+    def get_rerun_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "rerun")
+
+    def get_rerun_note_file(self):
+        return os.path.join(self.get_notes_directory(), "rerun.txt")
+
+    def get_last_tests_failed_file(self, directory):
+        if get_deb_ctest_option("model") is None:
+            return os.path.join(directory, CTEST_LAST_TESTS_FAILED_FILE % "")
+
+        # Dashboard mode adds the tag to the name
+        tag = self.read_tag(directory)
+        if tag is None:
+            return None
+        return os.path.join(directory,
+                            CTEST_LAST_TESTS_FAILED_FILE % ("_" + tag[0]))
+
+    def read_last_tests_failed(self, directory):
+        path = self.get_last_tests_failed_file(directory)
+        if path is None:
+            return []
+        try:
+            with open(path, "r") as f:
+                # Each line is "<number>:<name>"
+                return [line.rstrip("\n").partition(":")[2] for line in f
+                        if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def rerun_failed_tests(self, dashboard):
+        if dashboard:
+            directory = self.options.ctest_testing_dir
+        else:
+            directory = self.get_build_directory()
+        # CTest leaves the list alone when every test passes, but the cost
+        # data always has the failures of the last run
+        _, last_failed = self.read_cost_data()
+        failed = [t for t in self.read_last_tests_failed(directory)
+                  if t in last_failed]
+        if dashboard:
+            # There has to be a Test part to add the results to
+            test_xml = self.get_test_xml_file(self.options.ctest_testing_dir)
+            if test_xml is None or not os.path.exists(test_xml):
+                failed = []
+        if not failed:
+            print("No failed tests to rerun", file=self.stdout)
+            return
+
+        lines = ["Reran %i failed tests" % len(failed)]
+        lines.extend(failed)
+        if dashboard:
+            self.write_note(self.get_rerun_note_file(), lines)
+        for line in lines:
+            print(line, file=self.stdout)
+
+        tests = self.get_test_names()
+        tests_file = os.path.join(self.options.ctest_testing_dir, "tests.txt")
+        if not dashboard:
+            self.run_ctest([*self.get_test_args(dashboard),
+                            *self.write_tests_file(tests_file, tests,
+                                                   failed)])
+            return
+
+        rerun_dir = self.get_rerun_directory()
+        if os.path.exists(rerun_dir):
+            self.do_cmd(["rm", "-rf", rerun_dir + "/"])
+        self.run_partial_tests(rerun_dir, tests, failed,
+                               self.get_test_args(dashboard))
+
+        # The new results replace the old ones in the Test part
+        test_xmls = [test_xml]
+        rerun_xml = self.get_test_xml_file(rerun_dir)
+        if rerun_xml is not None and os.path.exists(rerun_xml):
+            test_xmls.append(rerun_xml)
+        with open(test_xml + ".tmp", "wb") as f:
+            testxml.merge_test_xml(test_xmls, f)
+        os.replace(test_xml + ".tmp", test_xml)
+
+        # Only the tests that were rerun decide whether the rerun failed
+        if rerun_xml is not None and os.path.exists(rerun_xml):
+            with open(rerun_xml, "rb") as f:
+                still_failed = testxml.count_failed(f)
+        else:
+            still_failed = len(failed)
+
+        # The rerun started from a copy of these, so its versions are newer
+        for path, rerun_path in [
+                (self.get_cost_data_file(),
+                 os.path.join(rerun_dir, CTEST_COST_DATA_FILE)),
+                (self.get_last_tests_failed_file(directory),
+                 self.get_last_tests_failed_file(rerun_dir))]:
+            if os.path.exists(rerun_path):
+                os.replace(rerun_path, path)
+            elif os.path.exists(path):
+                os.unlink(path)
+
+        self.do_ctest_step("test_merged",
+                           ctest_args=["-DDH_CTEST_TEST_FAILED:BOOL=%s"
+                                       % ("ON" if still_failed else "OFF")])
+
+    def get_test_args(self, dashboard, shares=1):
+        return [*self.get_parallel_args(dashboard, shares),
+                *self.get_resource_spec_args(dashboard, shares)]
+
+    def get_parallel_args(self, dashboard, shares=1):
+        parallel_level = get_parallel_level()
+        if parallel_level is None:
+            return []
+
+        parallel_level = max(parallel_level // shares, 1)
+        if dashboard:
+            return ["-DDH_CTEST_PARALLEL_LEVEL:STRING=%i" % parallel_level]
+        else:
+            return ["-j%i" % parallel_level]
+
+    def get_resource_spec_args(self, dashboard, shares=1):
+        if not get_deb_ctest_option("resourcespec") or \
+                self.options.no_act or any(
+                    a.startswith("--resource-spec-file")
+                    for a in self.options.extra_args):
+            return []
+        self.require_ctest_version("resourcespec", (3, 16))
+
+        path = os.path.abspath(os.path.join(self.options.ctest_testing_dir,
+                                            "resources.json"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            resourcespec.write_resource_spec(f, shares=shares)
+
+        if dashboard:
+            return ["-DDH_CTEST_RESOURCE_SPEC_FILE:PATH=" + path]
+        else:
+            return ["--resource-spec-file", path]
+
+    def get_output_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "output")
+
+    def get_rusage_directory(self):
+        return os.path.join(self.options.ctest_testing_dir, "rusage")
+
+    def get_rusage_launcher(self):
+        # Read from the environment by dh_ctest_rusage.cmake
+        return ";".join([
+            sys.executable,
+            pkg_resources.resource_filename(__name__, "rusage.py"),
+            os.path.abspath(self.get_rusage_directory()),
+        ])
+
+    def run_ctest(self, ctest_args=None):
+        quiet = get_deb_ctest_option("quiet")
+        if quiet:
+            args = ["ctest", "--output-on-failure"]
+        else:
+            args = ["ctest", "-VV"]
+        if get_deb_ctest_option("failfast"):
+            self.require_ctest_version("failfast", (3, 18))
+            args.append("--stop-on-failure")
+        for status in ["passed", "failed"]:
+            output_size = get_output_size(status)
+            if output_size is not None:
+                self.require_ctest_version(status + "outputsize", (3, 18))
+                args.extend(["--test-output-size-" + status,
+                             "%i" % output_size])
+        if ctest_args:
+            args.extend(ctest_args)
+        try:
+            self.do_cmd([*args, *self.options.extra_args],
+                        cwd=self.get_build_directory())
+        finally:
+            if quiet and not self.options.no_act:
+                self.save_last_test_log_output()
+
+    def save_last_test_log_output(self):
+        try:
+            with open(os.path.join(self.get_build_directory(),
+                                   "Testing/Temporary/LastTest.log"),
+                      "r", errors="replace") as f:
+                testoutput.write_last_test_log_output(
+                    f, self.get_output_directory())
+        except FileNotFoundError:
+            pass
+
+    def save_test_xml_output(self):
+        test_xml = self.get_test_xml_file(self.options.ctest_testing_dir)
+        if test_xml is None or not os.path.exists(test_xml):
+            return
+        with open(test_xml, "rb") as f:
+            testoutput.write_test_xml_output(
+                f, self.get_output_directory(), failed=self.stdout)
+
+    def run_tests(self):
+        budget = get_budget()
+        shards = get_shards()
+        test_cache = self.get_test_cache_file()
+        dashboard = get_deb_ctest_option("model") is not None
+
+        if get_deb_ctest_option("rerunfailed") and not self.options.no_act:
+            self.rerun_failed_tests(dashboard)
+            return
+
+        if not self.options.no_act:
+            self.remove_note(self.get_rerun_note_file())
+            if budget is None:
+                self.remove_note(self.get_budget_note_file())
+            if test_cache is None:
+                self.remove_note(self.get_test_cache_note_file())
+
+        if self.options.no_act or (budget is None and shards is None and
+                                   test_cache is None):
+            ctest_args = self.get_test_args(dashboard)
+            if not self.do_ctest_step("test", ctest_args=ctest_args):
+                self.run_ctest(ctest_args)
+            return
+
+        tests = self.get_tests()
+        names = [t["name"] for t in tests]
+        costs, failed = self.read_cost_data()
+        selected = names
+        if test_cache is not None:
+            fingerprints = self.get_test_fingerprints(tests)
+            results = self.read_test_results(test_cache)
+            selected = self.select_uncached_tests(names, fingerprints,
+                                                  results)
+        if budget is not None:
+            selected = self.select_budget_tests(selected, costs, failed,
+                                                budget)
+
+        try:
+            self.run_selected_tests(names, selected, costs, shards,
+                                    dashboard)
+        finally:
+            if test_cache is not None:
+                self.save_test_results(test_cache, fingerprints, results,
+                                       costs)
+
+    def run_selected_tests(self, tests, selected, costs, shards, dashboard):
+        tests_file = os.path.join(self.options.ctest_testing_dir, "tests.txt")
+
+        if shards is None:
+            ctest_args = [*self.get_test_args(dashboard),
+                          *self.write_tests_file(tests_file, tests, selected)]
+            if not self.do_ctest_step("test", ctest_args=ctest_args):
+                self.run_ctest(ctest_args)
+            return
+
+        count, index = shards
+        assignments = costdata.assign_shards(selected, costs, count)
+
+        if not dashboard:
+            if index is not None:
+                selected = assignments[index - 1]
+            self.run_ctest([*self.get_test_args(dashboard),
+                            *self.write_tests_file(tests_file, tests,
+                                                   selected)])
+            return
+
+        # Shards running side by side share the machine's resources
+        indexes = [index] if index is not None else range(1, count + 1)
+        ctest_args = self.get_test_args(dashboard, shares=len(indexes))
+        with concurrent.futures.ThreadPoolExecutor(len(indexes)) as executor:
+            list(executor.map(
+                lambda i: self.run_shard(i, tests, assignments[i - 1],
+                                         ctest_args),
+                indexes))
+
+        if index is None:
+            failed = self.merge_shards(count)
+            self.do_ctest_step("test_merged",
+                               ctest_args=["-DDH_CTEST_TEST_FAILED:BOOL=%s"
+                                           % ("ON" if failed else "OFF")])
+
     @common.DHEntryPoint("dh_ctest_clean")
     def clean(self, args=None):
         self.parse_args(args)
@@ -155,6 +1371,8 @@ class DHCTest(common.DHCommon):
     @common.DHEntryPoint("dh_ctest_start")
     def start(self, args=None):
         self.parse_args(args)
+        if os.path.exists(self.get_shards_directory()):
+            self.do_cmd(["rm", "-rf", self.get_shards_directory() + "/"])
         self.do_ctest_step("start")
 
     @common.DHEntryPoint("dh_ctest_update")
@@ -163,22 +1381,116 @@ class DHCTest(common.DHCommon):
         if get_deb_ctest_option("update"):
             self.do_ctest_step("update")
 
-    @common.DHEntryPoint("dh_ctest_configure")
+    @common.DHEntryPoint("dh_ctest_configure", record_history=True)
     def configure(self, args=None):
         self.parse_args(args)
         self.do_ctest_step("configure", "dh_auto_configure")
+        self.save_check_cache()
 
-    @common.DHEntryPoint("dh_ctest_build")
+    @common.DHEntryPoint("dh_ctest_build", record_history=True)
     def build(self, args=None):
         self.parse_args(args)
-        self.do_ctest_step("build", "dh_auto_build")
+        self.snapshot_ccache_stats()
+        try:
+            self.do_ctest_step("build", "dh_auto_build")
+        finally:
+            self.record_build_memory()
+        self.analyze_build()
+        self.report_ccache_stats()
 
-    @common.DHEntryPoint("dh_ctest_test")
+    def run_test_step(self):
+        quiet = get_deb_ctest_option("quiet")
+        if quiet and os.path.exists(self.get_output_directory()):
+            self.do_cmd(["rm", "-rf", self.get_output_directory() + "/"])
+
+        rusage = get_deb_ctest_option("rusage")
+        if rusage:
+            if os.path.exists(self.get_rusage_directory()):
+                self.do_cmd(["rm", "-rf", self.get_rusage_directory() + "/"])
+            os.environ["DH_CTEST_RUSAGE_LAUNCHER"] = \
+                self.get_rusage_launcher()
+
+        started = time.time()
+        self.import_cost_data()
+        try:
+            self.run_tests()
+        finally:
+            if rusage:
+                del os.environ["DH_CTEST_RUSAGE_LAUNCHER"]
+            self.export_cost_data()
+            if quiet and get_deb_ctest_option("model") is not None and \
+                    not self.options.no_act:
+                self.save_test_xml_output()
+            if self.get_history_file() is not None and \
+                    not self.options.no_act:
+                self.history_tests = self.read_test_history(started)
+
+    def read_test_history(self, started):
+        if get_deb_ctest_option("model") is None:
+            path = os.path.join(self.get_build_directory(),
+                                "Testing/Temporary/LastTest.log")
+        else:
+            path = self.get_test_xml_file(self.options.ctest_testing_dir)
+
+        # Left over from an earlier run if the tests did not run this time
+        if path is None or not os.path.exists(path) or \
+                os.path.getmtime(path) < started:
+            return []
+        if get_deb_ctest_option("model") is None:
+            with open(path, "r", errors="replace") as f:
+                results = list(testoutput.iter_last_test_log(f))
+        else:
+            with open(path, "rb") as f:
+                results = [{k: r[k] for k in ["name", "status", "time"]}
+                           for r in testxml.iter_test_xml(f)]
+
+        if get_deb_ctest_option("rusage"):
+            for result in results:
+                try:
+                    result.update(rusage.read_usage(
+                        self.get_rusage_directory(), result["name"]))
+                except FileNotFoundError:
+                    pass
+        return results
+
+    @common.DHEntryPoint("dh_ctest_test", record_history=True)
     def test(self, args=None):
         self.parse_args(args)
-        if not self.do_ctest_step("test"):
-            self.do_cmd(["ctest", "-VV", *self.options.extra_args],
-                        cwd=self.get_build_directory())
+        self.run_test_step()
+
+    @common.DHEntryPoint("dh_ctest_coverage")
+    def coverage(self, args=None):
+        self.parse_args(args)
+        if get_deb_ctest_option("coverage"):
+            self.run_coverage_step()
+
+    def get_submit_url(self):
+        path = os.path.abspath(os.path.join(self.options.ctest_testing_dir,
+                                            "submit-url.txt"))
+        self.do_ctest_step("submit_url", ctest_args=[
+            "-DDH_CTEST_SUBMIT_URL_FILE:PATH=" + path])
+        if self.options.no_act:
+            return None
+        with open(path, "r") as f:
+            return f.read().rstrip("\n")
+
+    def native_submit(self):
+        url = self.get_submit_url()
+        if url is None:
+            return
+
+        # Stock CDash can't take compressed uploads, so only compress them
+        # when asked to
+        option = get_deb_ctest_option("nativesubmit")
+        if option not in (True, "gzip"):
+            raise ValueError("Invalid nativesubmit: %s" % option)
+
+        tag = self.read_tag(self.options.ctest_testing_dir)[0]
+        testing_dir = os.path.join(self.options.ctest_testing_dir, "Testing",
+                                   tag)
+        with cdash.Uploader(url, compress=option == "gzip") as uploader:
+            uploader.submit(testing_dir, self.options.parts or None,
+                            self.get_notes_files())
 
     def submit_make_arg_parser(self, parser):
         super().make_arg_parser(parser)
@@ -201,7 +1513,151 @@ class DHCTest(common.DHCommon):
         self.options.no_submit = False
         self.options.extra_args = []
         if get_deb_ctest_option("submit"):
-            self.do_ctest_step("submit")
+            self.replay_spool()
+            if get_deb_ctest_option("nativesubmit"):
+                self.native_submit()
+            else:
+                self.do_ctest_step("submit")
+
+    def run_make_arg_parser(self, parser):
+        self.make_arg_parser(parser)
+
+        parser.add_argument(
+            "--steps", action="store",
+            help="Comma-separated list of steps to run")
+
+    def get_run_steps(self):
+        if self.options.steps is None:
+            raise ValueError("No steps specified")
+
+        steps = [s for s in self.options.steps.split(",") if s]
+        for step in steps:
+            if step not in RUN_STEPS:
+                raise ValueError("Invalid step: %s" % step)
+
+        if not get_deb_ctest_option("update"):
+            steps = [s for s in steps if s != "update"]
+        if not get_deb_ctest_option("coverage"):
+            steps = [s for s in steps if s != "coverage"]
+        if not get_deb_ctest_option("submit"):
+            steps = [s for s in steps if s != "submit"]
+        return steps
+
+    @contextlib.contextmanager
+    def record_step_history(self, tool_name):
+        # dh_ctest_run records its steps under the names of the commands
+        # that run them separately, so that the two can be compared
+        if tool_name is None:
+            yield
+            return
+
+        started = time.time()
+        start = time.monotonic()
+        before = history.get_usage()
+        outcome = history.FAILED
+        try:
+            yield
+            outcome = history.PASSED
+        finally:
+            usage = history.get_usage_since(before)
+            # The peak is for the whole process, so unless it went up, it
+            # came from an earlier step
+            if usage["max_rss"] <= before["max_rss"]:
+                usage["max_rss"] = None
+            self.record_history(started, time.monotonic() - start, usage,
+                                outcome, tool_name=tool_name)
+
+    def do_fused_steps(self, steps):
+        configure = any(s == "configure" for s, c in steps)
+        build = any(s == "build" for s, c in steps)
+        tool_name = None
+        if build:
+            tool_name = HISTORY_TOOLS["build"]
+        elif configure:
+            tool_name = HISTORY_TOOLS["configure"]
+
+        with self.record_step_history(tool_name):
+            if build:
+                self.snapshot_ccache_stats()
+            try:
+                self.do_ctest_steps(steps)
+            finally:
+                # A failed build must not lose the results of the configure
+                if configure:
+                    self.save_check_cache()
+                if build:
+                    self.record_build_memory()
+            if build:
+                self.analyze_build()
+                self.report_ccache_stats()
+
+    @common.DHEntryPoint("dh_ctest_run")
+    def run(self, args=None):
+        self.parse_args(args, make_arg_parser=self.run_make_arg_parser)
+        self.parsed_args = _remove_option(self.parsed_args, "--steps")
+        steps = self.get_run_steps()
+
+        if "start" in steps and os.path.exists(self.get_shards_directory()):
+            self.do_cmd(["rm", "-rf", self.get_shards_directory() + "/"])
+
+        # Everything except the test and coverage steps goes to one driver
+        # process. These have to look at the build tree first, so they run
+        # on their own, in between. When the history is recorded, configure
+        # and build get a process each, so that each has its own time.
+        split = self.get_history_file() is not None and \
+            not self.options.no_act
+        fused = []
+        for step in steps:
+            if step == "test":
+                self.do_fused_steps(fused)
+                fused = []
+                with self.record_step_history(HISTORY_TOOLS["test"]):
+                    self.run_test_step()
+            elif step == "coverage":
+                self.do_fused_steps(fused)
+                fused = []
+                self.run_coverage_step()
+            else:
+                if split and step in STEP_COMMANDS and \
+                        any(s in STEP_COMMANDS for s, c in fused):
+                    self.do_fused_steps(fused)
+                    fused = []
+                fused.append((step, STEP_COMMANDS.get(step)))
+        self.do_fused_steps(fused)
+
+    def report_make_arg_parser(self, parser):
+        super().make_arg_parser(parser)
+
+        parser.add_argument(
+            "--ctest-testing-dir", action="store", default="debian/.ctest",
+            help="Directory in which to store CTest Testing/ directory")
+        parser.add_argument(
+            "--junit", action="store",
+            help="JUnit XML file to write (default: junit.xml in the CTest "
+                 "testing directory)")
+        parser.add_argument(
+            "--slowest", action="store", type=int, default=10,
+            help="Number of slowest tests to list")
+
+    @common.DHEntryPoint("dh_ctest_report")
+    def report(self, args=None):
+        self.parse_args(args, make_arg_parser=self.report_make_arg_parser)
+
+        test_xml = self.get_test_xml_file(self.options.ctest_testing_dir)
+        if test_xml is None or not os.path.exists(test_xml):
+            return
+
+        junit = self.options.junit
+        if junit is None:
+            junit = os.path.join(self.options.ctest_testing_dir, "junit.xml")
+        if self.options.no_act:
+            return
+
+        with open(test_xml, "rb") as f, open(junit, "wb") as junit_f:
+            summary = testxml.summarize_test_xml(
+                f, junit_f, slowest=self.options.slowest)
+        for line in testxml.format_summary(summary):
+            print(line, file=self.stdout)
 
 
 def clean():
@@ -234,6 +1690,21 @@ def test():
     dhctest.test()
 
 
+def coverage():
+    dhctest = DHCTest()
+    dhctest.coverage()
+
+
 def submit():
     dhctest = DHCTest()
     dhctest.submit()
+
+
+def run():
+    dhctest = DHCTest()
+    dhctest.run()
+
+
+def report():
+    dhctest = DHCTest()
+    dhctest.report()
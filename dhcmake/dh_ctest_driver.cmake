@@ -19,74 +19,179 @@ if(DEFINED DH_CTEST_BUILD)
   set(CTEST_BUILD_NAME "${DH_CTEST_BUILD}")
 endif()
 
+if(DEFINED DH_CTEST_PASSED_OUTPUT_SIZE)
+  set(CTEST_CUSTOM_MAXIMUM_PASSED_TEST_OUTPUT_SIZE
+    "${DH_CTEST_PASSED_OUTPUT_SIZE}")
+endif()
+
+if(DEFINED DH_CTEST_FAILED_OUTPUT_SIZE)
+  set(CTEST_CUSTOM_MAXIMUM_FAILED_TEST_OUTPUT_SIZE
+    "${DH_CTEST_FAILED_OUTPUT_SIZE}")
+endif()
+
+if(DEFINED DH_CTEST_NOTES_FILES)
+  set(CTEST_NOTES_FILES "${DH_CTEST_NOTES_FILES}")
+endif()
+
 function(step_submit)
   if(DH_CTEST_STEP_SUBMIT)
-    ctest_submit(PARTS ${ARGN})
+    if(DEFINED DH_CTEST_SPOOL_DIR)
+      # Submitted in the background, see dhcmake/spool.py. An empty entry
+      # has not been given a snapshot to submit from yet.
+      file(MAKE_DIRECTORY "${DH_CTEST_SPOOL_DIR}")
+      foreach(_part IN LISTS ARGN)
+        file(WRITE "${DH_CTEST_SPOOL_DIR}/${_part}" "")
+      endforeach()
+    else()
+      ctest_submit(PARTS ${ARGN})
+    endif()
   endif()
 endfunction()
 
-if(DH_CTEST_STEP STREQUAL start)
-
-  set(_track_args)
-  if(DEFINED DH_CTEST_TRACK)
-    set(_track_args TRACK "${DH_CTEST_TRACK}")
+function(finish_test failed)
+  if(DEFINED DH_CTEST_NOTES_FILES)
+    step_submit(Test Notes)
+  else()
+    step_submit(Test)
   endif()
-  ctest_start("${DH_CTEST_DASHBOARD_MODEL}" ${_track_args})
-
-elseif(DH_CTEST_STEP STREQUAL update)
-
-  set(CTEST_UPDATE_VERSION_ONLY TRUE)
-  set(CTEST_UPDATE_VERSION_OVERRIDE)
-  set(CTEST_UPDATE_COMMAND)
-  if(DEFINED DH_CTEST_VERSION_OVERRIDE)
-    set(CTEST_UPDATE_VERSION_OVERRIDE "${DH_CTEST_VERSION_OVERRIDE}")
-    # TODO No way to specify "no tool", so we have to specify something even
-    # though it won't actually be used. Fix this in CMake upstream.
-    set(CTEST_UPDATE_COMMAND /usr/bin/git)
+
+  if(DH_CTEST_CATCHFAILED AND failed)
+    message(FATAL_ERROR
+      "One or more tests failed and DEB_CTEST_OPTIONS=catchfailed was set. "
+      "Aborting.")
+  elseif(DH_CTEST_STOP_ON_FAILURE AND failed)
+    message(FATAL_ERROR
+      "A test failed and DEB_CTEST_OPTIONS=failfast was set. Aborting.")
   endif()
+endfunction()
 
-  ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
-  ctest_update(CAPTURE_CMAKE_ERROR _result)
+# DH_CTEST_STEP may name several steps, which then run in order in this one
+# process. A failed configure or build stops the steps after it, and fails
+# ctest, just like a failed dh_ctest_* command stops the build.
+foreach(_step IN LISTS DH_CTEST_STEP)
 
-  step_submit(Update)
+  if(_step STREQUAL start)
 
-elseif(DH_CTEST_STEP STREQUAL configure)
+    set(_track_args)
+    if(DEFINED DH_CTEST_TRACK)
+      set(_track_args TRACK "${DH_CTEST_TRACK}")
+    endif()
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" ${_track_args})
 
-  set(CTEST_CONFIGURE_COMMAND "${DH_CTEST_RUN_CMD}")
-  ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
-  ctest_configure(BUILD "${DH_CTEST_SRCDIR}")
+  elseif(_step STREQUAL update)
 
-  step_submit(Configure)
+    set(CTEST_UPDATE_VERSION_ONLY TRUE)
+    set(CTEST_UPDATE_VERSION_OVERRIDE)
+    set(CTEST_UPDATE_COMMAND)
+    if(DEFINED DH_CTEST_VERSION_OVERRIDE)
+      set(CTEST_UPDATE_VERSION_OVERRIDE "${DH_CTEST_VERSION_OVERRIDE}")
+      # TODO No way to specify "no tool", so we have to specify something even
+      # though it won't actually be used. Fix this in CMake upstream.
+      set(CTEST_UPDATE_COMMAND /usr/bin/git)
+    endif()
 
-elseif(DH_CTEST_STEP STREQUAL build)
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    ctest_update(CAPTURE_CMAKE_ERROR _result)
 
-  set(CTEST_BUILD_COMMAND "${DH_CTEST_RUN_CMD}")
-  ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
-  ctest_build(BUILD "${DH_CTEST_SRCDIR}")
+    step_submit(Update)
 
-  step_submit(Build)
+  elseif(_step STREQUAL configure)
 
-elseif(DH_CTEST_STEP STREQUAL test)
+    set(CTEST_CONFIGURE_COMMAND "${DH_CTEST_RUN_CMD_configure}")
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    ctest_configure(BUILD "${DH_CTEST_SRCDIR}" RETURN_VALUE _result)
 
-  ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
-  ctest_test(BUILD "${DH_CTEST_BUILDDIR}" RETURN_VALUE _result)
+    step_submit(Configure)
 
-  step_submit(Test)
+    if(_result)
+      message(FATAL_ERROR "Configure failed. Aborting.")
+    endif()
 
-  if(DH_CTEST_CATCHFAILED AND _result)
-    message(FATAL_ERROR
-      "One or more tests failed and DEB_CTEST_OPTIONS=catchfailed was set. "
-      "Aborting.")
-  endif()
+  elseif(_step STREQUAL build)
 
-elseif(DH_CTEST_STEP STREQUAL submit)
+    set(CTEST_BUILD_COMMAND "${DH_CTEST_RUN_CMD_build}")
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    ctest_build(BUILD "${DH_CTEST_SRCDIR}" RETURN_VALUE _result)
 
-  ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    step_submit(Build)
+
+    if(_result)
+      message(FATAL_ERROR "Build failed. Aborting.")
+    endif()
+
+  elseif(_step STREQUAL test)
+
+    set(_test_args)
+    if(DEFINED DH_CTEST_PARALLEL_LEVEL)
+      set(_test_args PARALLEL_LEVEL "${DH_CTEST_PARALLEL_LEVEL}")
+    endif()
+    if(DEFINED DH_CTEST_RESOURCE_SPEC_FILE)
+      list(APPEND _test_args
+        RESOURCE_SPEC_FILE "${DH_CTEST_RESOURCE_SPEC_FILE}")
+    endif()
+    if(DH_CTEST_STOP_ON_FAILURE)
+      list(APPEND _test_args STOP_ON_FAILURE)
+    endif()
+
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    ctest_test(BUILD "${DH_CTEST_BUILDDIR}" ${_test_args}
+      RETURN_VALUE _result)
+
+    # Shards and reruns are merged and submitted by dh_ctest_test afterwards
+    if(NOT DH_CTEST_SHARD)
+      finish_test("${_result}")
+    endif()
+
+  elseif(_step STREQUAL coverage)
+
+    # gcov already ran in dh_ctest_coverage, see dhcmake/gcov.py
+    set(CTEST_COVERAGE_COMMAND "${DH_CTEST_COVERAGE_COMMAND}")
+    set(CTEST_COVERAGE_EXTRA_FLAGS "${DH_CTEST_COVERAGE_EXTRA_FLAGS}")
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    ctest_coverage(BUILD "${DH_CTEST_BUILDDIR}" CAPTURE_CMAKE_ERROR _result)
+
+    step_submit(Coverage)
+
+  elseif(_step STREQUAL test_merged)
+
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+    finish_test("${DH_CTEST_TEST_FAILED}")
+
+  elseif(_step STREQUAL submit_url)
+
+    # For dh_ctest_submit's own uploader, see dhcmake/cdash.py
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+
+    if(DEFINED CTEST_SUBMIT_URL)
+      set(_url "${CTEST_SUBMIT_URL}")
+    else()
+      set(_url "${CTEST_DROP_METHOD}://")
+      if(NOT "${CTEST_DROP_SITE_USER}" STREQUAL "")
+        string(APPEND _url "${CTEST_DROP_SITE_USER}")
+        if(NOT "${CTEST_DROP_SITE_PASSWORD}" STREQUAL "")
+          string(APPEND _url ":${CTEST_DROP_SITE_PASSWORD}")
+        endif()
+        string(APPEND _url "@")
+      endif()
+      string(APPEND _url "${CTEST_DROP_SITE}${CTEST_DROP_LOCATION}")
+    endif()
+    file(WRITE "${DH_CTEST_SUBMIT_URL_FILE}" "${_url}\n")
+
+  elseif(_step STREQUAL submit)
+
+    ctest_start("${DH_CTEST_DASHBOARD_MODEL}" APPEND)
+
+    if(DEFINED DH_CTEST_SUBMIT_PARTS)
+      ctest_submit(PARTS ${DH_CTEST_SUBMIT_PARTS} RETURN_VALUE _result)
+    else()
+      ctest_submit(RETURN_VALUE _result)
+    endif()
+
+    # A spooled part stays in the spool until it has been submitted
+    if(DH_CTEST_SUBMIT_SPOOLED AND _result)
+      message(FATAL_ERROR "Failed to submit ${DH_CTEST_SUBMIT_PARTS}")
+    endif()
 
-  if(DEFINED DH_CTEST_SUBMIT_PARTS)
-    ctest_submit(PARTS ${DH_CTEST_SUBMIT_PARTS})
-  else()
-    ctest_submit()
   endif()
 
-endif()
+endforeach()
@@ -0,0 +1,32 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+# Read by ctest along with CTestTestfile.cmake. While dh_ctest_test runs with
+# DEB_CTEST_OPTIONS=rusage, it sets DH_CTEST_RUSAGE_LAUNCHER, and every test
+# in this directory and below runs through dhcmake/rusage.py. Otherwise the
+# tests run as usual.
+include_guard(GLOBAL)
+
+if(NOT DEFINED ENV{DH_CTEST_RUSAGE_LAUNCHER})
+  return()
+endif()
+
+function(add_test name)
+  set(_launcher "$ENV{DH_CTEST_RUSAGE_LAUNCHER}")
+  if(COMMAND cmake_language)
+    # Quote every argument, so that empty arguments and arguments with
+    # semicolons make it through unchanged
+    set(_args)
+    foreach(_arg IN LISTS _launcher)
+      string(APPEND _args " [==[${_arg}]==]")
+    endforeach()
+    math(EXPR _last "${ARGC} - 1")
+    foreach(_i RANGE 0 ${_last})
+      string(APPEND _args " [==[${ARGV${_i}}]==]")
+    endforeach()
+    cmake_language(EVAL CODE "_add_test([==[${name}]==] ${_args})")
+  else()
+    _add_test("${name}" ${_launcher} "${name}" ${ARGN})
+  endif()
+endfunction()
@@ -0,0 +1,11 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+# dh_ctest_configure passes this as CMAKE_PROJECT_INCLUDE when
+# DEB_CTEST_OPTIONS=rusage is set. The top-level project's CTestTestfile.cmake
+# then includes dh_ctest_rusage.cmake, before any of the tests are added.
+include_guard(GLOBAL)
+
+set_property(DIRECTORY APPEND PROPERTY TEST_INCLUDE_FILES
+  "${CMAKE_CURRENT_LIST_DIR}/dh_ctest_rusage.cmake")
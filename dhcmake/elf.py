@@ -0,0 +1,147 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import concurrent.futures
+import mmap
+import os
+import struct
+
+
+ELF_MAGIC = b"\x7fELF"
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+
+# Below this many files, the process pool costs more than it saves
+SERIAL_SCAN_THRESHOLD = 64
+
+
+class ElfError(Exception):
+    pass
+
+
+class _ElfLayout:
+    def __init__(self, elf_class, elf_data):
+        if elf_data == ELFDATA2LSB:
+            e = "<"
+        elif elf_data == ELFDATA2MSB:
+            e = ">"
+        else:
+            raise ElfError("Invalid ELF data encoding")
+
+        if elf_class == ELFCLASS32:
+            self.header = struct.Struct(e + "28xI10xHH")
+            self.phdr = struct.Struct(e + "III4xI12x")
+            self.dyn = struct.Struct(e + "iI")
+        elif elf_class == ELFCLASS64:
+            self.header = struct.Struct(e + "32xQ14xHH")
+            self.phdr = struct.Struct(e + "I4xQQ8xQ16x")
+            self.dyn = struct.Struct(e + "qQ")
+        else:
+            raise ElfError("Invalid ELF class")
+
+
+def _read_string(data, offset):
+    end = data.find(b"\0", offset)
+    if end < 0:
+        raise ElfError("Unterminated string")
+    return data[offset:end].decode("utf-8", "surrogateescape")
+
+
+def parse_dynamic(data):
+    if data[:4] != ELF_MAGIC:
+        return None
+
+    try:
+        layout = _ElfLayout(data[4], data[5])
+        phoff, phentsize, phnum = layout.header.unpack_from(data, 0)
+
+        loads = []
+        dynamic = None
+        for i in range(phnum):
+            p_type, p_offset, p_vaddr, p_filesz = \
+                layout.phdr.unpack_from(data, phoff + i * phentsize)
+            if p_type == PT_LOAD:
+                loads.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == PT_DYNAMIC:
+                dynamic = (p_offset, p_filesz)
+
+        if dynamic is None:
+            return (None, ())
+
+        strtab_vaddr = None
+        soname_offset = None
+        needed_offsets = []
+        offset, size = dynamic
+        for offset in range(offset, offset + size, layout.dyn.size):
+            d_tag, d_val = layout.dyn.unpack_from(data, offset)
+            if d_tag == DT_NULL:
+                break
+            elif d_tag == DT_NEEDED:
+                needed_offsets.append(d_val)
+            elif d_tag == DT_SONAME:
+                soname_offset = d_val
+            elif d_tag == DT_STRTAB:
+                strtab_vaddr = d_val
+
+        if strtab_vaddr is None:
+            return (None, ())
+
+        for p_vaddr, p_offset, p_filesz in loads:
+            if p_vaddr <= strtab_vaddr < p_vaddr + p_filesz:
+                strtab = strtab_vaddr - p_vaddr + p_offset
+                break
+        else:
+            raise ElfError("DT_STRTAB is outside of any PT_LOAD segment")
+
+        soname = None
+        if soname_offset is not None:
+            soname = _read_string(data, strtab + soname_offset)
+        needed = tuple(_read_string(data, strtab + o) for o in needed_offsets)
+    except (struct.error, IndexError) as e:
+        raise ElfError("Truncated ELF file") from e
+
+    return (soname, needed)
+
+
+def read_dynamic(path):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 64 or f.read(4) != ELF_MAGIC:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_dynamic(data)
+
+
+def _read_dynamic_or_none(path):
+    try:
+        return read_dynamic(path)
+    except (OSError, ElfError):
+        return None
+
+
+def scan(paths, jobs=None):
+    paths = list(paths)
+    if len(paths) < SERIAL_SCAN_THRESHOLD or jobs == 1:
+        results = map(_read_dynamic_or_none, paths)
+    else:
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        chunksize = max(1, len(paths) // (jobs * 8))
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(_read_dynamic_or_none, paths,
+                                        chunksize=chunksize))
+
+    return {path: result for path, result in zip(paths, results)
+            if result is not None}
@@ -0,0 +1,174 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import array
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import sys
+
+
+INDEX_MAGIC = b"DHCMIDX\x01"
+
+_HEADER = struct.Struct("<8sQ")
+_OFFSET = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+
+
+class FileIndexError(Exception):
+    pass
+
+
+def _encode_record(record):
+    return b"\0".join(os.fsencode(field) for field in record)
+
+
+def _decode_record(data):
+    return tuple(os.fsdecode(field) for field in data.split(b"\0"))
+
+
+class _PathView:
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index.get_raw(i).split(b"\0", 1)[0]
+
+
+class InstalledFilesIndex:
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        try:
+            if os.fstat(self.f.fileno()).st_size < _HEADER.size:
+                raise FileIndexError("Truncated installed files index")
+            self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.f.close()
+            raise
+
+        magic, self.count = _HEADER.unpack_from(self.data, 0)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise FileIndexError("Invalid installed files index")
+
+    def close(self):
+        self.data.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def get_raw(self, i):
+        offset, = _OFFSET.unpack_from(self.data, _HEADER.size + 8 * i)
+        length, = _LENGTH.unpack_from(self.data, offset)
+        offset += _LENGTH.size
+        return self.data[offset:offset + length]
+
+    def __getitem__(self, i):
+        return _decode_record(self.get_raw(i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def iter_paths(self):
+        view = _PathView(self)
+        for i in range(self.count):
+            yield view[i]
+
+    def lookup(self, path):
+        key = os.fsencode(path)
+        view = _PathView(self)
+        i = bisect.bisect_left(view, key)
+        result = []
+        while i < self.count and view[i] == key:
+            result.append(self[i])
+            i += 1
+        return result
+
+
+def write_index(path, records):
+    offsets = array.array("Q")
+    tmp_path = path + ".tmp"
+    data_path = path + ".data.tmp"
+
+    with open(data_path, "w+b") as data:
+        previous = None
+        for record in records:
+            encoded = _encode_record(record)
+            if encoded == previous:
+                continue
+            previous = encoded
+            offsets.append(data.tell())
+            data.write(_LENGTH.pack(len(encoded)))
+            data.write(encoded)
+
+        base = _HEADER.size + 8 * len(offsets)
+        for i in range(len(offsets)):
+            offsets[i] += base
+        if sys.byteorder == "big":
+            offsets.byteswap()
+
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, len(offsets)))
+            offsets.tofile(f)
+            data.seek(0)
+            for chunk in iter(lambda: data.read(1 << 20), b""):
+                f.write(chunk)
+
+    os.unlink(data_path)
+    os.replace(tmp_path, path)
+
+
+def _record_key(record):
+    return tuple(os.fsencode(field) for field in record)
+
+
+def update_index(path, new_records):
+    new_records = sorted(new_records, key=_record_key)
+
+    try:
+        index = InstalledFilesIndex(path)
+    except FileNotFoundError:
+        write_index(path, new_records)
+        return
+
+    with index:
+        write_index(path, heapq.merge(index, new_records, key=_record_key))
+
+
+def find_unclaimed(index, directory):
+    staged = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        rel = os.path.relpath(dirpath, directory)
+        for name in filenames:
+            staged.append(os.fsencode(name if rel == "." else
+                                      os.path.join(rel, name)))
+        for name in dirnames:
+            if os.path.islink(os.path.join(dirpath, name)):
+                staged.append(os.fsencode(name if rel == "." else
+                                          os.path.join(rel, name)))
+    staged.sort()
+
+    unclaimed = []
+    claimed = index.iter_paths() if index is not None else iter(())
+    current = next(claimed, None)
+    for path in staged:
+        while current is not None and current < path:
+            current = next(claimed, None)
+        if current != path:
+            unclaimed.append(os.fsdecode(path))
+
+    return unclaimed
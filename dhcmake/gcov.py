@@ -0,0 +1,104 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+# dh_ctest_driver.cmake runs this file as a script in place of gcov, so it
+# must only use the standard library.
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+
+GCOV_COMMAND = "gcov"
+GCDA_SUFFIX = ".gcda"
+GCOV_SUFFIX = ".gcov"
+
+_STDOUT_FILE = "stdout"
+_STDERR_FILE = "stderr"
+_STATUS_FILE = "status"
+
+
+def find_gcda_files(build_dir):
+    # Every object directory, with the .gcda files in it
+    directories = {}
+    for dirpath, dirnames, filenames in os.walk(build_dir):
+        dirnames.sort()
+        gcda_files = sorted(os.path.join(dirpath, f) for f in filenames
+                            if f.endswith(GCDA_SUFFIX))
+        if gcda_files:
+            directories[dirpath] = gcda_files
+    return directories
+
+
+def get_gcov_args(gcda_file):
+    # The same arguments that ctest_coverage() passes to gcov. gcov runs in
+    # a directory of its own, so the paths have to be absolute.
+    gcda_file = os.path.abspath(gcda_file)
+    return ["-o", os.path.dirname(gcda_file), gcda_file]
+
+
+def get_output_directory(cache_dir, args):
+    # ctest_coverage() passes absolute paths, which may or may not go through
+    # the same symlinks, so the paths are resolved before they are hashed
+    key = [a if a.startswith("-") else os.path.realpath(a) for a in args]
+    return os.path.join(cache_dir, hashlib.sha1(
+        json.dumps(key).encode("utf-8")).hexdigest())
+
+
+def run_gcov(cache_dir, gcov_command, args):
+    # gcov writes its .gcov files to the current directory, so every run
+    # gets its own. The output goes straight to disk, however large it is.
+    output_dir = get_output_directory(cache_dir, args)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, _STDOUT_FILE), "wb") as stdout, \
+            open(os.path.join(output_dir, _STDERR_FILE), "wb") as stderr:
+        returncode = subprocess.run([gcov_command, *args], stdout=stdout,
+                                    stderr=stderr, cwd=output_dir).returncode
+
+    # Written last, so that gcov runs again if this one did not finish
+    with open(os.path.join(output_dir, _STATUS_FILE), "w") as f:
+        f.write("%i\n" % returncode)
+    return returncode
+
+
+def run_directory(cache_dir, gcov_command, gcda_files):
+    for gcda_file in gcda_files:
+        run_gcov(cache_dir, gcov_command, get_gcov_args(gcda_file))
+
+
+def replay(cache_dir, gcov_command, args):
+    output_dir = get_output_directory(cache_dir, args)
+    try:
+        with open(os.path.join(output_dir, _STATUS_FILE), "r") as f:
+            returncode = int(f.read())
+    except (FileNotFoundError, ValueError):
+        return subprocess.run([gcov_command, *args]).returncode
+
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith(GCOV_SUFFIX):
+            shutil.copyfile(os.path.join(output_dir, name), name)
+    for name, stream in [(_STDOUT_FILE, sys.stdout),
+                         (_STDERR_FILE, sys.stderr)]:
+        stream.flush()
+        with open(os.path.join(output_dir, name), "rb") as f:
+            shutil.copyfileobj(f, stream.buffer)
+        stream.flush()
+    return returncode
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    cache_dir, gcov_command, *gcov_args = args
+
+    # ctest_coverage() runs gcov for one .gcda file at a time, after
+    # dh_ctest_coverage already ran them all in parallel
+    return replay(cache_dir, gcov_command, gcov_args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
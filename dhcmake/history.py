@@ -0,0 +1,297 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import argparse
+import math
+import os
+import resource
+import sqlite3
+import statistics
+
+import debian.debian_support
+
+
+HISTORY_FILE = "history.sqlite"
+
+PASSED = "passed"
+FAILED = "failed"
+
+# Builds of different packages may share the database at the same time
+LOCK_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS steps (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    version TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    step TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    user_time REAL,
+    system_time REAL,
+    max_rss INTEGER,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_key ON steps (source, arch, step);
+CREATE TABLE IF NOT EXISTS tests (
+    step_id INTEGER NOT NULL REFERENCES steps (id),
+    name TEXT NOT NULL,
+    duration REAL NOT NULL,
+    user_time REAL,
+    system_time REAL,
+    max_rss INTEGER,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_step ON tests (step_id);
+"""
+
+_USAGE_COLUMNS = ["user_time", "system_time", "max_rss"]
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def get_usage():
+    # The tool itself and everything it ran. ru_maxrss is in kilobytes, and
+    # is the largest single process rather than a total.
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "user_time": usage_self.ru_utime + usage_children.ru_utime,
+        "system_time": usage_self.ru_stime + usage_children.ru_stime,
+        "max_rss": max(usage_self.ru_maxrss, usage_children.ru_maxrss),
+    }
+
+
+def get_usage_since(before):
+    after = get_usage()
+    return {
+        "user_time": round(after["user_time"] - before["user_time"], 6),
+        "system_time": round(after["system_time"] - before["system_time"],
+                             6),
+        "max_rss": after["max_rss"],
+    }
+
+
+def record_step(path, key, step, started, duration, usage, outcome,
+                tests=()):
+    conn = connect(path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO steps (source, version, arch, step, started, "
+                "duration, user_time, system_time, max_rss, outcome) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key["source"], key["version"], key["arch"], step, started,
+                 duration, *(usage.get(c) for c in _USAGE_COLUMNS), outcome))
+            step_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO tests (step_id, name, duration, user_time, "
+                "system_time, max_rss, outcome) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((step_id, t["name"], t["time"],
+                  *(t.get(c) for c in _USAGE_COLUMNS), t["status"])
+                 for t in tests))
+    finally:
+        conn.close()
+    return step_id
+
+
+def read_series(conn, source=None, arch=None, step=None, tests=False):
+    # Durations and peak memory of every run, grouped by what ran and then
+    # by version
+    conditions = []
+    params = []
+    for column, value in [("source", source), ("arch", arch),
+                          ("step", step)]:
+        if value is not None:
+            conditions.append("steps.%s = ?" % column)
+            params.append(value)
+    where = " AND ".join(conditions) or "1"
+
+    if tests:
+        query = ("SELECT steps.source, steps.arch, steps.step, tests.name, "
+                 "steps.version, tests.duration, tests.max_rss, "
+                 "tests.outcome FROM tests "
+                 "JOIN steps ON tests.step_id = steps.id WHERE %s "
+                 "ORDER BY steps.started" % where)
+    else:
+        query = ("SELECT source, arch, step, NULL, version, duration, "
+                 "max_rss, outcome FROM steps WHERE %s "
+                 "ORDER BY started" % where)
+
+    series = {}
+    for source, arch, step, test, version, duration, max_rss, outcome in \
+            conn.execute(query, params):
+        versions = series.setdefault((source, arch, step, test), {})
+        versions.setdefault(version, []).append({
+            "duration": duration,
+            "max_rss": max_rss,
+            "outcome": outcome,
+        })
+
+    return {key: sorted(versions.items(),
+                        key=lambda v: debian.debian_support.Version(v[0]))
+            for key, versions in series.items()}
+
+
+def mann_whitney_p(before, after):
+    # One-sided Mann-Whitney U test that the values in "after" tend to be
+    # larger, with the normal approximation and a correction for ties. Build
+    # times are skewed and have outliers, so ranks work better than means.
+    n1 = len(before)
+    n2 = len(after)
+    values = sorted([(v, 0) for v in before] + [(v, 1) for v in after])
+
+    rank_sum = 0.0
+    tie_term = 0
+    i = 0
+    while i < len(values):
+        j = i
+        while j < len(values) and values[j][0] == values[i][0]:
+            j += 1
+        rank = (i + j + 1) / 2
+        rank_sum += rank * sum(1 for v in values[i:j] if v[1] == 1)
+        tie_term += (j - i) ** 3 - (j - i)
+        i = j
+
+    u = rank_sum - n2 * (n2 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 1 - statistics.NormalDist().cdf(z)
+
+
+def summarize(runs):
+    durations = [r["duration"] for r in runs if r["outcome"] == PASSED]
+    memory = [r["max_rss"] for r in runs if r["max_rss"] is not None]
+    return {
+        "runs": len(runs),
+        "failed": sum(1 for r in runs if r["outcome"] != PASSED),
+        "durations": durations,
+        "mean": statistics.mean(durations) if durations else None,
+        "stdev": statistics.stdev(durations) if len(durations) > 1 else None,
+        "max_rss": max(memory) if memory else None,
+    }
+
+
+def find_regressions(versions, alpha=0.05, threshold=0.1, min_runs=3):
+    # Only passing runs count, as a failure can end a step early
+    regressions = []
+    summaries = [(v, summarize(runs)) for v, runs in versions]
+    for (old_version, old), (new_version, new) in zip(summaries,
+                                                      summaries[1:]):
+        if len(old["durations"]) < min_runs or \
+                len(new["durations"]) < min_runs:
+            continue
+        change = new["mean"] / old["mean"] - 1 if old["mean"] else math.inf
+        p = mann_whitney_p(old["durations"], new["durations"])
+        if change >= threshold and p < alpha:
+            regressions.append({
+                "from": old_version,
+                "to": new_version,
+                "change": change,
+                "p": p,
+            })
+
+    return regressions
+
+
+def _format_seconds(value):
+    return "-" if value is None else "%.2fs" % value
+
+
+def format_report(series, alpha=0.05, threshold=0.1, min_runs=3,
+                  regressions_only=False):
+    lines = []
+    for (source, arch, step, test), versions in sorted(
+            series.items(), key=lambda i: tuple(x or "" for x in i[0])):
+        regressions = find_regressions(versions, alpha, threshold, min_runs)
+        if regressions_only and not regressions:
+            continue
+
+        title = "%s %s %s" % (source, arch, step)
+        if test is not None:
+            title += " " + test
+        lines.append(title)
+        for version, runs in versions:
+            summary = summarize(runs)
+            line = "  %s: %i runs, %i failed, mean %s, stdev %s" % (
+                version, summary["runs"], summary["failed"],
+                _format_seconds(summary["mean"]),
+                _format_seconds(summary["stdev"]))
+            if summary["max_rss"] is not None:
+                line += ", peak %i MiB" % -(-summary["max_rss"] // 1024)
+            lines.append(line)
+        for r in regressions:
+            lines.append("  SLOWER: %s -> %s: %+.1f%% (p = %.3f)" % (
+                r["from"], r["to"], r["change"] * 100, r["p"]))
+
+    return lines
+
+
+def make_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="dh_cmake_history",
+        description="Report the build step history recorded by dh-cmake")
+    parser.add_argument(
+        "--cache-dir", action="store",
+        default=os.environ.get("DH_CMAKE_CACHE_DIR"),
+        help="Directory containing the history database (default: "
+             "$DH_CMAKE_CACHE_DIR)")
+    parser.add_argument(
+        "--source", action="store", help="Only report this source package")
+    parser.add_argument(
+        "--arch", action="store", help="Only report this architecture")
+    parser.add_argument(
+        "--step", action="store", help="Only report this step")
+    parser.add_argument(
+        "--tests", action="store_true",
+        help="Report individual tests instead of steps")
+    parser.add_argument(
+        "--regressions", action="store_true",
+        help="Only report steps that got slower")
+    parser.add_argument(
+        "--alpha", action="store", type=float, default=0.05,
+        help="Significance level for slowdowns")
+    parser.add_argument(
+        "--threshold", action="store", type=float, default=0.1,
+        help="Smallest relative slowdown to report")
+    parser.add_argument(
+        "--min-runs", action="store", type=int, default=3,
+        help="Passing runs of each version needed to compare them")
+    return parser
+
+
+def main(args=None):
+    parser = make_arg_parser()
+    options = parser.parse_args(args)
+    if options.cache_dir is None:
+        parser.error("no cache directory, set DH_CMAKE_CACHE_DIR or use "
+                     "--cache-dir")
+
+    path = os.path.join(options.cache_dir, HISTORY_FILE)
+    if not os.path.exists(path):
+        return 0
+
+    conn = connect(path)
+    try:
+        series = read_series(conn, source=options.source, arch=options.arch,
+                             step=options.step, tests=options.tests)
+    finally:
+        conn.close()
+
+    lines = format_report(series, alpha=options.alpha,
+                          threshold=options.threshold,
+                          min_runs=options.min_runs,
+                          regressions_only=options.regressions)
+    for line in lines:
+        print(line)
+    return 0
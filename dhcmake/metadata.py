@@ -0,0 +1,318 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import json
+import os
+import struct
+import sys
+
+
+SIDECAR_MAGIC = b"DHCPKMD\x02"
+
+_NO_STRING = 0xFFFFFFFF
+
+
+class MetadataError(Exception):
+    pass
+
+
+class Component:
+    __slots__ = ("name", "dependencies")
+
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+
+
+class ComponentGroup:
+    __slots__ = ("name", "components", "subgroups")
+
+    def __init__(self, name, components, subgroups):
+        self.name = name
+        self.components = components
+        self.subgroups = subgroups
+
+
+class Project:
+    __slots__ = ("directory", "components", "flavor", "build_type",
+                 "strip_files")
+
+    def __init__(self, directory, components, flavor=None, build_type=None,
+                 strip_files=False):
+        self.directory = directory
+        self.components = components
+        self.flavor = flavor
+        self.build_type = build_type
+        self.strip_files = strip_files
+
+    def get_install_component(self, component):
+        if self.flavor is None:
+            return component
+        return component[len(self.flavor) + 1:]
+
+
+class CPackMetadata:
+    __slots__ = ("components", "component_groups", "projects", "build_type",
+                 "strip_files")
+
+    def __init__(self, components, component_groups, projects,
+                 build_type=None, strip_files=False):
+        self.components = components
+        self.component_groups = component_groups
+        self.projects = projects
+        self.build_type = build_type
+        self.strip_files = strip_files
+
+
+def _intern_all(strings):
+    return tuple(sys.intern(s) for s in strings)
+
+
+def _intern_optional(s):
+    if s is None:
+        return None
+    return sys.intern(s)
+
+
+def flavor_name(flavor, name):
+    return "%s:%s" % (flavor, name)
+
+
+def merge_json_data(flavors, extra_dependencies=None):
+    components = {}
+    component_groups = {}
+    projects = []
+
+    for flavor, data in flavors:
+        def ns(name):
+            return flavor_name(flavor, name)
+
+        for name, c in data["components"].items():
+            c = dict(c, name=ns(name),
+                     dependencies=[ns(d) for d in c["dependencies"]])
+            if "group" in c:
+                c["group"] = ns(c["group"])
+            components[ns(name)] = c
+
+        for name, g in data["componentGroups"].items():
+            g = dict(g, name=ns(name),
+                     components=[ns(c) for c in g["components"]],
+                     subgroups=[ns(s) for s in g["subgroups"]])
+            if "parentGroup" in g:
+                g["parentGroup"] = ns(g["parentGroup"])
+            component_groups[ns(name)] = g
+
+        for p in data["projects"]:
+            p = dict(p, flavor=flavor,
+                     components=[ns(c) for c in p["components"]],
+                     stripFiles=data["stripFiles"])
+            if "buildType" in data:
+                p["buildType"] = data["buildType"]
+            projects.append(p)
+
+    for component, deps in (extra_dependencies or {}).items():
+        for name in (component, *deps):
+            if name not in components:
+                raise MetadataError("Invalid CPack component: %s" % name)
+        components[component]["dependencies"] = \
+            components[component]["dependencies"] + \
+            [d for d in deps
+             if d not in components[component]["dependencies"]]
+
+    return {
+        "formatVersionMajor": 1,
+        "formatVersionMinor": 0,
+        "components": components,
+        "componentGroups": component_groups,
+        "projects": projects,
+        "stripFiles": False,
+    }
+
+
+def from_json_data(data):
+    components = {}
+    for name, c in data["components"].items():
+        name = sys.intern(name)
+        components[name] = Component(name, _intern_all(c["dependencies"]))
+
+    component_groups = {}
+    for name, g in data["componentGroups"].items():
+        name = sys.intern(name)
+        component_groups[name] = ComponentGroup(
+            name, _intern_all(g["components"]), _intern_all(g["subgroups"]))
+
+    build_type = _intern_optional(data.get("buildType"))
+    strip_files = bool(data["stripFiles"])
+
+    projects = [Project(p["directory"], frozenset(_intern_all(p["components"])),
+                        flavor=_intern_optional(p.get("flavor")),
+                        build_type=_intern_optional(
+                            p.get("buildType", build_type)),
+                        strip_files=bool(p.get("stripFiles", strip_files)))
+                for p in data["projects"]]
+
+    return CPackMetadata(components, component_groups, projects,
+                         build_type=build_type, strip_files=strip_files)
+
+
+def read_json(f):
+    return from_json_data(json.load(f))
+
+
+class _SidecarWriter:
+    def __init__(self):
+        self.strings = {}
+        self.body = bytearray()
+
+    def u32(self, value):
+        self.body += struct.pack("<I", value)
+
+    def string(self, value):
+        if value is None:
+            self.u32(_NO_STRING)
+        else:
+            self.u32(self.strings.setdefault(value, len(self.strings)))
+
+    def string_list(self, values):
+        self.u32(len(values))
+        for value in values:
+            self.string(value)
+
+    def getvalue(self, mtime_ns, size):
+        header = bytearray(SIDECAR_MAGIC)
+        header += struct.pack("<QQI", mtime_ns, size, len(self.strings))
+        for s in self.strings:
+            encoded = s.encode("utf-8")
+            header += struct.pack("<I", len(encoded))
+            header += encoded
+        return bytes(header + self.body)
+
+
+class _SidecarReader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = len(SIDECAR_MAGIC)
+        self.strings = []
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def u32(self):
+        return self.unpack("<I")[0]
+
+    def read_string_table(self, count):
+        for _ in range(count):
+            length = self.u32()
+            end = self.offset + length
+            self.strings.append(sys.intern(
+                self.data[self.offset:end].decode("utf-8")))
+            self.offset = end
+
+    def string(self):
+        index = self.u32()
+        if index == _NO_STRING:
+            return None
+        return self.strings[index]
+
+    def string_list(self):
+        return tuple(self.string() for _ in range(self.u32()))
+
+
+def encode_sidecar(metadata, mtime_ns, size):
+    w = _SidecarWriter()
+
+    w.string(metadata.build_type)
+    w.u32(1 if metadata.strip_files else 0)
+
+    w.u32(len(metadata.components))
+    for c in metadata.components.values():
+        w.string(c.name)
+        w.string_list(c.dependencies)
+
+    w.u32(len(metadata.component_groups))
+    for g in metadata.component_groups.values():
+        w.string(g.name)
+        w.string_list(g.components)
+        w.string_list(g.subgroups)
+
+    w.u32(len(metadata.projects))
+    for p in metadata.projects:
+        w.string(p.directory)
+        w.string_list(sorted(p.components))
+        w.string(p.flavor)
+        w.string(p.build_type)
+        w.u32(1 if p.strip_files else 0)
+
+    return w.getvalue(mtime_ns, size)
+
+
+def decode_sidecar(data, mtime_ns=None, size=None):
+    if data[:len(SIDECAR_MAGIC)] != SIDECAR_MAGIC:
+        raise MetadataError("Invalid CPack metadata sidecar")
+
+    try:
+        r = _SidecarReader(data)
+        sidecar_mtime_ns, sidecar_size, nstrings = r.unpack("<QQI")
+        if mtime_ns is not None and \
+                (sidecar_mtime_ns, sidecar_size) != (mtime_ns, size):
+            return None
+        r.read_string_table(nstrings)
+
+        build_type = r.string()
+        strip_files = bool(r.u32())
+
+        components = {}
+        for _ in range(r.u32()):
+            name = r.string()
+            components[name] = Component(name, r.string_list())
+
+        component_groups = {}
+        for _ in range(r.u32()):
+            name = r.string()
+            component_groups[name] = ComponentGroup(
+                name, r.string_list(), r.string_list())
+
+        projects = []
+        for _ in range(r.u32()):
+            directory = r.string()
+            project_components = frozenset(r.string_list())
+            projects.append(Project(directory, project_components,
+                                    flavor=r.string(),
+                                    build_type=r.string(),
+                                    strip_files=bool(r.u32())))
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise MetadataError("Truncated CPack metadata sidecar")
+
+    return CPackMetadata(components, component_groups, projects,
+                         build_type=build_type, strip_files=strip_files)
+
+
+def get_sidecar_path(json_path):
+    return os.path.splitext(json_path)[0] + ".bin"
+
+
+def load(json_path, write_sidecar=True):
+    sidecar_path = get_sidecar_path(json_path)
+    st = os.stat(json_path)
+
+    try:
+        with open(sidecar_path, "rb") as f:
+            result = decode_sidecar(f.read(), st.st_mtime_ns, st.st_size)
+    except (FileNotFoundError, MetadataError):
+        result = None
+    if result is not None:
+        return result
+
+    with open(json_path, "r") as f:
+        result = read_json(f)
+
+    if write_sidecar:
+        tmp_path = sidecar_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encode_sidecar(result, st.st_mtime_ns, st.st_size))
+        os.replace(tmp_path, sidecar_path)
+
+    return result
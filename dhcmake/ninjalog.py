@@ -0,0 +1,177 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import re
+
+
+NINJA_LOG_FILE = ".ninja_log"
+
+_GRAPH_EDGE = re.compile("^\"([^\"]+)\" -> \"([^\"]+)\"")
+_GRAPH_NODE = re.compile(
+    "^\"([^\"]+)\" \\[label=\"(.*)\"(, shape=ellipse)?\\]$")
+
+
+def read_ninja_log(f):
+    # Each line is start and end time in milliseconds, mtime, output and
+    # command hash. A command with several outputs has one line for each.
+    steps = {}
+    outputs = set()
+    last_end = None
+    for line in f:
+        if line.startswith("#"):
+            continue
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 5:
+            continue
+        start, end = int(fields[0]), int(fields[1])
+
+        # The log keeps growing, so only look at the last run of ninja. The
+        # clock starts from 0 for every run, and every run builds an output
+        # at most once.
+        if (last_end is not None and end < last_end) or \
+                fields[3] in outputs:
+            steps = {}
+            outputs = set()
+        last_end = end
+        outputs.add(fields[3])
+
+        key = (start, end, fields[4])
+        step = steps.get(key)
+        if step is None:
+            step = steps[key] = {
+                "outputs": [],
+                "start": start / 1000,
+                "end": end / 1000,
+                "duration": (end - start) / 1000,
+            }
+        step["outputs"].append(fields[3])
+    return list(steps.values())
+
+
+def read_ninja_graph(f):
+    # Reads the output of "ninja -t graph", and returns the inputs of every
+    # output. Edges with more than one input or output are drawn as an
+    # ellipse, with the inputs pointing to it and it pointing to the outputs.
+    labels = {}
+    rules = set()
+    edges = []
+    for line in f:
+        line = line.strip()
+        match = _GRAPH_EDGE.match(line)
+        if match:
+            edges.append((match.group(1), match.group(2)))
+            continue
+        match = _GRAPH_NODE.match(line)
+        if match:
+            labels[match.group(1)] = match.group(2)
+            if match.group(3):
+                rules.add(match.group(1))
+
+    # Outputs that nothing depends on are not labeled, so leave them out
+    inputs = {}
+    rule_inputs = {}
+    rule_outputs = {}
+    for a, b in edges:
+        if b in rules:
+            rule_inputs.setdefault(b, []).append(labels[a])
+        elif a not in labels or b not in labels:
+            continue
+        elif a in rules:
+            rule_outputs.setdefault(a, []).append(labels[b])
+        else:
+            inputs.setdefault(labels[b], set()).add(labels[a])
+    for rule, outputs in rule_outputs.items():
+        for output in outputs:
+            inputs.setdefault(output, set()).update(
+                rule_inputs.get(rule, []))
+    return inputs
+
+
+def get_critical_path(steps, inputs):
+    # The longest chain of dependent steps, by how long each step took in
+    # this build. Nothing in the build could have finished sooner.
+    producers = {}
+    for step in steps:
+        for output in step["outputs"]:
+            producers[output] = step
+
+    # Longest chain ending in each node, and the node before it
+    longest = {}
+    for root in [*inputs, *producers]:
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if node in longest:
+                continue
+            if not visited:
+                stack.append((node, True))
+                stack.extend((i, False) for i in inputs.get(node, ())
+                             if i not in longest)
+                continue
+
+            length, previous = 0.0, None
+            for i in inputs.get(node, ()):
+                if longest.get(i, (0.0,))[0] > length:
+                    length, previous = longest[i][0], i
+            step = producers.get(node)
+            if step is not None:
+                length += step["duration"]
+            longest[node] = (length, previous)
+
+    if not longest:
+        return 0.0, []
+
+    node = max(longest, key=lambda n: longest[n][0])
+    length = longest[node][0]
+    path = []
+    while node is not None:
+        step = producers.get(node)
+        if step is not None and (not path or path[-1] is not step):
+            path.append(step)
+        node = longest[node][1]
+    path.reverse()
+    return length, path
+
+
+def analyze_ninja_log(steps, inputs=None):
+    steps = sorted(steps, key=lambda s: (-s["duration"], s["outputs"]))
+    build_time = 0.0
+    if steps:
+        build_time = max(s["end"] for s in steps) - \
+            min(s["start"] for s in steps)
+    work_time = sum(s["duration"] for s in steps)
+
+    report = {
+        "build_time": build_time,
+        "work_time": work_time,
+        "parallelism": work_time / build_time if build_time else None,
+        "steps": steps,
+        "critical_path": None,
+    }
+    if inputs is not None:
+        length, path = get_critical_path(steps, inputs)
+        report["critical_path"] = {"time": length, "steps": path}
+    return report
+
+
+def format_summary(report, slowest=10):
+    lines = ["Build took %.2f s: %i steps, %.2f s of work" % (
+        report["build_time"], len(report["steps"]), report["work_time"])]
+    if report["parallelism"] is not None:
+        lines[0] += ", parallelism %.2f" % report["parallelism"]
+
+    critical_path = report["critical_path"]
+    if critical_path is not None and critical_path["steps"]:
+        lines.append("Critical path (%.2f s):" % critical_path["time"])
+        for step in critical_path["steps"]:
+            lines.append("\t%8.2f s  %s" % (step["duration"],
+                                            step["outputs"][0]))
+
+    if report["steps"] and slowest:
+        lines.append("Slowest steps:")
+        for step in report["steps"][:slowest]:
+            lines.append("\t%8.2f s  %s" % (step["duration"],
+                                            step["outputs"][0]))
+
+    return lines
@@ -0,0 +1,114 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import json
+import os
+
+
+CGROUP_DIR = "/sys/fs/cgroup"
+PROC_CGROUP_FILE = "/proc/self/cgroup"
+
+
+def get_threads():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _get_cgroup_path(proc_cgroup):
+    # The cgroup v2 entry is the one with hierarchy 0 and no controllers
+    try:
+        with open(proc_cgroup, "r") as f:
+            for line in f:
+                hierarchy, controllers, path = line.rstrip("\n").split(":", 2)
+                if hierarchy == "0" and not controllers:
+                    return path
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _get_cgroup_memory_limit(cgroup_dir=CGROUP_DIR,
+                             proc_cgroup=PROC_CGROUP_FILE):
+    path = _get_cgroup_path(proc_cgroup)
+    if path is None:
+        return None
+
+    # Every ancestor's limit applies too, and the root has none of its own
+    cgroup_dir = os.path.normpath(cgroup_dir)
+    directory = os.path.normpath(os.path.join(cgroup_dir, path.lstrip("/")))
+    if os.path.commonpath([cgroup_dir, directory]) != cgroup_dir:
+        return None
+    limits = []
+    while True:
+        try:
+            with open(os.path.join(directory, "memory.max"), "r") as f:
+                limit = f.read().strip()
+            with open(os.path.join(directory, "memory.current"), "r") as f:
+                current = int(f.read().strip())
+            if limit != "max":
+                limits.append(max(int(limit) - current, 0))
+        except (OSError, ValueError):
+            pass
+
+        if directory == cgroup_dir:
+            break
+        directory = os.path.dirname(directory)
+
+    return min(limits) if limits else None
+
+
+def get_available_memory():
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    if available is None:
+        available = os.sysconf("SC_AVPHYS_PAGES") * \
+            os.sysconf("SC_PAGE_SIZE")
+
+    limit = _get_cgroup_memory_limit()
+    if limit is not None:
+        available = min(available, limit)
+
+    # In MiB
+    return available // (1024 * 1024)
+
+
+def make_resource_spec(threads, memory):
+    return {
+        "version": {
+            "major": 1,
+            "minor": 0,
+        },
+        "local": [
+            {
+                "threads": [
+                    {
+                        "id": "0",
+                        "slots": threads,
+                    },
+                ],
+                "memory": [
+                    {
+                        "id": "0",
+                        "slots": memory,
+                    },
+                ],
+            },
+        ],
+    }
+
+
+def write_resource_spec(f, shares=1):
+    threads = max(get_threads() // shares, 1)
+    memory = max(get_available_memory() // shares, 1)
+    json.dump(make_resource_spec(threads, memory), f, indent=2)
+    f.write("\n")
@@ -0,0 +1,109 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+# dh_ctest_rusage.cmake runs every test through this file as a script, so it
+# must only use the standard library.
+
+import json
+import os
+import re
+import signal
+import sys
+
+
+RUSAGE_SUFFIX = ".json"
+
+# Key, CDash measurement name, and measurement type
+MEASUREMENTS = [
+    ("max_rss", "Peak Memory (KiB)", "numeric/integer"),
+    ("user_time", "User CPU Time (s)", "numeric/double"),
+    ("system_time", "System CPU Time (s)", "numeric/double"),
+    ("voluntary_context_switches", "Voluntary Context Switches",
+     "numeric/integer"),
+    ("involuntary_context_switches", "Involuntary Context Switches",
+     "numeric/integer"),
+]
+
+_FORWARDED_SIGNALS = [signal.SIGHUP, signal.SIGINT, signal.SIGTERM]
+
+
+def get_rusage_file(directory, name):
+    return os.path.join(directory,
+                        re.sub("[^A-Za-z0-9._+-]", "_", name) + RUSAGE_SUFFIX)
+
+
+def get_usage(rusage):
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "max_rss": rusage.ru_maxrss,
+        "user_time": round(rusage.ru_utime, 6),
+        "system_time": round(rusage.ru_stime, 6),
+        "voluntary_context_switches": rusage.ru_nvcsw,
+        "involuntary_context_switches": rusage.ru_nivcsw,
+    }
+
+
+def format_measurements(usage):
+    return "".join(
+        "<DartMeasurement name=\"%s\" type=\"%s\">%s</DartMeasurement>\n"
+        % (name, type, usage[key]) for key, name, type in MEASUREMENTS)
+
+
+def read_usage(directory, name):
+    with open(get_rusage_file(directory, name), "r") as f:
+        return json.load(f)
+
+
+def run(args):
+    pid = os.posix_spawnp(args[0], args, os.environ)
+
+    # If ctest stops the test, stop the command as well
+    def forward(signum, frame):
+        os.kill(pid, signum)
+
+    old_handlers = {s: signal.signal(s, forward) for s in _FORWARDED_SIGNALS}
+    try:
+        pid, status, rusage = os.wait4(pid, 0)
+    finally:
+        for s, handler in old_handlers.items():
+            signal.signal(s, handler)
+    return status, rusage
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    # dh_ctest_build only wants the file, not measurements in the build log
+    quiet = args[:1] == ["--quiet"]
+    if quiet:
+        args = args[1:]
+    directory, name, *command = args
+
+    try:
+        status, rusage = run(command)
+    except OSError as e:
+        print("%s: %s" % (command[0], e.strerror), file=sys.stderr)
+        return 127
+
+    usage = get_usage(rusage)
+    os.makedirs(directory, exist_ok=True)
+    with open(get_rusage_file(directory, name), "w") as f:
+        json.dump({"name": name, **usage}, f, indent=2)
+        f.write("\n")
+
+    # ctest turns these into named measurements in Test.xml
+    if not quiet:
+        sys.stdout.write(format_measurements(usage))
+        sys.stdout.flush()
+
+    if os.WIFSIGNALED(status):
+        # Die the same way, so that ctest reports the same failure
+        signum = os.WTERMSIG(status)
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+    return os.WEXITSTATUS(status)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import traceback
+
+
+# The order in which ctest_submit() itself submits parts
+PART_ORDER = ["Start", "Update", "Configure", "Build", "Test", "Coverage",
+              "MemCheck", "Notes", "ExtraFiles", "Upload", "Submit", "Done"]
+
+LOCK_FILE = ".lock"
+LOG_FILE = ".log"
+
+_CLAIMED_SUFFIX = ".submitting"
+_TAG_SUFFIX = ".tagging"
+
+
+def _part_key(part):
+    try:
+        return (PART_ORDER.index(part), part)
+    except ValueError:
+        return (len(PART_ORDER), part)
+
+
+def list_parts(spool_dir):
+    try:
+        names = os.listdir(spool_dir)
+    except FileNotFoundError:
+        return []
+    return sorted((n for n in names if not n.startswith(".")), key=_part_key)
+
+
+def lock(spool_dir, blocking=True):
+    os.makedirs(spool_dir, exist_ok=True)
+    f = open(os.path.join(spool_dir, LOCK_FILE), "a")
+    try:
+        if blocking:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def _recover(spool_dir):
+    # A worker that died while submitting leaves its part claimed
+    for name in os.listdir(spool_dir):
+        if name.startswith(".") and name.endswith(_CLAIMED_SUFFIX):
+            claimed = os.path.join(spool_dir, name)
+            entry = os.path.join(spool_dir, name[1:-len(_CLAIMED_SUFFIX)])
+            if os.path.exists(entry):
+                os.unlink(claimed)
+            else:
+                os.rename(claimed, entry)
+
+
+def tag_parts(spool_dir, snapshot):
+    # Every part spooled so far gets submitted from this snapshot. A part
+    # spooled again later gets the later snapshot.
+    for part in list_parts(spool_dir):
+        tmp = os.path.join(spool_dir, "." + part + _TAG_SUFFIX)
+        with open(tmp, "w") as f:
+            f.write(snapshot)
+        os.replace(tmp, os.path.join(spool_dir, part))
+
+
+def _read_tag(path):
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def drain(spool_dir, submit, skip=(), snapshot=None):
+    _recover(spool_dir)
+
+    failed = []
+    for part in list_parts(spool_dir):
+        if part in skip:
+            continue
+
+        entry = os.path.join(spool_dir, part)
+        claimed = os.path.join(spool_dir, "." + part + _CLAIMED_SUFFIX)
+        os.rename(entry, claimed)
+        # Left to the worker with the snapshot the part was tagged with
+        if snapshot is not None and _read_tag(claimed) != snapshot:
+            submitted = False
+        else:
+            try:
+                submitted = submit(part)
+            except BaseException:
+                _recover(spool_dir)
+                raise
+            if not submitted:
+                failed.append(part)
+
+        # If the part was spooled again in the meantime, the new entry
+        # takes the place of the claimed one
+        if submitted or os.path.exists(entry):
+            os.unlink(claimed)
+        else:
+            os.rename(claimed, entry)
+
+    return failed
+
+
+def work(spool_dir, submit, snapshot=None):
+    # Workers take turns, so each one waits for the ones before it
+    with lock(spool_dir):
+        return drain(spool_dir, submit, snapshot=snapshot)
+
+
+def start_worker(spool_dir, args):
+    # In a session of its own, so that it keeps going after the build step
+    # that started it exits
+    with open(os.path.join(spool_dir, LOG_FILE), "a") as log:
+        return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log,
+                                stderr=log, start_new_session=True)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    spool_dir, snapshot, *submit_args = args
+
+    def submit(part):
+        result = subprocess.run(
+            [*submit_args, "-DDH_CTEST_SUBMIT_PARTS:STRING=" + part],
+            stdin=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    try:
+        work(spool_dir, submit, snapshot)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        shutil.rmtree(os.path.join(spool_dir, snapshot), ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import hashlib
+import json
+import os
+
+from dhcmake import elf
+
+
+TEST_RESULTS_FILE = "test-results.json"
+
+# Where CMake keeps object files, which are never loaded by a test
+_SKIPPED_DIRECTORY = "CMakeFiles"
+
+
+def find_objects(build_dir, jobs=None):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(build_dir):
+        dirnames[:] = sorted(d for d in dirnames if d != _SKIPPED_DIRECTORY)
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path) and not os.path.islink(path):
+                paths.append(path)
+
+    return elf.scan(paths, jobs=jobs)
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Fingerprinter:
+    def __init__(self, build_dir, objects, environment):
+        self.build_dir = build_dir
+        self.objects = objects
+        self.environment = environment
+        self.providers = {}
+        for path, (soname, _) in sorted(objects.items()):
+            self.providers.setdefault(soname or os.path.basename(path), path)
+        self.hashes = {}
+
+    def hash_file(self, path):
+        try:
+            return self.hashes[path]
+        except KeyError:
+            pass
+
+        try:
+            digest = _hash_file(path)
+        except FileNotFoundError:
+            digest = None
+        self.hashes[path] = digest
+        return digest
+
+    def get_libraries(self, path):
+        # Shared libraries from the build tree that the file loads, directly
+        # or through another library
+        libraries = set()
+        pending = [path]
+        while pending:
+            _, needed = self.objects.get(pending.pop(), (None, ()))
+            for soname in needed:
+                library = self.providers.get(soname)
+                if library is not None and library not in libraries:
+                    libraries.add(library)
+                    pending.append(library)
+        return libraries
+
+    def get_fingerprint(self, test):
+        # CTest leaves out the command if the executable was not built
+        command = test.get("command")
+        if not command:
+            return None
+
+        properties = {p["name"]: p["value"]
+                      for p in test.get("properties", [])}
+        cwd = properties.get("WORKING_DIRECTORY", self.build_dir)
+
+        paths = set()
+        for arg in command:
+            path = os.path.join(cwd, arg)
+            if os.path.isfile(path):
+                paths.add(os.path.abspath(path))
+        for path in properties.get("REQUIRED_FILES", []):
+            paths.add(os.path.abspath(os.path.join(cwd, path)))
+        for path in list(paths):
+            paths.update(self.get_libraries(path))
+
+        return hashlib.sha256(json.dumps({
+            "command": command,
+            "properties": properties,
+            "files": {p: self.hash_file(p) for p in paths},
+            "environment": self.environment,
+        }, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def read_results(f):
+    return json.load(f)
+
+
+def write_results(f, results):
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.write("\n")
+
+
+def select_uncached(tests, fingerprints, results):
+    cached = set(t for t in tests if fingerprints.get(t) is not None
+                 and results.get(t) == fingerprints[t])
+
+    return ([t for t in tests if t not in cached],
+            [t for t in tests if t in cached])
+
+
+def update_results(results, fingerprints, costs_before, costs_after, failed):
+    # CTest lists the tests that failed in this run, and counts another run
+    # for the ones that passed
+    updated = {}
+    for test, fingerprint in fingerprints.items():
+        if test in failed:
+            continue
+        runs = costs_before.get(test, (0, 0.0))[0]
+        if test in costs_after and costs_after[test][0] != runs:
+            if fingerprint is not None:
+                updated[test] = fingerprint
+        elif test in results:
+            updated[test] = results[test]
+
+    return updated
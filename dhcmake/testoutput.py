@@ -0,0 +1,113 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import gzip
+import os
+import re
+
+from dhcmake import testxml
+
+
+OUTPUT_SUFFIX = ".log.gz"
+
+_TEST_LINE = re.compile("^[0-9]+/[0-9]+ Test: (.*)$")
+_TEST_TIME = re.compile("^Test time = *([0-9.]+) sec$")
+_SEPARATOR = "-" * 58 + "\n"
+_END_OF_OUTPUT = "<end of output>\n"
+
+
+def get_output_file(directory, name):
+    return os.path.join(directory,
+                        re.sub("[^A-Za-z0-9._+-]", "_", name) + OUTPUT_SUFFIX)
+
+
+def write_test_xml_output(f, directory, failed=None):
+    # If failed is given, the output of each test that did not pass or get
+    # skipped is also written there, since nothing else shows it
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for result in testxml.iter_test_xml(f, all_output=True):
+        with gzip.open(get_output_file(directory, result["name"]), "wt",
+                       encoding="utf-8") as out:
+            out.write(result["output"])
+        if failed is not None and result["status"] not in (
+                testxml.PASSED, testxml.SKIPPED):
+            failed.write("Test %s (%s):\n" % (
+                result["name"], result["message"] or result["status"]))
+            failed.write(result["output"])
+            if result["output"] and not result["output"].endswith("\n"):
+                failed.write("\n")
+        count += 1
+    return count
+
+
+def write_last_test_log_output(f, directory):
+    # LastTest.log has one block per test, with the output between a line
+    # of dashes after "Output:" and "<end of output>". Copy it one line at a
+    # time, so that huge outputs never have to be in memory.
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    name = None
+    out = None
+    previous = None
+    try:
+        for line in f:
+            if out is not None:
+                if line == _END_OF_OUTPUT:
+                    out.close()
+                    out = None
+                    count += 1
+                elif line.endswith(_END_OF_OUTPUT):
+                    out.write(line[:-len(_END_OF_OUTPUT)])
+                    out.close()
+                    out = None
+                    count += 1
+                else:
+                    out.write(line)
+            elif name is not None and previous == "Output:\n" and \
+                    line == _SEPARATOR:
+                out = gzip.open(get_output_file(directory, name), "wt",
+                                encoding="utf-8")
+                name = None
+            else:
+                match = _TEST_LINE.match(line.rstrip("\n"))
+                if match:
+                    name = match.group(1)
+            previous = line
+    finally:
+        if out is not None:
+            out.close()
+    return count
+
+
+def iter_last_test_log(f):
+    # The name, status and time of each test in LastTest.log. The output of
+    # a test could contain anything, so it is skipped the same way as above.
+    name = None
+    time = None
+    in_output = False
+    previous = None
+    for line in f:
+        text = line.rstrip("\n")
+        if in_output:
+            if line.endswith(_END_OF_OUTPUT):
+                in_output = False
+        elif name is not None and previous == "Output:\n" and \
+                line == _SEPARATOR:
+            in_output = True
+        elif _TEST_LINE.match(text):
+            name = _TEST_LINE.match(text).group(1)
+            time = None
+        elif name is not None and _TEST_TIME.match(text):
+            time = float(_TEST_TIME.match(text).group(1))
+        elif name is not None and time is not None and \
+                text.startswith("Test "):
+            yield {
+                "name": name,
+                "status": testxml.PASSED if text == "Test Passed."
+                else testxml.FAILED,
+                "time": time,
+            }
+            name = None
+        previous = line
@@ -0,0 +1,63 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import io
+
+from dhcmake import ccache
+from . import KWTestCaseBase
+
+
+CCACHE_4_STATS = (
+    "stats_updated_timestamp\t1700000000\n"
+    "direct_cache_hit\t6\n"
+    "preprocessed_cache_hit\t2\n"
+    "cache_miss\t2\n"
+    "files_in_cache\t30\n"
+)
+
+CCACHE_3_STATS = (
+    "stats_zeroed_timestamp\t1700000000\n"
+    "cache_hit_direct\t1\n"
+    "cache_hit_preprocessed\t2\n"
+    "cache_miss\t1\n"
+)
+
+
+class CCacheTestCase(KWTestCaseBase):
+    def test_get_launcher(self):
+        env = ccache.get_environment("/cache", "/src")
+
+        self.assertEqual(["env", "CCACHE_BASEDIR=/src", "CCACHE_DIR=/cache",
+                          "ccache"], ccache.get_launcher(env))
+        self.assertEqual(["env", "CCACHE_BASEDIR=/src", "ccache"],
+                         ccache.get_launcher(
+                             ccache.get_environment(None, "/src")))
+
+    def test_read_stats(self):
+        stats = ccache.read_stats(io.StringIO(CCACHE_4_STATS))
+
+        self.assertEqual({"hits": 8, "misses": 2, "hit_rate": 0.8}, stats)
+        self.assertEqual("ccache: 8 hits, 2 misses (80.0% hit rate)",
+                         ccache.format_stats(stats))
+
+    def test_read_stats_ccache_3(self):
+        stats = ccache.read_stats(io.StringIO(CCACHE_3_STATS))
+
+        self.assertEqual({"hits": 3, "misses": 1, "hit_rate": 0.75}, stats)
+
+    def test_read_stats_empty(self):
+        stats = ccache.read_stats(io.StringIO(""))
+
+        self.assertEqual({"hits": 0, "misses": 0, "hit_rate": None}, stats)
+        self.assertEqual("ccache: 0 hits, 0 misses",
+                         ccache.format_stats(stats))
+
+    def test_subtract_stats(self):
+        before = ccache.read_stats(io.StringIO(CCACHE_3_STATS))
+        after = ccache.read_stats(io.StringIO(CCACHE_4_STATS))
+
+        self.assertEqual({"hits": 5, "misses": 1, "hit_rate": 5 / 6},
+                         ccache.subtract_stats(after, before))
+        self.assertEqual({"hits": 0, "misses": 0, "hit_rate": None},
+                         ccache.subtract_stats(before, after))
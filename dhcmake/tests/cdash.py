@@ -0,0 +1,224 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import gzip
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree
+
+from dhcmake import cdash
+from . import KWTestCaseBase
+
+
+class KeepAliveCDashServerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("content-length")))
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+
+        if server.delay:
+            time.sleep(server.delay)
+
+        if fail:
+            self.respond(503, b"")
+            return
+
+        if self.headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if query["MD5"] != [hashlib.md5(body).hexdigest()]:
+            self.respond(400, b"")
+            return
+
+        with server.lock:
+            server.submitted[query["FileName"][0]] = body
+            server.encodings.append(self.headers.get("content-encoding"))
+        self.respond(200, b"<cdash><status>OK</status>"
+                          b"<buildId>42</buildId></cdash>")
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KeepAliveCDashServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address):
+        super().__init__(server_address, KeepAliveCDashServerHandler)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self.failures = 0
+        self.delay = 0
+        self.submitted = {}
+        self.encodings = []
+
+
+class UploaderTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        self.server = KeepAliveCDashServer(("localhost", 0))
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = "http://localhost:%i/submit.php?project=test" % \
+            self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server_thread.join()
+        self.server.server_close()
+
+        self.tmp_dir.cleanup()
+
+    def write_part(self, name, contents=None):
+        if contents is None:
+            contents = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+                '<Site BuildName="build" BuildStamp="20200101-0000-' \
+                'Experimental" Name="site">\n\t<%s/>\n</Site>\n' % name
+        path = os.path.join(self.tmp_dir.name, name + ".xml")
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def test_upload_keep_alive(self):
+        paths = [self.write_part("Part%i" % i) for i in range(10)]
+
+        with cdash.Uploader(self.url, jobs=1) as uploader:
+            for path in paths:
+                uploader.upload(path, os.path.basename(path))
+
+        self.assertEqual(10, self.server.requests)
+        self.assertEqual(1, len(self.server.connections))
+        with open(paths[0], "rb") as f:
+            self.assertEqual(f.read(), self.server.submitted["Part0.xml"])
+
+    def test_upload_uncompressed(self):
+        paths = [self.write_part("Part%i" % i) for i in range(2)]
+
+        with cdash.Uploader(self.url) as uploader:
+            for path in paths:
+                uploader.upload(path, os.path.basename(path))
+
+        self.assertEqual(2, self.server.requests)
+        self.assertEqual([None, None], self.server.encodings)
+        self.assertEqual({"Part0.xml", "Part1.xml"},
+                         set(self.server.submitted))
+
+    def test_upload_gzip(self):
+        path = self.write_part("Configure")
+
+        with cdash.Uploader(self.url, compress=True) as uploader:
+            uploader.upload(path, "Configure.xml")
+
+        self.assertEqual(["gzip"], self.server.encodings)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.server.submitted["Configure.xml"])
+
+    def test_upload_flaky(self):
+        self.server.failures = 2
+        path = self.write_part("Configure")
+
+        with cdash.Uploader(self.url, backoff=0.01) as uploader:
+            uploader.upload(path, "Configure.xml")
+
+        self.assertEqual(3, self.server.requests)
+        self.assertEqual({"Configure.xml"}, set(self.server.submitted))
+
+    def test_upload_flaky_give_up(self):
+        self.server.failures = 3
+        path = self.write_part("Configure")
+
+        with cdash.Uploader(self.url, retries=2, backoff=0.01) as uploader:
+            with self.assertRaisesRegex(cdash.CDashError,
+                                        "HTTP status 503"):
+                uploader.upload(path, "Configure.xml")
+
+        self.assertEqual(3, self.server.requests)
+        self.assertEqual({}, self.server.submitted)
+
+    def test_upload_unreachable(self):
+        path = self.write_part("Configure")
+        port = self.server.server_address[1]
+        self.server.shutdown()
+        self.server.server_close()
+
+        with cdash.Uploader("http://localhost:%i/submit.php" % port,
+                            retries=1, backoff=0.01) as uploader:
+            with self.assertRaises(cdash.CDashError):
+                uploader.upload(path, "Configure.xml")
+
+    def test_submit(self):
+        for name in ["Configure", "Build", "Test"]:
+            self.write_part(name)
+        notes_file = os.path.join(self.tmp_dir.name, "note.txt")
+        with open(notes_file, "w") as f:
+            f.write("A note\n")
+
+        with cdash.Uploader(self.url) as uploader:
+            uploader.submit(self.tmp_dir.name,
+                            ["Configure", "Test", "Notes", "Done"],
+                            [notes_file])
+
+        prefix = "site___build___20200101-0000-Experimental___XML___"
+        self.assertEqual({prefix + "Configure.xml", prefix + "Test.xml",
+                          prefix + "Notes.xml", prefix + "Done.xml"},
+                         set(self.server.submitted))
+        self.assertEqual(prefix + "Done.xml",
+                         list(self.server.submitted)[-1])
+
+        notes = xml.etree.ElementTree.fromstring(
+            self.server.submitted[prefix + "Notes.xml"])
+        self.assertEqual("build", notes.get("BuildName"))
+        self.assertEqual("A note\n", notes.findtext("Notes/Note/Text"))
+
+        done = xml.etree.ElementTree.fromstring(
+            self.server.submitted[prefix + "Done.xml"])
+        self.assertEqual("42", done.findtext("buildId"))
+        with open(os.path.join(self.tmp_dir.name, "Done.xml"), "rb") as f:
+            self.assertEqual(f.read(),
+                             self.server.submitted[prefix + "Done.xml"])
+
+    def test_submit_nothing(self):
+        with cdash.Uploader(self.url) as uploader:
+            self.assertEqual([], uploader.submit(self.tmp_dir.name))
+
+        self.assertEqual(0, self.server.requests)
+
+    def test_submit_throughput(self):
+        self.server.delay = 0.2
+        parts = ["Update", "Configure", "Build", "Test", "Upload"]
+        for name in parts:
+            self.write_part(name)
+
+        with cdash.Uploader(self.url, jobs=len(parts)) as uploader:
+            start = time.monotonic()
+            uploader.submit(self.tmp_dir.name, parts)
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(len(parts), len(self.server.submitted))
+        # Serially this would take at least 1 second
+        self.assertLess(elapsed, 0.2 * len(parts) * 0.8)
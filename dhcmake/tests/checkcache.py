@@ -0,0 +1,114 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import io
+import os
+import tempfile
+import time
+
+from dhcmake import checkcache
+from . import KWTestCaseBase
+
+
+CMAKE_CACHE = """# This is the CMakeCache file.
+
+########################
+# EXTERNAL cache entries
+########################
+
+//Build shared libraries
+BUILD_SHARED_LIBS:BOOL=ON
+
+########################
+# INTERNAL cache entries
+########################
+
+//ADVANCED property for variable: CMAKE_AR
+CMAKE_AR-ADVANCED:INTERNAL=1
+//This is the directory where this CMakeCache.txt was created
+CMAKE_CACHEFILE_DIR:INTERNAL=/src/build
+//Test CMAKE_HAVE_LIBC_PTHREAD
+CMAKE_HAVE_LIBC_PTHREAD:INTERNAL=1
+//Have include stdio.h
+HAVE_STDIO_H:INTERNAL=1
+//Have symbol
+//\\nstrlcpy
+HAVE_STRLCPY:INTERNAL=
+//Result of TRY_COMPILE
+TRY_RESULT:INTERNAL=/src/build/CMakeFiles/CMakeTmp
+"QUOTED NAME":INTERNAL=1
+_CMAKE_LINKER_PUSHPOP_STATE_SUPPORTED:INTERNAL=TRUE
+"""
+
+
+class CheckCacheTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_entries(self):
+        return checkcache.read_cmake_cache(io.StringIO(CMAKE_CACHE))
+
+    def test_read_cmake_cache(self):
+        entries = self.read_entries()
+
+        self.assertEqual({
+            "name": "BUILD_SHARED_LIBS",
+            "type": "BOOL",
+            "value": "ON",
+            "help": "Build shared libraries",
+        }, entries[0])
+        self.assertEqual({
+            "name": "HAVE_STRLCPY",
+            "type": "INTERNAL",
+            "value": "",
+            "help": "Have symbol\nstrlcpy",
+        }, entries[5])
+        self.assertEqual(["QUOTED NAME", ""],
+                         [entries[7]["name"], entries[7]["help"]])
+
+    def test_select_check_results(self):
+        results = checkcache.select_check_results(self.read_entries(),
+                                                  exclude=["/src"])
+
+        self.assertEqual(
+            ["CMAKE_HAVE_LIBC_PTHREAD", "HAVE_STDIO_H", "HAVE_STRLCPY"],
+            [e["name"] for e in results])
+
+    def test_format_initial_cache(self):
+        self.assertEqual(
+            "set(HAVE_STDIO_H [[1]] CACHE INTERNAL [[Have include stdio.h]])\n"
+            "set(ODD [=[a]]b]=] CACHE INTERNAL [[]])\n",
+            checkcache.format_initial_cache([
+                {"name": "HAVE_STDIO_H", "value": "1",
+                 "help": "Have include stdio.h"},
+                {"name": "ODD", "value": "a]]b", "help": ""},
+            ]))
+
+    def test_get_key(self):
+        self.assertEqual(checkcache.get_key({"a": 1, "b": [2]}),
+                         checkcache.get_key({"b": [2], "a": 1}))
+        self.assertNotEqual(checkcache.get_key({"a": 1}),
+                            checkcache.get_key({"a": 2}))
+
+    def test_configure_succeeded(self):
+        build_dir = self.tmp_dir.name
+        os.makedirs(os.path.join(build_dir, "CMakeFiles"))
+        cache = os.path.join(build_dir, "CMakeCache.txt")
+        targets = os.path.join(build_dir, "CMakeFiles/TargetDirectories.txt")
+
+        self.assertFalse(checkcache.configure_succeeded(build_dir))
+
+        for path in [cache, targets]:
+            with open(path, "w"):
+                pass
+        now = time.time()
+        os.utime(cache, (now - 10, now - 10))
+        os.utime(targets, (now, now))
+        self.assertTrue(checkcache.configure_succeeded(build_dir))
+
+        os.utime(cache, (now + 10, now + 10))
+        self.assertFalse(checkcache.configure_succeeded(build_dir))
@@ -2,6 +2,7 @@
 # BSD 3-Clause license. See top-level LICENSE file or
 # https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
 
+import io
 import os.path
 
 from dhcmake import common, cmake
@@ -196,6 +197,28 @@ class DHCMakeTestCase(DebianSourcePackageTestCaseBase):
                                  | self.namelinks_files,
                                  "debian/tmp")
 
+    def test_dh_cmake_installed(self):
+        self.do_dh_cmake_install([])
+        namelink, = self.replace_arch_in_paths(
+            ["usr/lib/{arch}/libdh-cmake-test.so"])
+
+        self.dh.stdout = io.StringIO()
+        self.assertTrue(self.dh.installed(
+            ["/usr/include/dh-cmake-test.h", namelink]))
+        self.assertEqual(
+            "libdh-cmake-test-dev (Headers, dh_cmake_install): "
+            "usr/include/dh-cmake-test.h\n"
+            "libdh-cmake-test-dev (Namelinks, dh_cmake_install): %s\n"
+            % namelink, self.dh.stdout.getvalue())
+
+        self.dh.stdout = io.StringIO()
+        self.dh.stderr = io.StringIO()
+        self.assertFalse(self.dh.installed(["usr/include/nonexistent.h"]))
+        self.assertEqual("", self.dh.stdout.getvalue())
+        self.assertEqual(
+            "usr/include/nonexistent.h: not installed by dh-cmake\n",
+            self.dh.stderr.getvalue())
+
     def test_run_debian_rules(self):
         self.run_debian_rules("build", "cmake")
         self.run_debian_rules("install", "cmake")
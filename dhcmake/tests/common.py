@@ -3,8 +3,10 @@
 # https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
 
 import os
-from dhcmake import common, arch
+import sqlite3
+from dhcmake import common, arch, history
 from . import DebianSourcePackageTestCaseBase, VolatileNamedTemporaryFile
+from .ctest import PushEnvironmentVariable
 
 
 class DHCommonTestCase(DebianSourcePackageTestCaseBase):
@@ -198,6 +200,32 @@ class DHCommonTestCase(DebianSourcePackageTestCaseBase):
         self.assertIsNone(self.dh.read_package_file(
             "libdh-cmake-test-doc", "cmake-components"))
 
+    def test_get_source_package(self):
+        self.assertEqual("dh-cmake-test", self.dh.get_source_package())
+
+    def test_get_cache_directory(self):
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", "/var/cache/dh"):
+            self.assertEqual("/var/cache/dh/dh-cmake-test",
+                             self.dh.get_cache_directory())
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", None):
+            self.assertIsNone(self.dh.get_cache_directory())
+
+    def test_get_history_file(self):
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", "/var/cache/dh"):
+            self.assertEqual("/var/cache/dh/history.sqlite",
+                             self.dh.get_history_file())
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", None):
+            self.assertIsNone(self.dh.get_history_file())
+
+    def test_get_history_key(self):
+        self.assertEqual({
+            "source": "dh-cmake-test",
+            "version": "0.1-1",
+            "arch": "armhf",
+        }, self.dh.get_history_key())
+
     def test_build_directory_default(self):
         self.dh.parse_args([])
 
@@ -296,6 +324,15 @@ class DHCommonCompatTestClass(common.DHCommon):
         self.parse_args(args)
         # Do nothing
 
+    @common.DHEntryPoint("dh_common_test_history", record_history=True)
+    def test_history_command(self, args=None, fail=False):
+        self.parse_args(args)
+        self.history_tests = [
+            {"name": "TestTrue", "status": "passed", "time": 0.5},
+        ]
+        if fail:
+            raise RuntimeError("Failed")
+
 
 class DHCommonCompatTestCase(DebianSourcePackageTestCaseBase):
     DHClass = DHCommonCompatTestClass
@@ -305,3 +342,41 @@ class DHCommonCompatTestCase(DebianSourcePackageTestCaseBase):
         self.dh.test_command([])
         self.assertEqual(1, self.dh._compat)
         self.assertEqual("dh_common_test_command", self.dh.tool_name)
+
+    def read_history(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            steps = conn.execute(
+                "SELECT source, version, step, outcome FROM steps "
+                "ORDER BY id").fetchall()
+            tests = conn.execute(
+                "SELECT step_id, name, duration, outcome FROM tests "
+                "ORDER BY step_id").fetchall()
+        finally:
+            conn.close()
+        return steps, tests
+
+    def test_record_history(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        path = os.path.join(cache_dir, history.HISTORY_FILE)
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir):
+            self.dh.test_history_command([])
+            with self.assertRaises(RuntimeError):
+                self.dh.test_history_command([], fail=True)
+            self.dh.test_history_command(["--no-act"])
+            self.dh.test_command([])
+
+        self.assertEqual(([
+            ("dh-cmake-test", "0.1-1", "dh_common_test_history", "passed"),
+            ("dh-cmake-test", "0.1-1", "dh_common_test_history", "failed"),
+        ], [
+            (1, "TestTrue", 0.5, "passed"),
+            (2, "TestTrue", 0.5, "passed"),
+        ]), self.read_history(path))
+
+    def test_record_history_none(self):
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", None):
+            self.dh.test_history_command([])
+
+        self.assertEqual([], self.dh.history_tests)
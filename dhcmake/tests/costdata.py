@@ -0,0 +1,98 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import io
+
+from dhcmake import costdata
+from . import KWTestCaseBase
+
+
+class CostDataTestCase(KWTestCaseBase):
+    def test_read_cost_data(self):
+        costs, failed = costdata.read_cost_data(io.StringIO(
+            "TestFast 3 0.5\n"
+            "Test With Spaces 1 2\n"
+            "garbage\n"
+            "---\n"
+            "TestBroken\n"
+        ))
+
+        self.assertEqual({
+            "TestFast": (3, 0.5),
+            "Test With Spaces": (1, 2.0),
+        }, costs)
+        self.assertEqual({"TestBroken"}, failed)
+
+    def test_read_cost_data_no_failed(self):
+        costs, failed = costdata.read_cost_data(
+            io.StringIO("TestFast 3 0.5\n"))
+
+        self.assertEqual({"TestFast": (3, 0.5)}, costs)
+        self.assertEqual(set(), failed)
+
+    def test_select_for_budget(self):
+        tests = ["TestSlow", "TestMedium", "TestNew", "TestFast",
+                 "TestBroken"]
+        costs = {
+            "TestSlow": (1, 100.0),
+            "TestMedium": (1, 8.0),
+            "TestFast": (1, 1.0),
+            "TestBroken": (1, 5.0),
+        }
+
+        self.assertEqual((
+            ["TestNew", "TestFast", "TestBroken"],
+            ["TestSlow", "TestMedium"],
+        ), costdata.select_for_budget(tests, costs, set(), 10))
+
+        self.assertEqual((
+            ["TestMedium", "TestNew", "TestFast"],
+            ["TestSlow", "TestBroken"],
+        ), costdata.select_for_budget(tests, costs, {"TestMedium"}, 10))
+
+        self.assertEqual((tests, []), costdata.select_for_budget(
+            tests, costs, set(), 1000))
+
+        self.assertEqual((
+            ["TestNew"],
+            ["TestSlow", "TestMedium", "TestFast", "TestBroken"],
+        ), costdata.select_for_budget(tests, costs, set(), 0.5))
+
+    def test_write_cost_data(self):
+        f = io.StringIO()
+        costdata.write_cost_data(f, {
+            "TestFast": (3, 0.5),
+            "TestSlow": (1, 120.25),
+        }, {"TestSlow", "TestBroken"})
+
+        self.assertEqual("TestFast 3 0.5\nTestSlow 1 120.25\n---\n"
+                         "TestBroken\nTestSlow\n", f.getvalue())
+
+    def test_merge_cost_data(self):
+        self.assertEqual(({
+            "TestFast": (4, 0.75),
+            "TestSlow": (2, 110.0),
+        }, {"TestSlow"}), costdata.merge_cost_data([
+            ({"TestFast": (4, 0.75), "TestSlow": (1, 100.0)}, set()),
+            ({"TestFast": (3, 0.5), "TestSlow": (2, 110.0)}, {"TestSlow"}),
+        ]))
+
+    def test_assign_shards(self):
+        tests = ["TestA", "TestB", "TestC", "TestD", "TestE", "TestF"]
+        costs = {
+            "TestA": (1, 10.0),
+            "TestB": (1, 7.0),
+            "TestC": (1, 5.0),
+            "TestD": (1, 4.0),
+        }
+
+        self.assertEqual([
+            ["TestA"],
+            ["TestB", "TestE", "TestF"],
+            ["TestC", "TestD"],
+        ], costdata.assign_shards(tests, costs, 3))
+
+        self.assertEqual([tests], costdata.assign_shards(tests, costs, 1))
+        self.assertEqual([["TestA"], []],
+                         costdata.assign_shards(["TestA"], costs, 2))
@@ -4,8 +4,10 @@
 
 import contextlib
 import os
+import shutil
 from dhcmake import cpack, arch
 from . import DebianSourcePackageTestCaseBase, KWTestCaseBase
+from .elf import compile_elf_objects
 
 from debian import debfile, deb822
 
@@ -82,6 +84,7 @@ class DHCPackTestCase(DebianSourcePackageTestCaseBase):
         self.assertFileNotExists("debian/.cpack/cpack-metadata.json")
         self.dh.generate([])
         self.assertFileExists("debian/.cpack/cpack-metadata.json")
+        self.assertFileExists("debian/.cpack/cpack-metadata.bin")
 
     def test_get_cpack_components(self):
         with open("debian/libdh-cmake-test-extra-32.cpack-components", "w") \
@@ -170,6 +173,90 @@ class DHCPackTestCase(DebianSourcePackageTestCaseBase):
 
         self.assertFileNotExists("debian/libdh-cmake-test-dev.substvars")
 
+    def test_substvars_rerun(self):
+        self.dh.generate([])
+        self.dh.substvars([])
+        self.dh.substvars([])
+
+        with open("debian/libdh-cmake-test-dev.substvars", "r") as f:
+            self.assertEqual("cpack:Depends=libdh-cmake-test "
+                             "(= ${binary:Version})\n", f.read())
+
+    def test_substvars_replace(self):
+        with open("debian/libdh-cmake-test-dev.substvars", "w") as f:
+            f.write("misc:Depends=foo\n"
+                    "cpack:Depends=stale (= ${binary:Version})\n")
+
+        self.dh.generate([])
+        self.dh.substvars([])
+
+        with open("debian/libdh-cmake-test-dev.substvars", "r") as f:
+            self.assertEqual("misc:Depends=foo\n"
+                             "cpack:Depends=libdh-cmake-test "
+                             "(= ${binary:Version})\n", f.read())
+
+    def record_recomputed_packages(self):
+        recomputed = []
+        get_package_dependencies = self.dh.get_package_dependencies
+
+        def record_package_dependencies(package, owners=None):
+            recomputed.append(package)
+            return get_package_dependencies(package, owners)
+
+        self.dh.get_package_dependencies = record_package_dependencies
+        return recomputed
+
+    def test_substvars_incremental(self):
+        recomputed = self.record_recomputed_packages()
+
+        self.dh.generate([])
+        self.dh.substvars([])
+        self.assertIn("libdh-cmake-test-dev", recomputed)
+        self.assertIn("libdh-cmake-test", recomputed)
+
+        recomputed.clear()
+        self.dh.substvars([])
+        self.assertEqual([], recomputed)
+
+        with open("debian/libdh-cmake-test-dev.cpack-component-groups",
+                  "w") as f:
+            f.write("\n")
+        self.dh.substvars([])
+        self.assertEqual(["libdh-cmake-test-dev"], recomputed)
+        self.assertFileContentsEqual("",
+                                     "debian/libdh-cmake-test-dev.substvars")
+
+        recomputed.clear()
+        with open("debian/libdh-cmake-test-dev.cpack-component-groups",
+                  "w") as f:
+            f.write("Development\n")
+        with open("debian/libdh-cmake-test.cpack-components", "w") as f:
+            f.write("\n")
+        self.dh.substvars([])
+        self.assertEqual({"libdh-cmake-test", "libdh-cmake-test-dev"},
+                         set(recomputed))
+        self.assertFileContentsEqual("",
+                                     "debian/libdh-cmake-test-dev.substvars")
+
+    def test_substvars_incremental_metadata_changed(self):
+        self.dh.generate([])
+        self.dh.substvars([])
+
+        with open("debian/.cpack/substvars-state.json", "r") as f:
+            self.assertIn("libdh-cmake-test-dev", f.read())
+
+        with open("debian/.cpack/cpack-metadata.json", "a") as f:
+            f.write("\n")
+        os.unlink("debian/libdh-cmake-test-dev.substvars")
+
+        recomputed = self.record_recomputed_packages()
+        self.dh.substvars([])
+
+        self.assertIn("libdh-cmake-test-dev", recomputed)
+        with open("debian/libdh-cmake-test-dev.substvars", "r") as f:
+            self.assertEqual("cpack:Depends=libdh-cmake-test "
+                             "(= ${binary:Version})\n", f.read())
+
     def test_install(self):
         self.dh.generate([])
         self.dh.install([])
@@ -180,6 +267,134 @@ class DHCPackTestCase(DebianSourcePackageTestCaseBase):
         self.assertFileTreeEqual(self.headers_files | self.namelinks_files,
                                  "debian/libdh-cmake-test-dev")
 
+    def setup_flavors(self):
+        os.mkdir("obj-other")
+        self.run_cmd(
+            [
+                "cmake", "-G", "Unix Makefiles", "-DCMAKE_INSTALL_PREFIX=/usr",
+                self.src_dir,
+            ], cwd="obj-other")
+        self.run_cmd(["make"], cwd="obj-other")
+
+        with open("debian/libdh-cmake-test.cpack-components", "w") as f:
+            f.write("main:Libraries\nother:Libraries\n")
+        with open("debian/libdh-cmake-test-dev.cpack-component-groups",
+                  "w") as f:
+            f.write("other:Development\n")
+
+        return [
+            "--flavor", "main=" + self.dh.get_build_directory(),
+            "--flavor", "other=obj-other",
+        ]
+
+    def test_generate_flavors(self):
+        flavor_args = self.setup_flavors()
+        self.dh.generate(flavor_args)
+        self.dh.read_cpack_metadata()
+
+        self.assertFileExists("debian/.cpack/main/cpack-metadata.json")
+        self.assertFileExists("debian/.cpack/other/cpack-metadata.json")
+        self.assertEqual({
+            "main:Libraries", "main:Headers", "main:Namelinks",
+            "other:Libraries", "other:Headers", "other:Namelinks",
+        }, set(self.dh.cpack_metadata.components))
+        self.assertEqual(
+            {"other:Headers", "other:Namelinks"},
+            self.dh.get_all_cpack_components("libdh-cmake-test-dev"))
+        self.assertEqual({"main", "other"},
+                         {p.flavor for p in self.dh.cpack_metadata.projects})
+
+    def test_generate_flavors_invalid(self):
+        with self.assertRaisesRegex(ValueError, "Invalid flavor: main"):
+            self.dh.generate(["--flavor", "main"])
+
+        dh = self.DHClass()
+        with self.assertRaisesRegex(ValueError, "Invalid flavor: a:b=obj"):
+            dh.generate(["--flavor", "a:b=obj"])
+
+    def test_get_package_dependencies_flavors(self):
+        flavor_args = self.setup_flavors()
+        with open("debian/libdh-cmake-test.cpack-components", "w") as f:
+            f.write("main:Libraries\n")
+        with open("debian/cpack-flavor-dependencies", "w") as f:
+            f.write("# Cross-flavor dependencies\n"
+                    "other:Headers main:Libraries\n")
+
+        self.dh.generate(flavor_args)
+        self.dh.read_cpack_metadata()
+        self.assertEqual({"libdh-cmake-test"},
+                         self.dh.get_package_dependencies("libdh-cmake-test-dev"))
+
+    def test_install_flavors(self):
+        flavor_args = self.setup_flavors()
+        self.dh.generate(flavor_args)
+        self.dh.install([])
+
+        self.assertFileTreeEqual(self.libraries_files,
+                                 "debian/libdh-cmake-test")
+
+        self.assertFileTreeEqual(self.headers_files | self.namelinks_files,
+                                 "debian/libdh-cmake-test-dev")
+
+    def install_elf_objects(self):
+        libbar, foo = compile_elf_objects(
+            self.make_directory_in_tmp("elf"))
+        os.makedirs("debian/libdh-cmake-test/usr/lib")
+        shutil.copy(libbar, "debian/libdh-cmake-test/usr/lib")
+        os.symlink("libbar.so.1.0",
+                   "debian/libdh-cmake-test/usr/lib/libbar.so.1")
+        os.makedirs("debian/libdh-cmake-test-dev/usr/bin")
+        shutil.copy(foo, "debian/libdh-cmake-test-dev/usr/bin")
+
+        return {
+            "libdh-cmake-test": {
+                "Libraries": ["usr/lib/libbar.so.1.0", "usr/lib/libbar.so.1"],
+            },
+            "libdh-cmake-test-dev": {
+                "Headers": ["usr/bin/foo"],
+            },
+        }
+
+    def test_infer_elf_dependencies(self):
+        self.dh.parse_args([])
+        installed = self.install_elf_objects()
+
+        self.assertEqual({
+            "libdh-cmake-test": {},
+            "libdh-cmake-test-dev": {
+                "libdh-cmake-test": {
+                    "foo (Headers) needs libbar.so.1 (Libraries)",
+                },
+            },
+        }, self.dh.infer_elf_dependencies(installed))
+
+    def test_check_elf_dependencies_add(self):
+        with open("debian/libdh-cmake-test-dev.cpack-component-groups",
+                  "w") as f:
+            f.write("\n")
+        self.dh.generate([])
+        self.dh.parse_args(["--elf-depends=add"],
+                           make_arg_parser=self.dh.install_make_arg_parser)
+        self.dh.read_cpack_metadata()
+        self.dh.check_elf_dependencies(self.install_elf_objects())
+
+        with open("debian/libdh-cmake-test-dev.substvars", "r") as f:
+            self.assertEqual("cpack:Depends=libdh-cmake-test "
+                             "(= ${binary:Version})\n", f.read())
+        self.assertFileNotExists("debian/libdh-cmake-test.substvars")
+
+    def test_check_elf_dependencies_warn(self):
+        with open("debian/libdh-cmake-test-dev.cpack-component-groups",
+                  "w") as f:
+            f.write("\n")
+        self.dh.generate([])
+        self.dh.parse_args(["--elf-depends=warn"],
+                           make_arg_parser=self.dh.install_make_arg_parser)
+        self.dh.read_cpack_metadata()
+        self.dh.check_elf_dependencies(self.install_elf_objects())
+
+        self.assertFileNotExists("debian/libdh-cmake-test-dev.substvars")
+
     def test_run_debian_rules(self):
         self.run_debian_rules("build", "cpack")
         self.run_debian_rules("install", "cpack")
@@ -2,15 +2,25 @@
 # BSD 3-Clause license. See top-level LICENSE file or
 # https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
 
+import base64
+import gzip
 import http.server
+import io
+import json
 import re
+import shutil
+import sqlite3
 import subprocess
+import tempfile
 import threading
+import time
 import urllib.parse
 import xml.etree.ElementTree
 import os
+import pkg_resources
+import zlib
 
-from dhcmake import ctest
+from dhcmake import costdata, ctest, gcov, history, rusage, spool
 from . import DebianSourcePackageTestCaseBase, KWTestCaseBase
 
 
@@ -22,14 +32,17 @@ class PushEnvironmentVariable:
         except KeyError:
             self.old_value = None
 
-        os.environ[name] = value
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.old_value is None:
-            del os.environ[self.name]
+            os.environ.pop(self.name, None)
         else:
             os.environ[self.name] = self.old_value
 
@@ -74,6 +87,8 @@ class MockCDashServerHandler(http.server.BaseHTTPRequestHandler):
         self.flush_headers()
 
         input_file = self.rfile.read(int(self.headers.get("content-length")))
+        if self.headers.get("content-encoding") == "gzip":
+            input_file = gzip.decompress(input_file)
         self.server.submitted_files.add(input_file)
 
         self.send_response(200)
@@ -97,10 +112,12 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
     def setUp(self):
         super().setUp()
 
-        try:
-            del os.environ["DEB_CTEST_OPTIONS"]
-        except KeyError:
-            pass  # No variable, no problem
+        for name in ["DEB_CTEST_OPTIONS", "DEB_BUILD_OPTIONS",
+                     "DH_CMAKE_CACHE_DIR"]:
+            try:
+                del os.environ[name]
+            except KeyError:
+                pass  # No variable, no problem
 
         self.cdash_server = MockCDashServer(("localhost", 47806))
         self.cdash_server_thread = \
@@ -130,6 +147,18 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
         with open("debian/.ctest/Testing/TAG", "r") as f:
             return next(f).rstrip()
 
+    def wait_for_spool(self):
+        # The background workers might not have taken the lock yet. Each one
+        # removes its snapshot when it is done.
+        timeout = time.monotonic() + 60
+        while (spool.list_parts("debian/.ctest/spool") or any(
+                n.startswith(".testing-")
+                for n in os.listdir("debian/.ctest/spool"))) and \
+                time.monotonic() < timeout:
+            time.sleep(0.1)
+        with spool.lock("debian/.ctest/spool"):
+            pass
+
     def test_get_deb_ctest_option(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
                                      "opt1 opt2=val  opt3=\"spaced value\" opt4=another\\ \\ space"):
@@ -157,6 +186,39 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
         self.dh.clean([])
         self.assertFileNotExists("debian/.ctest")
 
+    def test_get_parallel_level(self):
+        self.assertIsNone(ctest.get_parallel_level())
+
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS",
+                                     "nostrip parallel=4"):
+            self.assertEqual(4, ctest.get_parallel_level())
+
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                         "model=Experimental parallel=2"):
+                self.assertEqual(2, ctest.get_parallel_level())
+
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "parallel"):
+                with self.assertRaisesRegex(ValueError,
+                                            "Invalid parallel level: True"):
+                    ctest.get_parallel_level()
+
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=0"):
+            with self.assertRaisesRegex(ValueError,
+                                        "Invalid parallel level: 0"):
+                ctest.get_parallel_level()
+
+    def test_clean_keeps_cost_data_cache(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
+            self.dh.clean([])
+
+        self.assertFileExists(os.path.join(
+            cache_dir, "dh-cmake-test/ctest/CTestCostData.txt"))
+
     def test_clean_dir(self):
         os.makedirs("debian/ctest/Testing")
         with open("debian/ctest/Testing/TAG", "w") as f:
@@ -604,6 +666,84 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
 
             self.assertFilesSubmittedEqual({"Configure"})
 
+    def read_cmake_output_log(self):
+        with open(os.path.join(self.dh.get_build_directory(),
+                               "CMakeFiles/CMakeOutput.log"), "r") as f:
+            return f.read()
+
+    def test_configure_none_checkcache_cmd(self):
+        cache_dir = os.path.abspath("checks")
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "checkcache=checks"):
+            self.dh.stdout = io.StringIO()
+            self.dh.configure(["--no-act", "-v"])
+            self.assertEqual("\tdh_auto_configure --no-act -v\n",
+                             self.dh.stdout.getvalue())
+            self.assertFileNotExists(cache_dir)
+
+            cached = self.dh.get_check_cache_file()
+            self.assertEqual(cache_dir, os.path.dirname(cached))
+            os.makedirs(cache_dir)
+            with open(cached, "w"):
+                pass
+
+            self.dh.stdout = io.StringIO()
+            self.dh.configure(["--no-act", "-v"])
+            self.assertEqual("\tdh_auto_configure --no-act -v -- -C %s\n"
+                             % cached, self.dh.stdout.getvalue())
+
+    def test_configure_none_checkcache(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        checks_dir = os.path.join(cache_dir, "dh-cmake-test/ctest/checks")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS", "checkcache"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.assertIn("stdio.h", self.read_cmake_output_log())
+
+            cached = os.listdir(checks_dir)
+            self.assertEqual(1, len(cached))
+            with open(os.path.join(checks_dir, cached[0]), "r") as f:
+                self.assertEqual(
+                    "set(DH_CMAKE_TEST_HAVE_STDIO_H [[1]] CACHE INTERNAL "
+                    "[[Have include stdio.h]])\n", f.read())
+
+            # A fresh build directory gets the result without checking again
+            shutil.rmtree(self.dh.get_build_directory())
+            self.dh.configure([])
+            self.assertNotIn("stdio.h", self.read_cmake_output_log())
+            self.assertEqual(cached, os.listdir(checks_dir))
+
+            # Other arguments may give other results, so start over
+            self.dh.configure(["--", "-DDH_CMAKE_TEST_FLAG:BOOL=ON"])
+            self.assertEqual(1, len(os.listdir(checks_dir)))
+            self.assertNotEqual(cached, os.listdir(checks_dir))
+
+    def test_configure_none_checkcache_bad(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "checkcache=checks"):
+            self.dh.start([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.configure(
+                    ["--", "-DDH_CMAKE_ENABLE_BAD_CONFIGURE:BOOL=ON"])
+
+        self.assertFileNotExists("checks")
+
+    def test_run_none_checkcache_bad(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "checkcache=checks"):
+            self.dh.run(["--steps", "start,configure"])
+            self.assertEqual(1, len(os.listdir("checks")))
+            shutil.rmtree("checks")
+
+            # The build system from before is still there, but out of date
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.run(["--steps", "configure,build", "--",
+                             "-DDH_CMAKE_ENABLE_BAD_CONFIGURE:BOOL=ON"])
+            self.assertFileNotExists("checks")
+
     def test_build_none(self):
         self.dh.start([])
         self.dh.configure([])
@@ -704,6 +844,159 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
 
             self.assertFilesSubmittedEqual({"Configure", "Build"})
 
+    def test_get_build_job_memory(self):
+        self.assertIsNone(ctest.get_build_job_memory())
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "buildmemory"):
+            self.assertIs(True, ctest.get_build_job_memory())
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "buildmemory=2048"):
+            self.assertEqual(2048, ctest.get_build_job_memory())
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "buildmemory=0"):
+            with self.assertRaisesRegex(ValueError,
+                                        "Invalid build job memory: 0"):
+                ctest.get_build_job_memory()
+
+    def test_build_none_buildmemory_cmd(self):
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=64"), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                        "buildmemory=1000000000"):
+            self.dh.stdout = io.StringIO()
+            self.dh.build(["--no-act", "-v", "--", "VERBOSE=1"])
+
+        self.assertRegex(
+            self.dh.stdout.getvalue(),
+            "^Building with 1 of 64 jobs: [0-9]+ MiB available, 1000000000 "
+            "MiB per job\n"
+            "\tdh_auto_build --no-act -v --max-parallel=1 -- VERBOSE=1\n$")
+        self.assertFileNotExists("debian/.ctest/notes")
+
+    def test_build_none_buildmemory_no_estimate(self):
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=64"), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS", "buildmemory"):
+            self.dh.stdout = io.StringIO()
+            self.dh.build(["--no-act", "-v"])
+
+        self.assertEqual("\tdh_auto_build --no-act -v\n",
+                         self.dh.stdout.getvalue())
+
+    def test_build_none_buildmemory(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        cached = os.path.join(cache_dir,
+                              "dh-cmake-test/ctest/build-memory.json")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS", "buildmemory"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+
+            with open(cached, "r") as f:
+                history = json.load(f)["peak_memory"]
+            self.assertEqual(1, len(history))
+            self.assertGreater(history[0], 0)
+
+            with open(cached, "w") as f:
+                json.dump({"peak_memory": [1000000000, 1, 1, 1, 1]}, f)
+            with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=2"):
+                self.dh.build([])
+
+            with open("debian/.ctest/notes/build-jobs.txt", "r") as f:
+                self.assertRegex(
+                    f.read(),
+                    "^Building with 1 of 2 jobs: [0-9]+ MiB available, "
+                    "1000000000 MiB per job\n$")
+
+            # Only the last few builds count
+            with open(cached, "r") as f:
+                history = json.load(f)["peak_memory"]
+            self.assertEqual(5, len(history))
+            self.assertEqual([1, 1, 1, 1], history[:4])
+
+    def test_build_experimental_buildmemory(self):
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=2"), \
+                PushEnvironmentVariable(
+                    "DEB_CTEST_OPTIONS",
+                    "model=Experimental submit buildmemory=1000000000"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            date = self.get_testing_tag_date()
+
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Build.xml"))
+            self.assertFileExists("debian/.ctest/notes/build-jobs.txt")
+
+            self.dh.test([])
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Notes"})
+
+    def write_ninja_log(self):
+        with open(os.path.join(self.dh.get_build_directory(), ".ninja_log"),
+                  "w") as f:
+            f.write("# ninja log v5\n"
+                    "0\t1000\t0\ta.c.o\t11\n"
+                    "0\t3000\t0\tb.c.o\t22\n"
+                    "3000\t3500\t0\tlibab.so\t33\n")
+
+    def test_build_none_ninjalog(self):
+        self.dh.start([])
+        self.dh.configure([])
+        self.dh.build([])
+        self.write_ninja_log()
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "ninjalog"):
+            self.dh.build([])
+
+        with open("debian/.ctest/ninja-log.json", "r") as f:
+            report = json.load(f)
+        self.assertEqual(3.5, report["build_time"])
+        self.assertEqual(4.5, report["work_time"])
+        self.assertEqual(["b.c.o", "a.c.o", "libab.so"],
+                         [s["outputs"][0] for s in report["steps"]])
+        self.assertFileNotExists("debian/.ctest/notes")
+
+    def test_build_experimental_ninjalog(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS", "model=Experimental submit ninjalog"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.write_ninja_log()
+            self.dh.build([])
+            with open("debian/.ctest/notes/ninja-log.txt", "r") as f:
+                self.assertEqual(
+                    "Build took 3.50 s: 3 steps, 4.50 s of work, "
+                    "parallelism 1.29\n", f.readline())
+
+            self.dh.test([])
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Notes"})
+
+    def test_configure_none_ccache_cmd(self):
+        cache_dir = os.path.abspath("ccache")
+        launcher = "env;CCACHE_BASEDIR=%s;CCACHE_DIR=%s;ccache" % (
+            os.getcwd(), cache_dir)
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "ccache=ccache"):
+            self.dh.stdout = io.StringIO()
+            self.dh.configure(["--no-act", "-v", "--", "-DFOO=1"])
+
+        self.assertEqual(
+            "\tdh_auto_configure --no-act -v -- -DFOO=1 "
+            "-DCMAKE_C_COMPILER_LAUNCHER:STRING=%s "
+            "-DCMAKE_CXX_COMPILER_LAUNCHER:STRING=%s\n"
+            % (launcher, launcher), self.dh.stdout.getvalue())
+
+    def test_build_none_ccache_cmd(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "ccache=ccache"):
+            self.dh.stdout = io.StringIO()
+            self.dh.build(["--no-act", "-v"])
+
+        self.assertEqual("\tdh_auto_build --no-act -v\n",
+                         self.dh.stdout.getvalue())
+        self.assertFileNotExists("debian/.ctest/ccache.json")
+
     def test_test_none(self):
         self.dh.start([])
         self.dh.configure([])
@@ -729,9 +1022,18 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
 
         self.assertFileNotExists(os.path.join("debian/.ctest/Testing/TAG"))
 
-    def test_test_experimental(self):
+    def test_test_none_parallel(self):
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=3"):
+            self.dh.stdout = io.StringIO()
+            self.dh.test(["--no-act", "-v", "--", "-E", "TestFalse"])
+
+        self.assertEqual("\tcd %s && ctest -VV -j3 -E TestFalse\n"
+                         % self.dh.get_build_directory(),
+                         self.dh.stdout.getvalue())
+
+    def test_test_experimental_parallel(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental"):
+                                     "model=Experimental parallel=2"):
             self.dh.start([])
             self.dh.configure([])
             self.dh.build([])
@@ -742,66 +1044,110 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
                       "r") as f:
                 tree = xml.etree.ElementTree.fromstring(f.read())
 
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(1, len(tests))
-
             test_true = self.get_single_element(tree.findall(
                 "Testing/Test[Name='TestTrue']"))
             self.assertEqual("passed", test_true.get("Status"))
 
-            self.assertFilesSubmittedEqual({})
-
-    def test_test_experimental_submit(self):
-        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental submit"):
+            self.dh.stdout = io.StringIO()
+            self.dh.test(["--no-act", "-v"])
+            self.assertIn("-DDH_CTEST_PARALLEL_LEVEL:STRING=2",
+                          self.dh.stdout.getvalue())
+
+    def read_cost_data(self, path):
+        result = {}
+        with open(path, "r") as f:
+            for line in f:
+                if line.rstrip() == "---":
+                    break
+                name, runs, cost = line.split()
+                result[name] = int(runs)
+        return result
+
+    def test_test_none_cost_data(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        cached = os.path.join(cache_dir,
+                              "dh-cmake-test/ctest/CTestCostData.txt")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir):
             self.dh.start([])
             self.dh.configure([])
             self.dh.build([])
             self.dh.test([])
-            date = self.get_testing_tag_date()
+            cost_data = os.path.join(self.dh.get_build_directory(),
+                                     "Testing/Temporary/CTestCostData.txt")
+            self.assertEqual({"TestTrue": 1}, self.read_cost_data(cached))
 
-            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
-                      "r") as f:
-                tree = xml.etree.ElementTree.fromstring(f.read())
-
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(1, len(tests))
+            os.unlink(cost_data)
+            with open(cached, "w") as f:
+                f.write("TestTrue 5 1.5\n---\n")
+            self.dh.test([])
 
-            test_true = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestTrue']"))
-            self.assertEqual("passed", test_true.get("Status"))
+        self.assertEqual({"TestTrue": 6}, self.read_cost_data(cost_data))
+        self.assertEqual({"TestTrue": 6}, self.read_cost_data(cached))
 
-            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+    def test_test_experimental_cost_data(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        cached = os.path.join(cache_dir,
+                              "dh-cmake-test/ctest/CTestCostData.txt")
+        os.makedirs(os.path.dirname(cached))
+        with open(cached, "w") as f:
+            f.write("TestTrue 5 1.5\n---\n")
 
-    def test_test_experimental_no_submit(self):
-        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental submit"):
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                        "model=Experimental"):
             self.dh.start([])
             self.dh.configure([])
             self.dh.build([])
-            self.dh.test(["-O--no-submit"])
-            date = self.get_testing_tag_date()
+            self.dh.test([])
 
-            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
-                      "r") as f:
-                tree = xml.etree.ElementTree.fromstring(f.read())
+        self.assertEqual({"TestTrue": 6}, self.read_cost_data(
+            "debian/.ctest/Testing/Temporary/CTestCostData.txt"))
+        self.assertEqual({"TestTrue": 6}, self.read_cost_data(cached))
 
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(1, len(tests))
+    def test_get_budget(self):
+        self.assertIsNone(ctest.get_budget())
 
-            test_true = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestTrue']"))
-            self.assertEqual("passed", test_true.get("Status"))
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "budget=90.5"):
+            self.assertEqual(90.5, ctest.get_budget())
 
-            self.assertFilesSubmittedEqual({"Configure", "Build"})
+        for value in ["budget", "budget=0", "budget=soon"]:
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS", value):
+                with self.assertRaisesRegex(ValueError,
+                                            "Invalid test budget"):
+                    ctest.get_budget()
 
-    def test_test_experimental_bad(self):
+    def write_cost_data(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write("TestTrue 1 0.5\nTestFalse 1 100\n---\n")
+
+    def test_test_none_budget(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "budget=10"):
+            self.dh.start([])
+            self.dh.configure(["--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.write_cost_data(os.path.join(
+                self.dh.get_build_directory(),
+                "Testing/Temporary/CTestCostData.txt"))
+            self.dh.test([])
+
+        self.assertFileContentsEqual(
+            "Skipped 1 of 2 tests to fit in a budget of 10 seconds\n"
+            "TestFalse\n", "debian/.ctest/notes/budget-skipped.txt")
+
+        self.dh.test(["--", "-E", "TestFalse"])
+        self.assertFileNotExists("debian/.ctest/notes/budget-skipped.txt")
+
+    def test_test_experimental_budget_submit(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental"):
+                                     "model=Experimental submit budget=10"):
             self.dh.start([])
             self.dh.configure([
                 "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
             self.dh.build([])
+            self.write_cost_data(
+                "debian/.ctest/Testing/Temporary/CTestCostData.txt")
             self.dh.test([])
             date = self.get_testing_tag_date()
 
@@ -809,134 +1155,1266 @@ class DHCTestTestCase(DebianSourcePackageTestCaseBase):
                       "r") as f:
                 tree = xml.etree.ElementTree.fromstring(f.read())
 
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(2, len(tests))
-
-            test_true = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestTrue']"))
+            test_true = self.get_single_element(
+                tree.findall("Testing/Test"))
+            self.assertEqual("TestTrue", test_true.find("Name").text)
             self.assertEqual("passed", test_true.get("Status"))
 
-            test_false = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestFalse']"))
-            self.assertEqual("failed", test_false.get("Status"))
+            with open(os.path.join("debian/.ctest/Testing", date,
+                                   "Notes.xml"), "r") as f:
+                notes = f.read()
+            self.assertIn("Skipped 1 of 2 tests", notes)
+            self.assertIn("TestFalse", notes)
 
-            self.assertFilesSubmittedEqual({})
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Notes"})
 
-    def test_test_experimental_bad_exclude(self):
-        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental"):
-            self.dh.start([])
-            self.dh.configure([
-                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
-            self.dh.build([])
-            self.dh.test(["--", "-E", "TestFalse"])
-            date = self.get_testing_tag_date()
+    def test_get_test_cache_file(self):
+        self.assertIsNone(self.dh.get_test_cache_file())
 
-            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
-                      "r") as f:
-                tree = xml.etree.ElementTree.fromstring(f.read())
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "testcache"):
+            self.assertIsNone(self.dh.get_test_cache_file())
+            with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", "/cache"):
+                self.assertEqual(
+                    "/cache/dh-cmake-test/ctest/test-results.json",
+                    self.dh.get_test_cache_file())
+                with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "nocheck"):
+                    self.assertIsNone(self.dh.get_test_cache_file())
 
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(1, len(tests))
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "testcache=tests"):
+            self.assertEqual(os.path.abspath("tests/test-results.json"),
+                             self.dh.get_test_cache_file())
 
-            test_true = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestTrue']"))
-            self.assertEqual("passed", test_true.get("Status"))
+    def test_test_none_testcache(self):
+        results_file = os.path.abspath("tests/test-results.json")
+        note_file = "debian/.ctest/notes/test-cache.txt"
 
-            self.assertFilesSubmittedEqual({})
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "testcache=tests"):
+            self.dh.start([])
+            self.dh.configure(["--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+            self.assertFileContentsEqual(
+                "Skipped 0 of 2 tests with a cached pass\n", note_file)
+            with open(results_file, "r") as f:
+                results = json.load(f)
+            self.assertEqual(["TestTrue"], list(results))
 
-    def test_test_experimental_bad_submit(self):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+            self.assertFileContentsEqual(
+                "Skipped 1 of 2 tests with a cached pass\nTestTrue\n",
+                note_file)
+            self.assertEqual({"TestTrue": 1, "TestFalse": 0},
+                             self.read_cost_data(os.path.join(
+                                 self.dh.get_build_directory(),
+                                 "Testing/Temporary/CTestCostData.txt")))
+
+            # A different fingerprint means the inputs changed
+            with open(results_file, "w") as f:
+                json.dump({"TestTrue": "0" * 64}, f)
+            self.dh.test(["--", "-R", "TestTrue"])
+            self.assertFileContentsEqual(
+                "Skipped 0 of 2 tests with a cached pass\n", note_file)
+            with open(results_file, "r") as f:
+                self.assertEqual(results, json.load(f))
+
+            with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "nocheck"):
+                self.dh.test(["--", "-R", "TestTrue"])
+            self.assertFileNotExists(note_file)
+
+    def test_test_experimental_testcache(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental submit"):
+                                     "model=Experimental testcache=tests"):
             self.dh.start([])
-            self.dh.configure([
-                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.configure([])
             self.dh.build([])
             self.dh.test([])
+            self.dh.test([])
             date = self.get_testing_tag_date()
 
             with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
                       "r") as f:
                 tree = xml.etree.ElementTree.fromstring(f.read())
+            self.assertEqual([], tree.findall("Testing/Test"))
+
+            self.assertFileContentsEqual(
+                "Skipped 1 of 1 tests with a cached pass\nTestTrue\n",
+                "debian/.ctest/notes/test-cache.txt")
+
+    def write_failed_test_true(self, directory, suffix=""):
+        with open(os.path.join(directory, "Testing/Temporary/LastTestsFailed%s"
+                               ".log" % suffix), "w") as f:
+            f.write("1:TestTrue\n")
+        with open(os.path.join(directory,
+                               "Testing/Temporary/CTestCostData.txt"),
+                  "w") as f:
+            f.write("TestTrue 1 0.5\n---\nTestTrue\n")
+
+    def test_test_none_rerunfailed(self):
+        self.dh.start([])
+        self.dh.configure(["--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+        self.dh.build([])
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.dh.test([])
+        cost_data = os.path.join(self.dh.get_build_directory(),
+                                 "Testing/Temporary/CTestCostData.txt")
 
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(2, len(tests))
-
-            test_true = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestTrue']"))
-            self.assertEqual("passed", test_true.get("Status"))
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "rerunfailed"):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+            self.assertEqual({"TestTrue": 1, "TestFalse": 0},
+                             self.read_cost_data(cost_data))
 
-            test_false = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestFalse']"))
-            self.assertEqual("failed", test_false.get("Status"))
+            self.write_failed_test_true(self.dh.get_build_directory())
+            self.dh.test([])
+            self.assertEqual({"TestTrue": 2},
+                             self.read_cost_data(cost_data))
+            self.assertFileNotExists("debian/.ctest/notes/rerun.txt")
 
-            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+            self.dh.stdout = io.StringIO()
+            self.dh.test([])
+            self.assertEqual("No failed tests to rerun\n",
+                             self.dh.stdout.getvalue())
 
-    def test_test_experimental_bad_catchfailed_submit(self):
+    def test_test_experimental_rerunfailed(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental catchfailed submit"):
+                                     "model=Experimental"):
             self.dh.start([])
-            self.dh.configure([
-                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.configure(["--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
             self.dh.build([])
+            self.dh.test([])
+        date = self.get_testing_tag_date()
+
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental rerunfailed catchfailed"):
             with self.assertRaises(subprocess.CalledProcessError):
                 self.dh.test([])
-            date = self.get_testing_tag_date()
-
-            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
-                      "r") as f:
-                tree = xml.etree.ElementTree.fromstring(f.read())
-
-            tests = tree.findall("Testing/Test")
-            self.assertEqual(2, len(tests))
-
-            test_true = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestTrue']"))
-            self.assertEqual("passed", test_true.get("Status"))
-
-            test_false = self.get_single_element(tree.findall(
-                "Testing/Test[Name='TestFalse']"))
-            self.assertEqual("failed", test_false.get("Status"))
 
-            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+        with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                  "r") as f:
+            tree = xml.etree.ElementTree.fromstring(f.read())
+        self.assertEqual(
+            [("TestTrue", "passed"), ("TestFalse", "failed")],
+            [(t.findtext("Name"), t.get("Status"))
+             for t in tree.findall("Testing/Test")])
+        self.assertEqual({"TestTrue": 1, "TestFalse": 0}, self.read_cost_data(
+            "debian/.ctest/Testing/Temporary/CTestCostData.txt"))
+        self.assertFileContentsEqual(
+            "Reran 1 failed tests\nTestFalse\n",
+            "debian/.ctest/notes/rerun.txt")
+
+    def test_test_experimental_rerunfailed_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
+        self.write_failed_test_true("debian/.ctest",
+                                    "_" + self.get_testing_tag_date())
 
-    def test_submit_none(self):
-        self.dh.start([])
-        self.dh.configure(["-O--no-submit"])
-        self.dh.build(["-O--no-submit"])
-        self.dh.test(["-O--no-submit"])
-        self.dh.submit([])
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental submit rerunfailed catchfailed"):
+            self.dh.test([])
 
-        self.assertFilesSubmittedEqual(set())
+        self.assertEqual({"TestTrue": 2}, self.read_cost_data(
+            "debian/.ctest/Testing/Temporary/CTestCostData.txt"))
+        self.assertFilesSubmittedEqual({"Test", "Notes"})
 
-    def test_submit_experimental_nosubmit(self):
+    def test_test_experimental_rerunfailed_skipped(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
                                      "model=Experimental"):
             self.dh.start([])
-            self.dh.configure(["-O--no-submit"])
-            self.dh.build(["-O--no-submit"])
-            self.dh.test(["-O--no-submit"])
-            self.dh.submit([])
+            self.dh.configure(["--", "-DDH_CMAKE_ENABLE_SKIP_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+        date = self.get_testing_tag_date()
+        self.write_failed_test_true("debian/.ctest", "_" + date)
 
-            self.assertFilesSubmittedEqual(set())
+        # The skipped test in the Test part is not a failure
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental rerunfailed catchfailed"):
+            self.dh.test([])
 
-    def test_submit_experimental_submit(self):
-        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
-                                     "model=Experimental submit"):
+        with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                  "r") as f:
+            tree = xml.etree.ElementTree.fromstring(f.read())
+        self.assertEqual(
+            [("TestTrue", "passed"), ("TestSkip", "notrun")],
+            [(t.findtext("Name"), t.get("Status"))
+             for t in tree.findall("Testing/Test")])
+
+    def read_history(self, cache_dir):
+        conn = sqlite3.connect(os.path.join(cache_dir, history.HISTORY_FILE))
+        try:
+            steps = conn.execute(
+                "SELECT step, outcome FROM steps ORDER BY id").fetchall()
+            tests = conn.execute(
+                "SELECT steps.step, tests.name, tests.outcome FROM tests "
+                "JOIN steps ON tests.step_id = steps.id "
+                "ORDER BY tests.rowid").fetchall()
+        finally:
+            conn.close()
+        return steps, tests
+
+    def test_test_none_history(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir):
             self.dh.start([])
-            self.dh.configure(["-O--no-submit"])
-            self.dh.build(["-O--no-submit"])
-            self.dh.test(["-O--no-submit"])
-            self.dh.submit([])
+            self.dh.configure(["--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+            self.dh.test(["--no-act"])
+
+        self.assertEqual(([
+            ("dh_ctest_configure", "passed"),
+            ("dh_ctest_build", "passed"),
+            ("dh_ctest_test", "failed"),
+        ], [
+            ("dh_ctest_test", "TestTrue", "passed"),
+            ("dh_ctest_test", "TestFalse", "failed"),
+        ]), self.read_history(cache_dir))
+
+    def test_test_experimental_history(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                        "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
 
-            self.assertFilesSubmittedEqual(
-                {"Configure", "Build", "Test", "Done"})
+        self.assertEqual(([
+            ("dh_ctest_configure", "passed"),
+            ("dh_ctest_build", "passed"),
+            ("dh_ctest_test", "passed"),
+        ], [
+            ("dh_ctest_test", "TestTrue", "passed"),
+        ]), self.read_history(cache_dir))
 
-    def test_submit_experimental_submit_parts(self):
+    def test_run_none_history(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.run([
+                    "--steps=start,configure,build,test", "--",
+                    "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+
+        self.assertEqual(([
+            ("dh_ctest_configure", "passed"),
+            ("dh_ctest_build", "passed"),
+            ("dh_ctest_test", "failed"),
+        ], [
+            ("dh_ctest_test", "TestTrue", "passed"),
+            ("dh_ctest_test", "TestFalse", "failed"),
+        ]), self.read_history(cache_dir))
+
+    def test_run_experimental_history(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                        "model=Experimental"):
+            self.dh.run(["--steps=start,configure,build,test"])
+
+            # A step that fails is the last one recorded
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.run([
+                    "--steps=start,configure,build,test", "--",
+                    "-DDH_CMAKE_ENABLE_BAD_CONFIGURE:BOOL=ON"])
+
+        self.assertEqual(([
+            ("dh_ctest_configure", "passed"),
+            ("dh_ctest_build", "passed"),
+            ("dh_ctest_test", "passed"),
+            ("dh_ctest_configure", "failed"),
+        ], [
+            ("dh_ctest_test", "TestTrue", "passed"),
+        ]), self.read_history(cache_dir))
+
+    def test_get_shards(self):
+        self.assertIsNone(ctest.get_shards())
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "shards=3"):
+            self.assertEqual((3, None), ctest.get_shards())
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "shards=3 shard=2"):
+            self.assertEqual((3, 2), ctest.get_shards())
+
+        for value, message in [
+                ("shard=1", "shard requires shards"),
+                ("shards=0", "Invalid shard count: 0"),
+                ("shards=2 shard=3", "Invalid shard: 3"),
+                ("shards=2 shard", "Invalid shard: True")]:
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS", value):
+                with self.assertRaisesRegex(ValueError, message):
+                    ctest.get_shards()
+
+    def test_test_none_shard(self):
+        self.dh.start([])
+        self.dh.configure(["--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+        self.dh.build([])
+        self.write_cost_data(os.path.join(
+            self.dh.get_build_directory(),
+            "Testing/Temporary/CTestCostData.txt"))
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "shards=2 shard=2"):
+            self.dh.test([])
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "shards=2 shard=1"):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+
+    def read_test_xml(self, ctest_testing_dir):
+        with open(os.path.join(ctest_testing_dir, "Testing/TAG"), "r") as f:
+            date = next(f).rstrip()
+        with open(os.path.join(ctest_testing_dir, "Testing", date,
+                               "Test.xml"), "r") as f:
+            return xml.etree.ElementTree.fromstring(f.read())
+
+    def test_test_experimental_shards_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit shards=2"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.write_cost_data(
+                "debian/.ctest/Testing/Temporary/CTestCostData.txt")
+            self.dh.test([])
+
+            shard1 = self.read_test_xml("debian/.ctest/shards/1")
+            self.assertEqual(["TestFalse"], [
+                t.findtext("Name") for t in shard1.findall("Testing/Test")])
+            shard2 = self.read_test_xml("debian/.ctest/shards/2")
+            self.assertEqual(["TestTrue"], [
+                t.findtext("Name") for t in shard2.findall("Testing/Test")])
+
+            with open("debian/.ctest/Testing/TAG", "r") as f:
+                tag = "%s-%s" % (next(f).rstrip(), next(f).rstrip())
+            merged = self.read_test_xml("debian/.ctest")
+            self.assertEqual(tag, merged.get("BuildStamp"))
+            self.assertEqual({"TestTrue": "passed", "TestFalse": "failed"}, {
+                t.findtext("Name"): t.get("Status")
+                for t in merged.findall("Testing/Test")})
+
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+            # CTest only records the cost of tests that passed
+            with open("debian/.ctest/Testing/Temporary/CTestCostData.txt",
+                      "r") as f:
+                costs, failed = costdata.read_cost_data(f)
+            self.assertEqual({"TestTrue": 2, "TestFalse": 1},
+                             {name: runs for name, (runs, cost)
+                              in costs.items()})
+            self.assertEqual({"TestFalse"}, failed)
+
+    def test_test_experimental_shards_catchfailed(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental shards=2 catchfailed"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+
+            merged = self.read_test_xml("debian/.ctest")
+            self.assertEqual(2, len(merged.findall("Testing/Test")))
+            self.assertFileContentsEqual(
+                "2:TestFalse\n", os.path.join(
+                    "debian/.ctest/Testing/Temporary",
+                    "LastTestsFailed_%s.log" % self.get_testing_tag_date()))
+
+    def test_test_experimental_shards_skipped_catchfailed(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental shards=2 catchfailed"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_SKIP_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+
+            merged = self.read_test_xml("debian/.ctest")
+            self.assertEqual({"TestTrue": "passed", "TestSkip": "notrun"}, {
+                t.findtext("Name"): t.get("Status")
+                for t in merged.findall("Testing/Test")})
+
+    def test_get_parallel_args(self):
+        self.assertEqual([], self.dh.get_parallel_args(True))
+
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=5"):
+            self.assertEqual(["-j5"], self.dh.get_parallel_args(False))
+            self.assertEqual(["-DDH_CTEST_PARALLEL_LEVEL:STRING=2"],
+                             self.dh.get_parallel_args(True, shares=2))
+            self.assertEqual(["-DDH_CTEST_PARALLEL_LEVEL:STRING=1"],
+                             self.dh.get_parallel_args(True, shares=8))
+
+    def test_merge_shards_empty(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.assertEqual(0, self.dh.merge_shards(2))
+
+        self.assertFileNotExists(os.path.join(
+            "debian/.ctest/Testing", self.get_testing_tag_date(), "Test.xml"))
+
+    def test_test_experimental_shards_separate(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+        date = self.get_testing_tag_date()
+
+        # Each shard could run on a different builder
+        for shard in [1, 2]:
+            with PushEnvironmentVariable(
+                    "DEB_CTEST_OPTIONS",
+                    "model=Experimental submit shards=2 shard=%i" % shard):
+                self.dh.test([])
+        self.assertFileNotExists(os.path.join("debian/.ctest/Testing", date,
+                                              "Test.xml"))
+        self.assertFilesSubmittedEqual({"Configure", "Build"})
+
+        shard_xmls = {}
+        for shard in ["1", "2"]:
+            path = os.path.join("debian/.ctest/shards", shard, "Testing",
+                                date, "Test.xml")
+            shard_xmls[path] = os.stat(path).st_mtime_ns
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit shards=2"):
+            self.dh.test([])
+
+        for path, mtime_ns in shard_xmls.items():
+            self.assertEqual(mtime_ns, os.stat(path).st_mtime_ns)
+        self.assertEqual(2, len(
+            self.read_test_xml("debian/.ctest").findall("Testing/Test")))
+        self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+    def test_parse_ctest_version(self):
+        self.assertEqual((3, 25), ctest.parse_ctest_version(
+            "ctest version 3.25.1\n\nCMake suite maintained and supported "
+            "by Kitware (kitware.com/cmake).\n"))
+        with self.assertRaisesRegex(ValueError,
+                                    "Could not read the CTest version"):
+            ctest.parse_ctest_version("")
+
+    def test_test_none_resource_spec(self):
+        self.dh.start([])
+        self.dh.configure(["--", "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON"])
+        self.dh.build([])
+        self.dh.test([])
+        self.assertFileNotExists("debian/.ctest/resources.json")
+
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "resourcespec"):
+            self.dh.test([])
+
+        with open("debian/.ctest/resources.json", "r") as f:
+            local = self.get_single_element(json.load(f)["local"])
+        self.assertGreater(local["threads"][0]["slots"], 0)
+        self.assertGreater(local["memory"][0]["slots"], 0)
+
+        with open(os.path.join(self.dh.get_build_directory(),
+                               "Testing/Temporary/LastTest.log"), "r") as f:
+            log = f.read()
+        self.assertIn("CTEST_RESOURCE_GROUP_0_THREADS=id:0,slots:1", log)
+        self.assertIn("CTEST_RESOURCE_GROUP_0_MEMORY=id:0,slots:1", log)
+
+    def test_test_none_resource_spec_old_ctest(self):
+        self.dh._ctest_version = (3, 15)
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "resourcespec"):
+            with self.assertRaisesRegex(
+                    ValueError,
+                    "resourcespec requires CTest 3.16 or newer, found 3.15"):
+                self.dh.test([])
+
+    def test_test_experimental_resource_spec(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental resourcespec"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+
+            tree = self.read_test_xml("debian/.ctest")
+            test_resources = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestResources']"))
+            self.assertEqual("passed", test_resources.get("Status"))
+            output = test_resources.find("Results/Measurement/Value")
+            if output.get("compression") == "gzip":
+                output = zlib.decompress(
+                    base64.b64decode(output.text)).decode()
+            else:
+                output = output.text
+            self.assertIn("CTEST_RESOURCE_GROUP_0_THREADS=id:0,slots:1",
+                          output)
+
+    def test_get_output_size(self):
+        self.assertIsNone(ctest.get_output_size("passed"))
+
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "passedoutputsize=1024 failedoutputsize=x"):
+            self.assertEqual(1024, ctest.get_output_size("passed"))
+            with self.assertRaisesRegex(
+                    ValueError, "Invalid failed test output size: x"):
+                ctest.get_output_size("failed")
+
+    def read_test_output(self, name):
+        with gzip.open(os.path.join("debian/.ctest/output",
+                                    name + ".log.gz"), "rt") as f:
+            return f.read()
+
+    def test_test_none_quiet_cmd(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS", "quiet failedoutputsize=100"):
+            self.dh.stdout = io.StringIO()
+            self.dh.test(["--no-act", "-v"])
+
+        self.assertEqual("\tcd %s && ctest --output-on-failure "
+                         "--test-output-size-failed 100\n"
+                         % self.dh.get_build_directory(),
+                         self.dh.stdout.getvalue())
+
+    def test_test_none_quiet(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "quiet resourcespec"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+
+        self.assertEqual("", self.read_test_output("TestTrue"))
+        self.assertIn("CTEST_RESOURCE_GROUP_COUNT=1\n",
+                      self.read_test_output("TestResources"))
+
+    def test_test_none_output_size_old_ctest(self):
+        self.dh._ctest_version = (3, 17)
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "passedoutputsize=100"):
+            with self.assertRaisesRegex(
+                    ValueError,
+                    "passedoutputsize requires CTest 3.18 or newer, "
+                    "found 3.17"):
+                self.dh.test([])
+
+    def test_test_experimental_quiet(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental quiet resourcespec passedoutputsize=10"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+
+        self.assertEqual("", self.read_test_output("TestTrue"))
+        output = self.read_test_output("TestResources")
+        self.assertTrue(output.startswith("CTEST_RESO...\n"))
+        self.assertIn("exceeds the threshold of 10 bytes", output)
+
+    def test_test_experimental_quiet_console(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS", "model=Experimental quiet resourcespec"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON",
+                 "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+
+            # CTest writes straight to the file descriptor, so this needs a
+            # real file
+            with tempfile.TemporaryFile("w+") as f:
+                self.dh.stdout = f
+                self.dh.test([])
+                f.seek(0)
+                console = f.read()
+
+        self.assertIn("Test TestFalse (Failed):\n", console)
+        self.assertNotIn("TestResources", console)
+        self.assertNotIn("CTEST_RESOURCE_GROUP_", console)
+        self.assertIn("CTEST_RESOURCE_GROUP_",
+                      self.read_test_output("TestResources"))
+
+    def test_test_experimental(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(1, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            self.assertFilesSubmittedEqual({})
+
+    def test_test_experimental_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(1, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+    def test_test_experimental_no_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test(["-O--no-submit"])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(1, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            self.assertFilesSubmittedEqual({"Configure", "Build"})
+
+    def test_test_experimental_bad(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(2, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            test_false = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestFalse']"))
+            self.assertEqual("failed", test_false.get("Status"))
+
+            self.assertFilesSubmittedEqual({})
+
+    def test_test_experimental_bad_exclude(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test(["--", "-E", "TestFalse"])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(1, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            self.assertFilesSubmittedEqual({})
+
+    def test_test_experimental_bad_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(2, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            test_false = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestFalse']"))
+            self.assertEqual("failed", test_false.get("Status"))
+
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+    def test_test_experimental_bad_catchfailed_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental catchfailed submit"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            tests = tree.findall("Testing/Test")
+            self.assertEqual(2, len(tests))
+
+            test_true = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestTrue']"))
+            self.assertEqual("passed", test_true.get("Status"))
+
+            test_false = self.get_single_element(tree.findall(
+                "Testing/Test[Name='TestFalse']"))
+            self.assertEqual("failed", test_false.get("Status"))
+
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+    def test_test_none_failfast_cmd(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "failfast"):
+            self.dh.stdout = io.StringIO()
+            self.dh.test(["--no-act", "-v"])
+
+        self.assertEqual("\tcd %s && ctest -VV --stop-on-failure\n"
+                         % self.dh.get_build_directory(),
+                         self.dh.stdout.getvalue())
+
+    def test_test_none_failfast(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "failfast"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON",
+                "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON"])
+            self.dh.build([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+
+        with open(os.path.join(self.dh.get_build_directory(),
+                               "Testing/Temporary/LastTest.log"), "r") as f:
+            log = f.read()
+        self.assertIn("Test: TestFalse", log)
+        self.assertNotIn("Test: TestResources", log)
+
+    def test_test_none_failfast_old_ctest(self):
+        self.dh._ctest_version = (3, 17)
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "failfast"):
+            with self.assertRaisesRegex(
+                    ValueError,
+                    "failfast requires CTest 3.18 or newer, found 3.17"):
+                self.dh.test([])
+
+    def test_test_experimental_failfast_old_ctest(self):
+        self.dh._ctest_version = (3, 17)
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental failfast"):
+            with self.assertRaisesRegex(
+                    ValueError,
+                    "failfast requires CTest 3.18 or newer, found 3.17"):
+                self.dh.test([])
+
+    def test_test_experimental_bad_failfast_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental failfast submit"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON",
+                "-DDH_CMAKE_ENABLE_RESOURCE_TEST:BOOL=ON"])
+            self.dh.build([])
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+            self.assertEqual(["TestTrue", "TestFalse"],
+                             [t.findtext("Name")
+                              for t in tree.findall("Testing/Test")])
+
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+    def test_configure_none_rusage_cmd(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "rusage"):
+            self.dh.stdout = io.StringIO()
+            self.dh.configure(["--no-act", "-v", "--", "-DFOO=1"])
+
+        self.assertEqual(
+            "\tdh_auto_configure --no-act -v -- -DFOO=1 "
+            "-DCMAKE_PROJECT_INCLUDE:FILEPATH=%s\n"
+            % pkg_resources.resource_filename(
+                "dhcmake", "dh_ctest_rusage_project.cmake"),
+            self.dh.stdout.getvalue())
+
+    def test_test_none_rusage(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "rusage"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
+
+        self.assertNotIn("DH_CTEST_RUSAGE_LAUNCHER", os.environ)
+        self.assertEqual(["TestTrue.json"],
+                         os.listdir("debian/.ctest/rusage"))
+        usage = rusage.read_usage("debian/.ctest/rusage", "TestTrue")
+        self.assertEqual("TestTrue", usage["name"])
+        self.assertGreater(usage["max_rss"], 0)
+
+        # Without the option, the tests run as they were configured
+        self.dh.clean([])
+        self.dh.test([])
+        self.assertFileNotExists("debian/.ctest/rusage")
+
+    def test_test_experimental_rusage(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental rusage"):
+            self.dh.start([])
+            self.dh.configure([
+                "--", "-DDH_CMAKE_ENABLE_BAD_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date, "Test.xml"),
+                      "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+
+        for name in ["TestTrue", "TestFalse"]:
+            test = self.get_single_element(tree.findall(
+                "Testing/Test[Name='%s']" % name))
+            measurements = {
+                m.get("name"): m.findtext("Value")
+                for m in test.findall("Results/NamedMeasurement")}
+            usage = rusage.read_usage("debian/.ctest/rusage", name)
+            self.assertEqual(str(usage["max_rss"]),
+                             measurements["Peak Memory (KiB)"])
+            self.assertIn("Involuntary Context Switches", measurements)
+
+        test_false = self.get_single_element(tree.findall(
+            "Testing/Test[Name='TestFalse']"))
+        self.assertEqual("failed", test_false.get("Status"))
+
+    def test_report_none(self):
+        self.dh.start([])
+        self.dh.configure([])
+        self.dh.build([])
+        self.dh.test([])
+        self.dh.stdout = io.StringIO()
+        self.dh.report([])
+
+        self.assertEqual("", self.dh.stdout.getvalue())
+        self.assertFileNotExists("debian/.ctest/junit.xml")
+
+    def test_report_experimental(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test(["--", "-E", "TestFalse"])
+            self.dh.stdout = io.StringIO()
+            self.dh.report(["--junit", "debian/junit.xml"])
+
+        lines = self.dh.stdout.getvalue().splitlines()
+        self.assertEqual("1 tests: 1 passed", lines[0])
+        self.assertEqual(["Slowest tests:"], lines[1:2])
+        self.assertRegex(lines[2], "^\t *[0-9.]+ s  TestTrue$")
+
+        tree = xml.etree.ElementTree.parse("debian/junit.xml")
+        self.assertEqual(["TestTrue"], [t.get("name") for t in
+                                        tree.findall("testsuite/testcase")])
+
+    def test_select_coverage_jobs(self):
+        self.dh.parse_args([])
+        self.assertEqual(1, self.dh.select_coverage_jobs())
+
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=4"):
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "coverage"):
+                self.assertEqual(4, self.dh.select_coverage_jobs())
+
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                         "coverage=1000000000"):
+                self.assertEqual(1, self.dh.select_coverage_jobs())
+
+            with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "coverage=0"):
+                with self.assertRaisesRegex(ValueError,
+                                            "Invalid coverage job memory: 0"):
+                    self.dh.select_coverage_jobs()
+
+    def test_coverage_none(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS", "coverage"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_COVERAGE_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+            self.dh.coverage([])
+
+        self.assertFileNotExists("debian/.ctest/Testing/TAG")
+        self.assertFileNotExists("debian/.ctest/coverage")
+
+    def test_coverage_experimental_no_coverage(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_COVERAGE_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+            self.dh.coverage([])
+            date = self.get_testing_tag_date()
+
+            self.assertFileNotExists(os.path.join("debian/.ctest/Testing",
+                                                  date, "Coverage.xml"))
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+
+    def test_coverage_experimental_submit(self):
+        with PushEnvironmentVariable("DEB_BUILD_OPTIONS", "parallel=2"), \
+                PushEnvironmentVariable(
+                    "DEB_CTEST_OPTIONS",
+                    "model=Experimental submit coverage=1"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_COVERAGE_TEST:BOOL=ON"])
+            self.dh.build([])
+            self.dh.test([])
+            self.dh.coverage([])
+            date = self.get_testing_tag_date()
+
+            with open(os.path.join("debian/.ctest/Testing", date,
+                                   "Coverage.xml"), "r") as f:
+                tree = xml.etree.ElementTree.fromstring(f.read())
+            files = {os.path.basename(e.attrib["FullPath"]): e
+                     for e in tree.iter("File")}
+            self.assertEqual("5", files["coverage-test.c"].find(
+                "LOCTested").text)
+            self.assertEqual("3", files["coverage-test.c"].find(
+                "LOCUnTested").text)
+
+            # gcov ran before ctest_coverage() did, and ctest_coverage()
+            # found its results
+            self.assertEqual(1, len(os.listdir("debian/.ctest/coverage")))
+            gcda = os.path.join(
+                os.getcwd(), self.dh.get_build_directory(),
+                "CMakeFiles/coverage-test.dir/coverage-test.c.gcda")
+            output_dir = gcov.get_output_directory(
+                os.path.abspath("debian/.ctest/coverage"),
+                ["-o", os.path.dirname(gcda), gcda])
+            with open(os.path.join(output_dir, "status"), "r") as f:
+                self.assertEqual("0\n", f.read())
+            self.assertTrue(any(
+                n.endswith(".gcov") for n in os.listdir(output_dir)))
+
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Coverage", "CoverageLog-0"})
+
+    def test_run_experimental_coverage(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental coverage"):
+            self.dh.start([])
+            self.dh.configure(
+                ["--", "-DDH_CMAKE_ENABLE_COVERAGE_TEST:BOOL=ON"])
+            self.dh.run(["--steps", "build,test,coverage"])
+            date = self.get_testing_tag_date()
+
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Coverage.xml"))
+
+    def test_submit_none(self):
+        self.dh.start([])
+        self.dh.configure(["-O--no-submit"])
+        self.dh.build(["-O--no-submit"])
+        self.dh.test(["-O--no-submit"])
+        self.dh.submit([])
+
+        self.assertFilesSubmittedEqual(set())
+
+    def test_submit_experimental_nosubmit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            self.dh.build(["-O--no-submit"])
+            self.dh.test(["-O--no-submit"])
+            self.dh.submit([])
+
+            self.assertFilesSubmittedEqual(set())
+
+    def test_submit_experimental_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            self.dh.build(["-O--no-submit"])
+            self.dh.test(["-O--no-submit"])
+            self.dh.submit([])
+
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Done"})
+
+    def test_submit_experimental_submit_parts(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            self.dh.build(["-O--no-submit"])
+            self.dh.test(["-O--no-submit"])
+            self.dh.submit(["--parts", "Configure", "Build"])
+
+            self.assertFilesSubmittedEqual({"Configure", "Build"})
+
+    def test_run_none(self):
+        self.dh.run(["--steps", "start,update,configure,build,test,submit"])
+
+        self.assertFileNotExists(os.path.join("debian/.ctest/Testing/TAG"))
+        self.assertFileExists(os.path.join(self.dh.get_build_directory(),
+                                           "libdh-cmake-test.so"))
+
+        self.assertFilesSubmittedEqual(set())
+
+    def test_run_invalid_step(self):
+        with self.assertRaises(ValueError):
+            self.dh.run(["--steps", "start,install"])
+
+    def test_run_experimental_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.run(["--steps", "start,update,configure,build"])
+            date = self.get_testing_tag_date()
+
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Configure.xml"))
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Build.xml"))
+            self.assertFileNotExists(os.path.join("debian/.ctest/Testing",
+                                                  date, "Update.xml"))
+            self.assertFileExists(os.path.join(self.dh.get_build_directory(),
+                                               "libdh-cmake-test.so"))
+
+            self.assertFilesSubmittedEqual({"Configure", "Build"})
+
+    def test_run_experimental_test_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.run(["-O--no-submit", "--steps",
+                         "start,configure,build,test,submit"])
+            date = self.get_testing_tag_date()
+
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Test.xml"))
+
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Done"})
+
+    def test_run_experimental_bad_submit(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.run([
+                    "--steps=start,configure,build", "--",
+                    "-DDH_CMAKE_ENABLE_BAD_CONFIGURE:BOOL=ON"])
+            date = self.get_testing_tag_date()
+
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Configure.xml"))
+
+            self.assertFileNotExists(os.path.join("debian/.ctest/Testing",
+                                                  date, "Build.xml"))
+
+            self.assertFilesSubmittedEqual({"Configure"})
+
+    def test_run_experimental_bad_build(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.run([
+                    "--steps=start,configure,build,test", "--",
+                    "-DDH_CMAKE_ENABLE_BAD_BUILD:BOOL=ON"])
+            date = self.get_testing_tag_date()
+
+            self.assertFileExists(os.path.join("debian/.ctest/Testing", date,
+                                               "Build.xml"))
+
+            self.assertFileNotExists(os.path.join("debian/.ctest/Testing",
+                                                  date, "Test.xml"))
+
+            self.assertFilesSubmittedEqual({"Configure", "Build"})
+
+    def test_run_experimental_buildmemory(self):
+        cache_dir = self.make_directory_in_tmp("cache")
+        cached = os.path.join(cache_dir,
+                              "dh-cmake-test/ctest/build-memory.json")
+
+        with PushEnvironmentVariable("DH_CMAKE_CACHE_DIR", cache_dir), \
+                PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                        "model=Experimental buildmemory"):
+            # Only the build counts, so a configure that fails records
+            # nothing
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.run([
+                    "--steps=start,configure,build", "--",
+                    "-DDH_CMAKE_ENABLE_BAD_CONFIGURE:BOOL=ON"])
+            self.assertFileNotExists(cached)
+
+            self.dh.run([
+                "--steps=start,configure,build", "--",
+                "-DDH_CMAKE_ENABLE_BAD_CONFIGURE:BOOL=OFF"])
+
+            with open(cached, "r") as f:
+                history = json.load(f)["peak_memory"]
+            self.assertEqual(1, len(history))
+            self.assertGreater(history[0], 0)
+            self.assertFileNotExists("debian/.ctest/build-rusage.json")
+
+    def test_submit_experimental_spool(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit spool"):
+            self.dh.start([])
+            self.dh.configure([])
+            self.dh.build([])
+            self.dh.test([])
+            self.wait_for_spool()
+
+            self.assertFilesSubmittedEqual({"Configure", "Build", "Test"})
+            self.assertEqual([], spool.list_parts("debian/.ctest/spool"))
+            self.assertFileExists("debian/.ctest/spool/.log")
+            # The workers submitted from snapshots, not the live directory
+            self.assertEqual([], [
+                n for n in os.listdir("debian/.ctest/Testing/Temporary")
+                if n.startswith("LastSubmit")])
+
+            self.dh.submit(["--parts", "Done"])
+
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Done"})
+
+    def test_submit_experimental_replay_spool(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            self.dh.build(["-O--no-submit"])
+
+            # Left over by a build that did not get to dh_ctest_submit
+            os.makedirs("debian/.ctest/spool")
+            with open("debian/.ctest/spool/Configure", "w"):
+                pass
+
+            self.dh.submit(["--parts", "Build"])
+
+            self.assertFilesSubmittedEqual({"Configure", "Build"})
+            self.assertEqual([], spool.list_parts("debian/.ctest/spool"))
+
+    def test_submit_experimental_replay_spool_bad(self):
         with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
                                      "model=Experimental submit"):
             self.dh.start([])
             self.dh.configure(["-O--no-submit"])
+
+            os.makedirs("debian/.ctest/spool")
+            with open("debian/.ctest/spool/Configure", "w"):
+                pass
+
+            self.cdash_server.shutdown()
+            self.cdash_server.server_close()
+
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.dh.submit([])
+
+            self.assertEqual(["Configure"],
+                             spool.list_parts("debian/.ctest/spool"))
+
+    def test_submit_experimental_native(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit nativesubmit"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            self.dh.build(["-O--no-submit"])
+            self.dh.test(["-O--no-submit"])
+            self.dh.submit([])
+
+            self.assertFilesSubmittedEqual(
+                {"Configure", "Build", "Test", "Done"})
+
+    def test_submit_experimental_native_gzip(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental submit nativesubmit=gzip"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            self.dh.submit([])
+
+            self.assertFilesSubmittedEqual({"Configure", "Done"})
+
+    def test_submit_experimental_native_invalid(self):
+        with PushEnvironmentVariable(
+                "DEB_CTEST_OPTIONS",
+                "model=Experimental submit nativesubmit=bzip2"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
+            with self.assertRaisesRegex(ValueError,
+                                        "Invalid nativesubmit: bzip2"):
+                self.dh.submit([])
+
+    def test_submit_experimental_native_parts(self):
+        with PushEnvironmentVariable("DEB_CTEST_OPTIONS",
+                                     "model=Experimental submit nativesubmit"):
+            self.dh.start([])
+            self.dh.configure(["-O--no-submit"])
             self.dh.build(["-O--no-submit"])
             self.dh.test(["-O--no-submit"])
             self.dh.submit(["--parts", "Configure", "Build"])
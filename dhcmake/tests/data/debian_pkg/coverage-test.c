@@ -0,0 +1,17 @@
+static int covered(int x)
+{
+  return x + 1;
+}
+
+static int not_covered(int x)
+{
+  return x - 1;
+}
+
+int main(int argc, char** argv)
+{
+  if (argc > 1) {
+    return not_covered(argc);
+  }
+  return covered(argc) - 2;
+}
@@ -0,0 +1,72 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import os.path
+import subprocess
+import tempfile
+
+from dhcmake import elf
+from . import KWTestCaseBase
+
+
+def compile_elf_objects(directory):
+    with open(os.path.join(directory, "bar.c"), "w") as f:
+        f.write("int bar(void) { return 1; }\n")
+    with open(os.path.join(directory, "foo.c"), "w") as f:
+        f.write("int bar(void);\nint main(void) { return bar(); }\n")
+
+    subprocess.run(["cc", "-shared", "-fPIC", "-Wl,-soname,libbar.so.1",
+                    "-o", "libbar.so.1.0", "bar.c"],
+                   cwd=directory, check=True)
+    subprocess.run(["cc", "-o", "foo", "foo.c", "libbar.so.1.0"],
+                   cwd=directory, check=True)
+
+    return os.path.join(directory, "libbar.so.1.0"), \
+        os.path.join(directory, "foo")
+
+
+class ElfTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.libbar, self.foo = compile_elf_objects(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_dynamic_library(self):
+        soname, needed = elf.read_dynamic(self.libbar)
+        self.assertEqual("libbar.so.1", soname)
+        self.assertNotIn("libbar.so.1", needed)
+
+    def test_read_dynamic_executable(self):
+        soname, needed = elf.read_dynamic(self.foo)
+        self.assertIsNone(soname)
+        self.assertEqual("libbar.so.1", needed[0])
+
+    def test_read_dynamic_not_elf(self):
+        self.assertIsNone(elf.read_dynamic(
+            os.path.join(self.tmp_dir.name, "bar.c")))
+
+    def test_read_dynamic_truncated(self):
+        truncated = os.path.join(self.tmp_dir.name, "truncated")
+        with open(self.libbar, "rb") as f:
+            data = f.read(80)
+        with open(truncated, "wb") as f:
+            f.write(data)
+
+        with self.assertRaisesRegex(elf.ElfError, "Truncated ELF file"):
+            elf.read_dynamic(truncated)
+
+    def test_scan(self):
+        paths = [self.libbar, self.foo,
+                 os.path.join(self.tmp_dir.name, "bar.c"),
+                 os.path.join(self.tmp_dir.name, "nonexistent")]
+        expected = {
+            self.libbar: elf.read_dynamic(self.libbar),
+            self.foo: elf.read_dynamic(self.foo),
+        }
+
+        self.assertEqual(expected, elf.scan(paths))
+        self.assertEqual(expected, elf.scan(paths * elf.SERIAL_SCAN_THRESHOLD,
+                                            jobs=2))
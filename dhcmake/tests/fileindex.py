@@ -0,0 +1,96 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import os
+import tempfile
+
+from dhcmake import fileindex
+from . import KWTestCaseBase
+
+
+class InstalledFilesIndexTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp_dir.name, "installed.idx")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_write_lookup(self):
+        fileindex.write_index(self.index_path, [
+            ("usr/include/foo.h", "libfoo-dev", "Headers", "dh_cmake_install"),
+            ("usr/lib/libfoo.so.1", "libfoo1", "", "dh_cmake_install"),
+            ("usr/lib/libfoo.so.1", "libfoo1", "", "dh_cmake_install"),
+            ("usr/lib/libfoo.so.1", "libfoo1-dbg", "", "dh_cpack_install"),
+        ])
+
+        with fileindex.InstalledFilesIndex(self.index_path) as index:
+            self.assertEqual(3, len(index))
+            self.assertEqual([
+                ("usr/include/foo.h", "libfoo-dev", "Headers",
+                 "dh_cmake_install"),
+            ], index.lookup("usr/include/foo.h"))
+            self.assertEqual([
+                ("usr/lib/libfoo.so.1", "libfoo1", "", "dh_cmake_install"),
+                ("usr/lib/libfoo.so.1", "libfoo1-dbg", "",
+                 "dh_cpack_install"),
+            ], index.lookup("usr/lib/libfoo.so.1"))
+            self.assertEqual([], index.lookup("usr/lib/libbar.so.1"))
+            self.assertEqual([], index.lookup("usr"))
+
+    def test_update(self):
+        fileindex.update_index(self.index_path, [
+            ("usr/lib/libfoo.so.1", "libfoo1", "", "dh_cmake_install"),
+        ])
+        fileindex.update_index(self.index_path, [
+            ("usr/include/foo.h", "libfoo-dev", "Headers", "dh_cpack_install"),
+            ("usr/lib/libfoo.so.1", "libfoo1", "", "dh_cmake_install"),
+        ])
+
+        with fileindex.InstalledFilesIndex(self.index_path) as index:
+            self.assertEqual([
+                ("usr/include/foo.h", "libfoo-dev", "Headers",
+                 "dh_cpack_install"),
+                ("usr/lib/libfoo.so.1", "libfoo1", "", "dh_cmake_install"),
+            ], list(index))
+
+    def test_find_unclaimed(self):
+        staging = os.path.join(self.tmp_dir.name, "tmp")
+        os.makedirs(os.path.join(staging, "usr/include"))
+        os.makedirs(os.path.join(staging, "usr/share/doc"))
+        for path in ["usr/include/foo.h", "usr/include/bar.h",
+                     "usr/share/doc/README"]:
+            with open(os.path.join(staging, path), "w"):
+                pass
+        os.symlink("doc", os.path.join(staging, "usr/share/doc-link"))
+
+        self.assertEqual([
+            "usr/include/bar.h",
+            "usr/include/foo.h",
+            "usr/share/doc-link",
+            "usr/share/doc/README",
+        ], fileindex.find_unclaimed(None, staging))
+
+        fileindex.write_index(self.index_path, [
+            ("usr/include/foo.h", "libfoo-dev", "Headers", "dh_cmake_install"),
+            ("usr/share/doc/README", "libfoo-doc", "", "dh_cmake_install"),
+        ])
+        with fileindex.InstalledFilesIndex(self.index_path) as index:
+            self.assertEqual([
+                "usr/include/bar.h",
+                "usr/share/doc-link",
+            ], fileindex.find_unclaimed(index, staging))
+
+    def test_invalid(self):
+        with open(self.index_path, "wb") as f:
+            f.write(b"garbage garbage garbage")
+        with self.assertRaisesRegex(fileindex.FileIndexError,
+                                    "Invalid installed files index"):
+            fileindex.InstalledFilesIndex(self.index_path)
+
+        with open(self.index_path, "wb") as f:
+            f.write(b"garbage")
+        with self.assertRaisesRegex(fileindex.FileIndexError,
+                                    "Truncated installed files index"):
+            fileindex.InstalledFilesIndex(self.index_path)
@@ -0,0 +1,108 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from dhcmake import gcov
+from . import KWTestCaseBase
+
+
+FAKE_GCOV = """#!/bin/sh
+echo "File '$3'"
+echo "Creating 'fake.c.gcov'"
+echo "$@" > fake.c.gcov
+echo "Run in $(pwd)" >&2
+exit 3
+"""
+
+
+class GCovTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "coverage")
+        self.work_dir = self.make_directory("work")
+        self.fake_gcov = os.path.join(self.tmp_dir.name, "gcov")
+        with open(self.fake_gcov, "w") as f:
+            f.write(FAKE_GCOV)
+        os.chmod(self.fake_gcov, 0o755)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_directory(self, name):
+        path = os.path.join(self.tmp_dir.name, name)
+        os.makedirs(path)
+        return path
+
+    def touch(self, *names):
+        for name in names:
+            path = os.path.join(self.tmp_dir.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w"):
+                pass
+
+    def run_replay(self, args):
+        return subprocess.run(
+            [sys.executable, gcov.__file__, self.cache_dir, self.fake_gcov,
+             *args], cwd=self.work_dir, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_find_gcda_files(self):
+        self.touch("build/a.dir/y.c.gcda", "build/a.dir/x.c.gcda",
+                   "build/a.dir/x.c.gcno", "build/b/c.dir/z.c.gcda")
+        build_dir = os.path.join(self.tmp_dir.name, "build")
+
+        self.assertEqual({
+            os.path.join(build_dir, "a.dir"): [
+                os.path.join(build_dir, "a.dir/x.c.gcda"),
+                os.path.join(build_dir, "a.dir/y.c.gcda"),
+            ],
+            os.path.join(build_dir, "b/c.dir"): [
+                os.path.join(build_dir, "b/c.dir/z.c.gcda"),
+            ],
+        }, gcov.find_gcda_files(build_dir))
+
+    def test_replay(self):
+        gcda = os.path.join(self.tmp_dir.name, "build/a.dir/x.c.gcda")
+        gcov.run_directory(self.cache_dir, self.fake_gcov, [gcda])
+
+        result = self.run_replay(gcov.get_gcov_args(gcda))
+
+        self.assertEqual(3, result.returncode)
+        self.assertEqual("File '%s'\nCreating 'fake.c.gcov'\n" % gcda,
+                         result.stdout)
+        output_dir = gcov.get_output_directory(self.cache_dir,
+                                               gcov.get_gcov_args(gcda))
+        self.assertEqual("Run in %s\n" % output_dir, result.stderr)
+        with open(os.path.join(self.work_dir, "fake.c.gcov"), "r") as f:
+            self.assertEqual("-o %s %s\n" % (os.path.dirname(gcda), gcda),
+                             f.read())
+
+    def test_replay_relative(self):
+        gcda = os.path.join(self.tmp_dir.name, "build/a.dir/x.c.gcda")
+        link = os.path.join(self.tmp_dir.name, "link")
+        os.symlink(self.tmp_dir.name, link)
+        gcov.run_directory(self.cache_dir, self.fake_gcov, [os.path.relpath(
+            os.path.join(link, "build/a.dir/x.c.gcda"))])
+
+        result = self.run_replay(gcov.get_gcov_args(gcda))
+
+        self.assertEqual(3, result.returncode)
+        output_dir = gcov.get_output_directory(self.cache_dir,
+                                               gcov.get_gcov_args(gcda))
+        self.assertEqual("Run in %s\n" % output_dir, result.stderr)
+
+    def test_replay_not_run(self):
+        gcda = os.path.join(self.tmp_dir.name, "build/a.dir/x.c.gcda")
+
+        result = self.run_replay(gcov.get_gcov_args(gcda))
+
+        self.assertEqual(3, result.returncode)
+        self.assertEqual("File '%s'\nCreating 'fake.c.gcov'\n" % gcda,
+                         result.stdout)
+        self.assertEqual("Run in %s\n" % self.work_dir, result.stderr)
+        self.assertFileExists(os.path.join(self.work_dir, "fake.c.gcov"))
@@ -0,0 +1,135 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import contextlib
+import io
+import os
+import tempfile
+
+from dhcmake import history
+from . import KWTestCaseBase
+
+
+KEY = {"source": "pkg", "version": "1.0-1", "arch": "amd64"}
+
+
+class HistoryTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, history.HISTORY_FILE)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def record(self, version, step, durations, outcome="passed", tests=()):
+        for duration in durations:
+            history.record_step(
+                self.path, dict(KEY, version=version), step, 0.0, duration,
+                {"user_time": 1.0, "system_time": 0.5, "max_rss": 2048},
+                outcome, tests)
+
+    def read_series(self, **kwargs):
+        conn = history.connect(self.path)
+        try:
+            return history.read_series(conn, **kwargs)
+        finally:
+            conn.close()
+
+    def test_read_series(self):
+        self.record("1.0-10", "dh_ctest_build", [30.0])
+        self.record("1.0-2", "dh_ctest_build", [20.0])
+        self.record("1.0-2", "dh_ctest_build", [1.0], outcome="failed")
+        self.record("1.0-2", "dh_ctest_test", [5.0], tests=[
+            {"name": "TestTrue", "status": "passed", "time": 0.5,
+             "max_rss": 1024},
+            {"name": "TestFalse", "status": "failed", "time": 1.5},
+        ])
+
+        self.assertEqual({
+            ("pkg", "amd64", "dh_ctest_build", None): [
+                ("1.0-2", [
+                    {"duration": 20.0, "max_rss": 2048, "outcome": "passed"},
+                    {"duration": 1.0, "max_rss": 2048, "outcome": "failed"},
+                ]),
+                ("1.0-10", [
+                    {"duration": 30.0, "max_rss": 2048, "outcome": "passed"},
+                ]),
+            ],
+        }, self.read_series(step="dh_ctest_build"))
+
+        self.assertEqual({
+            ("pkg", "amd64", "dh_ctest_test", "TestTrue"): [
+                ("1.0-2", [
+                    {"duration": 0.5, "max_rss": 1024, "outcome": "passed"},
+                ]),
+            ],
+            ("pkg", "amd64", "dh_ctest_test", "TestFalse"): [
+                ("1.0-2", [
+                    {"duration": 1.5, "max_rss": None, "outcome": "failed"},
+                ]),
+            ],
+        }, self.read_series(tests=True))
+
+        self.assertEqual({}, self.read_series(arch="i386"))
+
+    def test_mann_whitney_p(self):
+        fast = [10.0, 11.0, 10.5, 10.2]
+        slow = [13.0, 12.5, 13.5, 12.8]
+
+        self.assertLess(history.mann_whitney_p(fast, slow), 0.05)
+        self.assertGreater(history.mann_whitney_p(slow, fast), 0.95)
+        self.assertGreater(history.mann_whitney_p(fast, fast), 0.5)
+        self.assertEqual(1.0, history.mann_whitney_p([1.0], [1.0]))
+
+    def test_find_regressions(self):
+        def runs(durations):
+            return [{"duration": d, "max_rss": None, "outcome": "passed"}
+                    for d in durations]
+
+        versions = [
+            ("1.0-1", runs([10.0, 11.0, 10.5])),
+            ("1.0-2", runs([10.2, 10.8, 10.4])),
+            ("1.0-3", runs([13.0, 12.5, 13.5])),
+            ("1.0-4", runs([30.0])),
+        ]
+        regressions = history.find_regressions(versions)
+        self.assertEqual([("1.0-2", "1.0-3")],
+                         [(r["from"], r["to"]) for r in regressions])
+        self.assertAlmostEqual(13.0 / 10.4667 - 1, regressions[0]["change"],
+                               places=4)
+
+        self.assertEqual([], history.find_regressions(versions,
+                                                      threshold=0.5))
+        self.assertEqual(2, len(history.find_regressions(versions,
+                                                         min_runs=1,
+                                                         alpha=0.5)))
+
+    def test_main(self):
+        self.record("1.0-1", "dh_ctest_build", [10.0, 11.0, 10.5])
+        self.record("1.0-2", "dh_ctest_build", [13.0, 12.5, 13.5])
+        self.record("1.0-2", "dh_ctest_build", [1.0], outcome="failed")
+        self.record("1.0-1", "dh_ctest_test", [5.0, 5.0, 5.0])
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(0, history.main(
+                ["--cache-dir", self.tmp_dir.name, "--regressions"]))
+
+        self.assertEqual(
+            "pkg amd64 dh_ctest_build\n"
+            "  1.0-1: 3 runs, 0 failed, mean 10.50s, stdev 0.50s, "
+            "peak 2 MiB\n"
+            "  1.0-2: 4 runs, 1 failed, mean 13.00s, stdev 0.50s, "
+            "peak 2 MiB\n"
+            "  SLOWER: 1.0-1 -> 1.0-2: +23.8% (p = 0.040)\n",
+            stdout.getvalue())
+
+    def test_main_no_history(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(0, history.main(
+                ["--cache-dir", self.tmp_dir.name]))
+
+        self.assertEqual("", stdout.getvalue())
+        self.assertFileNotExists(self.path)
@@ -0,0 +1,174 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import json
+import os
+import tempfile
+
+from dhcmake import metadata
+from . import KWTestCaseBase
+
+
+class CPackMetadataTestCase(KWTestCaseBase):
+    json_data = {
+        "components": {
+            "Libraries": {
+                "name": "Libraries",
+                "displayName": "Runtime libraries",
+                "description": "Shared library files",
+                "dependencies": [],
+            },
+            "Headers": {
+                "name": "Headers",
+                "displayName": "Header files",
+                "description": "#include files for the library",
+                "dependencies": ["Libraries"],
+            },
+        },
+        "componentGroups": {
+            "All": {
+                "name": "All",
+                "components": ["Libraries"],
+                "subgroups": ["Development"],
+            },
+            "Development": {
+                "name": "Development",
+                "components": ["Headers"],
+                "subgroups": [],
+            },
+        },
+        "projects": [
+            {
+                "projectName": "example",
+                "directory": "/build",
+                "components": ["Headers", "Libraries"],
+            },
+        ],
+        "buildType": "Release",
+        "stripFiles": True,
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.tmp_dir.name, "cpack-metadata.json")
+        with open(self.json_path, "w") as f:
+            json.dump(self.json_data, f)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def check_metadata(self, m):
+        self.assertEqual({"Libraries", "Headers"}, set(m.components))
+        self.assertEqual(("Libraries",), m.components["Headers"].dependencies)
+        self.assertEqual((), m.components["Libraries"].dependencies)
+        self.assertEqual(("Libraries",), m.component_groups["All"].components)
+        self.assertEqual(("Development",),
+                         m.component_groups["All"].subgroups)
+        self.assertEqual(1, len(m.projects))
+        self.assertEqual("/build", m.projects[0].directory)
+        self.assertEqual({"Headers", "Libraries"}, m.projects[0].components)
+        self.assertEqual("Release", m.build_type)
+        self.assertTrue(m.strip_files)
+
+    def test_slots(self):
+        m = metadata.load(self.json_path, write_sidecar=False)
+        with self.assertRaises(AttributeError):
+            m.components["Headers"].description = "Header files"
+
+    def test_load_writes_sidecar(self):
+        sidecar = metadata.get_sidecar_path(self.json_path)
+        self.assertEqual(os.path.join(self.tmp_dir.name, "cpack-metadata.bin"),
+                         sidecar)
+
+        self.check_metadata(metadata.load(self.json_path))
+        self.assertFileExists(sidecar)
+
+        with open(sidecar, "rb") as f:
+            data = f.read()
+        self.assertTrue(data.startswith(metadata.SIDECAR_MAGIC))
+        self.assertNotIn(b"Shared library files", data)
+
+        st = os.stat(self.json_path)
+        self.check_metadata(
+            metadata.decode_sidecar(data, st.st_mtime_ns, st.st_size))
+
+    def test_load_no_sidecar(self):
+        self.check_metadata(
+            metadata.load(self.json_path, write_sidecar=False))
+        self.assertFileNotExists(
+            metadata.get_sidecar_path(self.json_path))
+
+    def test_load_uses_sidecar(self):
+        metadata.load(self.json_path)
+
+        st = os.stat(self.json_path)
+        with open(self.json_path, "w") as f:
+            f.write("not json")
+        os.truncate(self.json_path, st.st_size)
+        os.utime(self.json_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        self.check_metadata(metadata.load(self.json_path))
+
+    def test_load_stale_sidecar(self):
+        metadata.load(self.json_path)
+
+        data = dict(self.json_data, buildType="Debug")
+        with open(self.json_path, "w") as f:
+            json.dump(data, f)
+        os.utime(self.json_path, ns=(0, 0))
+
+        self.assertEqual("Debug", metadata.load(self.json_path).build_type)
+        self.assertEqual("Debug", metadata.load(self.json_path).build_type)
+
+    def test_no_build_type(self):
+        data = dict(self.json_data)
+        del data["buildType"]
+        with open(self.json_path, "w") as f:
+            json.dump(data, f)
+
+        self.assertIsNone(metadata.load(self.json_path).build_type)
+        self.assertIsNone(metadata.load(self.json_path).build_type)
+
+    def test_decode_invalid(self):
+        with self.assertRaisesRegex(metadata.MetadataError,
+                                    "Invalid CPack metadata sidecar"):
+            metadata.decode_sidecar(b"garbage")
+
+        encoded = metadata.encode_sidecar(
+            metadata.from_json_data(self.json_data), 0, 0)
+        with self.assertRaisesRegex(metadata.MetadataError,
+                                    "Truncated CPack metadata sidecar"):
+            metadata.decode_sidecar(encoded[:-3])
+
+    def test_merge_json_data(self):
+        merged = metadata.merge_json_data(
+            [("shared", self.json_data), ("static", self.json_data)],
+            {"static:Headers": ["shared:Libraries"]})
+        m = metadata.from_json_data(merged)
+
+        self.assertEqual({
+            "shared:Libraries", "shared:Headers",
+            "static:Libraries", "static:Headers",
+        }, set(m.components))
+        self.assertEqual(("shared:Libraries",),
+                         m.components["shared:Headers"].dependencies)
+        self.assertEqual(("static:Libraries", "shared:Libraries"),
+                         m.components["static:Headers"].dependencies)
+        self.assertEqual(("static:Development",),
+                         m.component_groups["static:All"].subgroups)
+
+        self.assertEqual(["shared", "static"],
+                         [p.flavor for p in m.projects])
+        self.assertEqual({"static:Headers", "static:Libraries"},
+                         m.projects[1].components)
+        self.assertEqual("Release", m.projects[1].build_type)
+        self.assertTrue(m.projects[1].strip_files)
+        self.assertEqual("Headers",
+                         m.projects[1].get_install_component("static:Headers"))
+
+    def test_merge_json_data_invalid_dependency(self):
+        with self.assertRaisesRegex(metadata.MetadataError,
+                                    "Invalid CPack component: static:Nope"):
+            metadata.merge_json_data([("static", self.json_data)],
+                                     {"static:Headers": ["static:Nope"]})
@@ -0,0 +1,124 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import io
+
+from dhcmake import ninjalog
+from . import KWTestCaseBase
+
+
+NINJA_LOG = (
+    "# ninja log v7\n"
+    # A previous run
+    "0\t500\t1\ta.c.o\t11\n"
+    "0\t900\t1\tb.c.o\t22\n"
+    # The last run
+    "0\t1000\t2\ta.c.o\t11\n"
+    "0\t3000\t2\tb.c.o\t22\n"
+    "3000\t3500\t2\tlibab.so.1.0\t33\n"
+    "3500\t3700\t2\tlibab.so.1\t55\n"
+    "3500\t3700\t2\tlibab.so\t55\n"
+    "3000\t4500\t2\tc.c.o\t44\n"
+)
+
+NINJA_GRAPH = """digraph ninja {
+rankdir="LR"
+node [fontsize=10, shape=box, height=0.25]
+edge [fontsize=10]
+"0x1" [label="all"]
+"0x2" [label="phony", shape=ellipse]
+"0x2" -> "0x1"
+"0x3" -> "0x2" [arrowhead=none]
+"0x4" -> "0x2" [arrowhead=none]
+"0x3" [label="libab.so"]
+"0x5" [label="CMAKE_SYMLINK_LIBRARY", shape=ellipse]
+"0x5" -> "0x6"
+"0x5" -> "0x3"
+"0x7" -> "0x5" [arrowhead=none]
+"0x7" [label="libab.so.1.0"]
+"0x8" [label="C_SHARED_LIBRARY_LINKER__ab_", shape=ellipse]
+"0x8" -> "0x7"
+"0x9" -> "0x8" [arrowhead=none]
+"0xa" -> "0x8" [arrowhead=none]
+"0x9" [label="a.c.o"]
+"0xb" -> "0x9" [label=" C_COMPILER__ab_"]
+"0xb" [label="/src/a.c"]
+"0xa" [label="b.c.o"]
+"0xc" -> "0xa" [label=" C_COMPILER__ab_"]
+"0xc" [label="/src/b.c"]
+"0x4" [label="c.c.o"]
+"0xd" [label="C_COMPILER__c_", shape=ellipse]
+"0xd" -> "0x4"
+"0xe" -> "0xd" [arrowhead=none]
+"0xa" -> "0xd" [arrowhead=none style=dotted]
+"0xe" [label="/src/c.c"]
+}
+"""
+
+
+class NinjaLogTestCase(KWTestCaseBase):
+    def read_steps(self):
+        return ninjalog.read_ninja_log(io.StringIO(NINJA_LOG))
+
+    def read_graph(self):
+        return ninjalog.read_ninja_graph(io.StringIO(NINJA_GRAPH))
+
+    def test_read_ninja_log(self):
+        self.assertEqual([
+            {"outputs": ["a.c.o"], "start": 0.0, "end": 1.0,
+             "duration": 1.0},
+            {"outputs": ["b.c.o"], "start": 0.0, "end": 3.0,
+             "duration": 3.0},
+            {"outputs": ["libab.so.1.0"], "start": 3.0, "end": 3.5,
+             "duration": 0.5},
+            {"outputs": ["libab.so.1", "libab.so"], "start": 3.5,
+             "end": 3.7, "duration": 0.2},
+            {"outputs": ["c.c.o"], "start": 3.0, "end": 4.5,
+             "duration": 1.5},
+        ], self.read_steps())
+
+    def test_read_ninja_graph(self):
+        self.assertEqual({
+            "all": {"libab.so", "c.c.o"},
+            "libab.so": {"libab.so.1.0"},
+            "libab.so.1.0": {"a.c.o", "b.c.o"},
+            "a.c.o": {"/src/a.c"},
+            "b.c.o": {"/src/b.c"},
+            "c.c.o": {"/src/c.c", "b.c.o"},
+        }, self.read_graph())
+
+    def test_get_critical_path(self):
+        length, path = ninjalog.get_critical_path(self.read_steps(),
+                                                  self.read_graph())
+
+        self.assertAlmostEqual(4.5, length)
+        self.assertEqual([["b.c.o"], ["c.c.o"]],
+                         [s["outputs"] for s in path])
+
+    def test_analyze_ninja_log(self):
+        report = ninjalog.analyze_ninja_log(self.read_steps(),
+                                            self.read_graph())
+
+        self.assertAlmostEqual(4.5, report["build_time"])
+        self.assertAlmostEqual(6.2, report["work_time"])
+        self.assertEqual([["b.c.o"], ["c.c.o"], ["a.c.o"], ["libab.so.1.0"],
+                          ["libab.so.1", "libab.so"]],
+                         [s["outputs"] for s in report["steps"]])
+
+        self.assertEqual([
+            "Build took 4.50 s: 5 steps, 6.20 s of work, parallelism 1.38",
+            "Critical path (4.50 s):",
+            "\t    3.00 s  b.c.o",
+            "\t    1.50 s  c.c.o",
+            "Slowest steps:",
+            "\t    3.00 s  b.c.o",
+            "\t    1.50 s  c.c.o",
+        ], ninjalog.format_summary(report, slowest=2))
+
+    def test_analyze_ninja_log_no_graph(self):
+        report = ninjalog.analyze_ninja_log([])
+
+        self.assertIsNone(report["critical_path"])
+        self.assertEqual(["Build took 0.00 s: 0 steps, 0.00 s of work"],
+                         ninjalog.format_summary(report))
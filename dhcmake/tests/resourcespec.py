@@ -0,0 +1,68 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import io
+import json
+import os
+import tempfile
+
+from dhcmake import resourcespec
+from . import KWTestCaseBase
+
+
+class ResourceSpecTestCase(KWTestCaseBase):
+    def test_detect(self):
+        self.assertGreater(resourcespec.get_threads(), 0)
+        self.assertGreater(resourcespec.get_available_memory(), 0)
+
+    def test_make_resource_spec(self):
+        spec = resourcespec.make_resource_spec(8, 16384)
+
+        self.assertEqual({"major": 1, "minor": 0}, spec["version"])
+        local = self.get_single_element(spec["local"])
+        self.assertEqual([{"id": "0", "slots": 8}], local["threads"])
+        self.assertEqual([{"id": "0", "slots": 16384}], local["memory"])
+
+    def test_write_resource_spec_shares(self):
+        f = io.StringIO()
+        resourcespec.write_resource_spec(f, shares=1000000)
+        local = self.get_single_element(json.loads(f.getvalue())["local"])
+
+        self.assertEqual([{"id": "0", "slots": 1}], local["threads"])
+        self.assertEqual(1, local["memory"][0]["slots"])
+
+    def write_cgroup(self, root, path, limit, current):
+        directory = os.path.join(root, path)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "memory.max"), "w") as f:
+            f.write("%s\n" % limit)
+        with open(os.path.join(directory, "memory.current"), "w") as f:
+            f.write("%i\n" % current)
+
+    def test_get_cgroup_memory_limit(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "cgroup")
+            proc_cgroup = os.path.join(tmp_dir, "cgroup.txt")
+            with open(proc_cgroup, "w") as f:
+                f.write("1:name=systemd:/build.slice/job.scope\n"
+                        "0::/build.slice/job.scope\n")
+            os.makedirs(root)
+
+            self.assertIsNone(resourcespec._get_cgroup_memory_limit(
+                root, proc_cgroup))
+
+            # The tightest limit among the cgroup and its ancestors wins
+            self.write_cgroup(root, "build.slice/job.scope", "max", 100)
+            self.write_cgroup(root, "build.slice", 1000, 400)
+            self.assertEqual(600, resourcespec._get_cgroup_memory_limit(
+                root, proc_cgroup))
+
+            self.write_cgroup(root, "build.slice/job.scope", 300, 100)
+            self.assertEqual(200, resourcespec._get_cgroup_memory_limit(
+                root, proc_cgroup))
+
+            with open(proc_cgroup, "w") as f:
+                f.write("4:memory:/build.slice\n")
+            self.assertIsNone(resourcespec._get_cgroup_memory_limit(
+                root, proc_cgroup))
@@ -0,0 +1,81 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import contextlib
+import io
+import os
+import tempfile
+
+from dhcmake import rusage
+from . import KWTestCaseBase
+
+
+class RUsageTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rusage_dir = os.path.join(self.tmp_dir.name, "rusage")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_main(self, *args):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            result = rusage.main([self.rusage_dir, *args])
+        return result, stdout.getvalue()
+
+    def test_get_rusage_file(self):
+        self.assertEqual("rusage/Test_With_Spaces_and_.slashes.json",
+                         rusage.get_rusage_file(
+                             "rusage", "Test With Spaces/and .slashes"))
+
+    def test_format_measurements(self):
+        self.assertEqual(
+            "<DartMeasurement name=\"Peak Memory (KiB)\" "
+            "type=\"numeric/integer\">1024</DartMeasurement>\n"
+            "<DartMeasurement name=\"User CPU Time (s)\" "
+            "type=\"numeric/double\">0.5</DartMeasurement>\n"
+            "<DartMeasurement name=\"System CPU Time (s)\" "
+            "type=\"numeric/double\">0.25</DartMeasurement>\n"
+            "<DartMeasurement name=\"Voluntary Context Switches\" "
+            "type=\"numeric/integer\">3</DartMeasurement>\n"
+            "<DartMeasurement name=\"Involuntary Context Switches\" "
+            "type=\"numeric/integer\">4</DartMeasurement>\n",
+            rusage.format_measurements({
+                "max_rss": 1024,
+                "user_time": 0.5,
+                "system_time": 0.25,
+                "voluntary_context_switches": 3,
+                "involuntary_context_switches": 4,
+            }))
+
+    def test_main(self):
+        result, stdout = self.run_main(
+            "Test/Memory", "python3", "-c",
+            "import sys; b = bytearray(64 << 20); sys.exit(3)")
+
+        self.assertEqual(3, result)
+        usage = rusage.read_usage(self.rusage_dir, "Test/Memory")
+        self.assertEqual("Test/Memory", usage["name"])
+        self.assertGreaterEqual(usage["max_rss"], 64 << 10)
+        self.assertGreater(usage["user_time"] + usage["system_time"], 0)
+        self.assertEqual(rusage.format_measurements(usage), stdout)
+
+    def test_main_quiet(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            result = rusage.main(["--quiet", self.rusage_dir, "build",
+                                  "true"])
+
+        self.assertEqual(0, result)
+        self.assertEqual("", stdout.getvalue())
+        self.assertEqual("build",
+                         rusage.read_usage(self.rusage_dir, "build")["name"])
+
+    def test_main_missing(self):
+        result, stdout = self.run_main("TestMissing", "/nonexistent")
+
+        self.assertEqual(127, result)
+        self.assertEqual("", stdout)
+        self.assertFileNotExists(self.rusage_dir)
@@ -0,0 +1,135 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import os
+import tempfile
+
+from dhcmake import spool
+from . import KWTestCaseBase
+
+
+class SpoolTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool_dir = os.path.join(self.tmp_dir.name, "spool")
+        os.mkdir(self.spool_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add_parts(self, *parts):
+        for part in parts:
+            with open(os.path.join(self.spool_dir, part), "w"):
+                pass
+
+    def test_list_parts(self):
+        self.assertEqual([], spool.list_parts(
+            os.path.join(self.tmp_dir.name, "nonexistent")))
+
+        self.add_parts("Notes", "Test", "Custom", "Configure", ".log")
+        self.assertEqual(["Configure", "Test", "Notes", "Custom"],
+                         spool.list_parts(self.spool_dir))
+
+    def test_lock(self):
+        with spool.lock(self.spool_dir):
+            self.assertIsNone(spool.lock(self.spool_dir, blocking=False))
+
+        f = spool.lock(self.spool_dir, blocking=False)
+        self.assertIsNotNone(f)
+        f.close()
+
+    def test_drain(self):
+        self.add_parts("Build", "Configure", "Test")
+        submitted = []
+
+        def submit(part):
+            submitted.append(part)
+            return part != "Build"
+
+        self.assertEqual(["Build"], spool.drain(self.spool_dir, submit))
+        self.assertEqual(["Configure", "Build", "Test"], submitted)
+        self.assertEqual(["Build"], spool.list_parts(self.spool_dir))
+
+        submitted.clear()
+        self.assertEqual([], spool.drain(self.spool_dir, submit,
+                                         skip={"Build"}))
+        self.assertEqual([], submitted)
+
+    def test_drain_respooled(self):
+        self.add_parts("Test")
+
+        def submit(part):
+            self.add_parts(part)
+            return True
+
+        self.assertEqual([], spool.drain(self.spool_dir, submit))
+        self.assertEqual(["Test"], spool.list_parts(self.spool_dir))
+
+    def test_drain_error(self):
+        self.add_parts("Configure")
+
+        def submit(part):
+            raise RuntimeError("Interrupted")
+
+        with self.assertRaisesRegex(RuntimeError, "Interrupted"):
+            spool.drain(self.spool_dir, submit)
+        self.assertEqual(["Configure"], spool.list_parts(self.spool_dir))
+
+    def test_drain_crashed(self):
+        with open(os.path.join(self.spool_dir, ".Build.submitting"), "w"):
+            pass
+        submitted = []
+
+        def submit(part):
+            submitted.append(part)
+            return True
+
+        self.assertEqual([], spool.drain(self.spool_dir, submit))
+        self.assertEqual(["Build"], submitted)
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    def test_tag_parts(self):
+        self.add_parts("Configure", "Build")
+        spool.tag_parts(self.spool_dir, ".testing-1")
+
+        self.assertEqual(["Configure", "Build"],
+                         spool.list_parts(self.spool_dir))
+        for part in ["Configure", "Build"]:
+            with open(os.path.join(self.spool_dir, part), "r") as f:
+                self.assertEqual(".testing-1", f.read())
+        self.assertEqual({"Configure", "Build"},
+                         set(os.listdir(self.spool_dir)))
+
+    def test_work(self):
+        self.add_parts("Configure", "Build")
+        spool.tag_parts(self.spool_dir, ".testing-1")
+        # Spooled after the snapshot was taken
+        self.add_parts("Test")
+        submitted = []
+
+        def submit(part):
+            submitted.append(part)
+            return part != "Build"
+
+        self.assertEqual(["Build"], spool.work(self.spool_dir, submit,
+                                               ".testing-1"))
+        self.assertEqual(["Configure", "Build"], submitted)
+        self.assertEqual(["Build", "Test"], spool.list_parts(self.spool_dir))
+
+    def test_main(self):
+        snapshot = os.path.join(self.spool_dir, ".testing-1")
+        os.mkdir(snapshot)
+        self.add_parts("Configure")
+        spool.tag_parts(self.spool_dir, ".testing-1")
+
+        self.assertEqual(0, spool.main([self.spool_dir, ".testing-1",
+                                        "true"]))
+        self.assertEqual([], spool.list_parts(self.spool_dir))
+        self.assertFileNotExists(snapshot)
+
+        self.add_parts("Build")
+        spool.tag_parts(self.spool_dir, ".testing-2")
+        self.assertEqual(0, spool.main([self.spool_dir, ".testing-2",
+                                        "false"]))
+        self.assertEqual(["Build"], spool.list_parts(self.spool_dir))
@@ -0,0 +1,104 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import io
+import os
+import tempfile
+
+from dhcmake import testcache
+from . import KWTestCaseBase
+
+
+class TestCacheTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.build_dir = self.tmp_dir.name
+        self.objects = {
+            self.path("test-exe"): (None, ("liba.so.1", "libc.so.6")),
+            self.path("liba.so.1.0"): ("liba.so.1", ("libb.so.1",)),
+            self.path("libb.so.1.0"): ("libb.so.1", ()),
+            self.path("libc.so.1.0"): ("libc.so.1", ()),
+        }
+        for name in ["test-exe", "liba.so.1.0", "libb.so.1.0", "libc.so.1.0",
+                     "data.txt"]:
+            self.write(name, name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.build_dir, name)
+
+    def write(self, name, contents):
+        with open(self.path(name), "w") as f:
+            f.write(contents)
+
+    def get_fingerprint(self, test, environment="env"):
+        return testcache.Fingerprinter(
+            self.build_dir, self.objects, environment).get_fingerprint(test)
+
+    def test_get_libraries(self):
+        fingerprinter = testcache.Fingerprinter(self.build_dir, self.objects,
+                                                "env")
+
+        self.assertEqual({self.path("liba.so.1.0"), self.path("libb.so.1.0")},
+                         fingerprinter.get_libraries(self.path("test-exe")))
+        self.assertEqual(set(), fingerprinter.get_libraries("/usr/bin/true"))
+
+    def test_get_fingerprint(self):
+        test = {
+            "name": "Test",
+            "command": [self.path("test-exe"), "--input", "data.txt"],
+            "properties": [
+                {"name": "WORKING_DIRECTORY", "value": self.build_dir},
+                {"name": "REQUIRED_FILES", "value": ["missing.txt"]},
+            ],
+        }
+        fingerprint = self.get_fingerprint(test)
+        self.assertEqual(fingerprint, self.get_fingerprint(test))
+        self.assertNotEqual(fingerprint,
+                            self.get_fingerprint(test, environment="other"))
+
+        for name in ["test-exe", "libb.so.1.0", "data.txt", "missing.txt"]:
+            self.write(name, "changed")
+            self.assertNotEqual(fingerprint, self.get_fingerprint(test))
+            fingerprint = self.get_fingerprint(test)
+
+        # Not loaded by the test
+        self.write("libc.so.1.0", "changed")
+        self.assertEqual(fingerprint, self.get_fingerprint(test))
+
+        test["properties"].append(
+            {"name": "ENVIRONMENT", "value": ["VAR=value"]})
+        self.assertNotEqual(fingerprint, self.get_fingerprint(test))
+
+    def test_get_fingerprint_not_built(self):
+        self.assertIsNone(self.get_fingerprint({"name": "Test"}))
+
+    def test_read_write_results(self):
+        f = io.StringIO()
+        testcache.write_results(f, {"TestTrue": "abc"})
+        f.seek(0)
+
+        self.assertEqual({"TestTrue": "abc"}, testcache.read_results(f))
+
+    def test_select_uncached(self):
+        self.assertEqual(
+            (["Changed", "New", "NotBuilt"], ["Same"]),
+            testcache.select_uncached(
+                ["Changed", "New", "NotBuilt", "Same"],
+                {"Changed": "2", "New": "3", "NotBuilt": None, "Same": "4"},
+                {"Changed": "1", "Same": "4", "Removed": "5"}))
+
+    def test_update_results(self):
+        self.assertEqual(
+            {"Cached": "1", "Passed": "3"},
+            testcache.update_results(
+                {"Cached": "1", "Failed": "2", "Gone": "9"},
+                {"Cached": "1", "Failed": "2", "Passed": "3",
+                 "NotBuilt": None, "NotRun": "4"},
+                {"Cached": (1, 0.5), "Failed": (1, 0.5), "NotRun": (2, 1.0)},
+                {"Cached": (1, 0.5), "Failed": (1, 0.5), "Passed": (1, 0.1),
+                 "NotBuilt": (1, 0.1), "NotRun": (2, 1.0)},
+                {"Failed", "NotBuilt"}))
@@ -0,0 +1,96 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import gzip
+import io
+import os
+import tempfile
+
+from dhcmake import testoutput
+from . import KWTestCaseBase
+
+
+SEPARATOR = "-" * 58 + "\n"
+
+LAST_TEST_LOG = (
+    "Start testing: Jan 01 00:00 UTC\n" + SEPARATOR +
+    "1/3 Testing: TestTrue\n"
+    "1/3 Test: TestTrue\n"
+    "Command: \"/usr/bin/true\"\n"
+    "Output:\n" + SEPARATOR +
+    "<end of output>\n"
+    "Test time =   0.00 sec\n" + SEPARATOR +
+    "Test Passed.\n" + SEPARATOR + "\n"
+    "2/3 Testing: Test/Output\n"
+    "2/3 Test: Test/Output\n"
+    "Output:\n" + SEPARATOR +
+    "Output:\n" + SEPARATOR +
+    "line 2\n"
+    "no newline<end of output>\n"
+    "Test time =   0.00 sec\n" + SEPARATOR +
+    "Test Failed.\n" + SEPARATOR + "\n"
+    "Unable to find executable: missing\n"
+    "3/3 Testing: TestMissing\n"
+    "3/3 Test: TestMissing\n"
+    "Test not run\n" + SEPARATOR + "\n"
+    "End testing: Jan 01 00:00 UTC\n"
+)
+
+TEST_XML = (
+    "<Site><Testing>\n"
+    "<Test Status=\"passed\"><Name>TestTrue</Name><Results>"
+    "<Measurement><Value>ok\n</Value></Measurement></Results></Test>\n"
+    "<Test Status=\"failed\"><Name>TestFalse</Name><Results>"
+    "<NamedMeasurement name=\"Exit Code\"><Value>Failed</Value>"
+    "</NamedMeasurement>"
+    "<Measurement><Value>it broke</Value></Measurement></Results></Test>\n"
+    "<Test Status=\"notrun\"><Name>TestSkip</Name><Results>"
+    "<NamedMeasurement name=\"Completion Status\">"
+    "<Value>SKIP_REGULAR_EXPRESSION_MATCHED</Value></NamedMeasurement>"
+    "<Measurement><Value>skipped\n</Value></Measurement></Results></Test>\n"
+    "</Testing></Site>\n"
+)
+
+
+class TestOutputTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = os.path.join(self.tmp_dir.name, "output")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_output(self, name):
+        with gzip.open(testoutput.get_output_file(self.output_dir, name),
+                       "rt") as f:
+            return f.read()
+
+    def test_get_output_file(self):
+        self.assertEqual("output/Test_With_Spaces_and_.slashes.log.gz",
+                         testoutput.get_output_file(
+                             "output", "Test With Spaces/and .slashes"))
+
+    def test_write_last_test_log_output(self):
+        self.assertEqual(2, testoutput.write_last_test_log_output(
+            io.StringIO(LAST_TEST_LOG), self.output_dir))
+
+        self.assertEqual(["TestTrue.log.gz", "Test_Output.log.gz"],
+                         sorted(os.listdir(self.output_dir)))
+        self.assertEqual("", self.read_output("TestTrue"))
+        self.assertEqual("Output:\n" + SEPARATOR + "line 2\nno newline",
+                         self.read_output("Test/Output"))
+
+    def test_write_test_xml_output(self):
+        failed = io.StringIO()
+        self.assertEqual(3, testoutput.write_test_xml_output(
+            io.BytesIO(TEST_XML.encode("utf-8")), self.output_dir,
+            failed=failed))
+
+        self.assertEqual(["TestFalse.log.gz", "TestSkip.log.gz",
+                          "TestTrue.log.gz"],
+                         sorted(os.listdir(self.output_dir)))
+        self.assertEqual("ok\n", self.read_output("TestTrue"))
+        self.assertEqual("it broke", self.read_output("TestFalse"))
+        self.assertEqual("Test TestFalse (Failed):\nit broke\n",
+                         failed.getvalue())
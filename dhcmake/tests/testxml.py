@@ -0,0 +1,235 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import base64
+import io
+import os
+import tempfile
+import xml.etree.ElementTree
+import zlib
+
+from dhcmake import testxml
+from . import KWTestCaseBase
+
+
+TEST_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Site BuildName="test" BuildStamp="{stamp}" Name="site">
+\t<Testing>
+\t\t<StartDateTime>{start_date}</StartDateTime>
+\t\t<StartTestTime>{start}</StartTestTime>
+\t\t<TestList>
+\t\t\t<Test>./{name}</Test>
+\t\t</TestList>
+\t\t<Test Status="{status}">
+\t\t\t<Name>{name}</Name>
+\t\t</Test>
+\t\t<EndDateTime>{end_date}</EndDateTime>
+\t\t<EndTestTime>{end}</EndTestTime>
+\t\t<ElapsedMinutes>0</ElapsedMinutes>
+\t</Testing>
+</Site>
+"""
+
+RESULT_XML = """\t\t<Test Status="{status}">
+\t\t\t<Name>{name}</Name>
+\t\t\t<Path>./sub</Path>
+\t\t\t<Results>
+\t\t\t\t<NamedMeasurement type="text/string" name="Exit Code">
+\t\t\t\t\t<Value>{exit_code}</Value>
+\t\t\t\t</NamedMeasurement>
+\t\t\t\t<NamedMeasurement type="numeric/double" name="Execution Time">
+\t\t\t\t\t<Value>{time}</Value>
+\t\t\t\t</NamedMeasurement>
+\t\t\t\t<NamedMeasurement type="text/string" name="Completion Status">
+\t\t\t\t\t<Value>{completion}</Value>
+\t\t\t\t</NamedMeasurement>
+\t\t\t\t<Measurement>
+\t\t\t\t\t<Value{encoding}>{output}</Value>
+\t\t\t\t</Measurement>
+\t\t\t</Results>
+\t\t</Test>
+"""
+
+RESULTS = [
+    dict(status="passed", name="TestTrue", exit_code="", time="0.5",
+         completion="Completed", encoding="", output="ok"),
+    dict(status="failed", name="TestFalse", exit_code="Failed", time="2",
+         completion="Completed",
+         encoding=' encoding="base64" compression="gzip"',
+         output=base64.b64encode(zlib.compress(b"it <broke>"))
+         .decode("ascii")),
+    dict(status="failed", name="TestSlow", exit_code="Timeout", time="10",
+         completion="Completed", encoding="", output=""),
+    dict(status="notrun", name="TestSkip", exit_code="", time="0",
+         completion="SKIP_RETURN_CODE=77", encoding="", output=""),
+    dict(status="notrun", name="TestMissing", exit_code="", time="0",
+         completion="Unable to find executable", encoding="",
+         output="Unable to find executable: missing"),
+]
+
+
+class TestXMLTestCase(KWTestCaseBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_test_xml(self, filename, **kwargs):
+        path = os.path.join(self.tmp_dir.name, filename)
+        with open(path, "w") as f:
+            f.write(TEST_XML.format(**kwargs))
+        return path
+
+    def test_merge_test_xml(self):
+        paths = [
+            self.write_test_xml(
+                "1.xml", stamp="20200101-0100-Shard", name="TestTrue",
+                status="passed", start=1000, end=1100,
+                start_date="Jan 01 01:00 UTC", end_date="Jan 01 01:01 UTC"),
+            self.write_test_xml(
+                "2.xml", stamp="20200101-0100-Shard", name="TestFalse",
+                status="failed", start=990, end=1200,
+                start_date="Jan 01 00:59 UTC", end_date="Jan 01 01:03 UTC"),
+        ]
+
+        f = io.BytesIO()
+        self.assertEqual(1, testxml.merge_test_xml(
+            paths, f, build_stamp="20200101-0000-Experimental"))
+
+        site = xml.etree.ElementTree.fromstring(f.getvalue())
+        self.assertEqual("20200101-0000-Experimental", site.get("BuildStamp"))
+        self.assertEqual("test", site.get("BuildName"))
+        self.assertEqual(["./TestTrue", "./TestFalse"], [
+            t.text for t in site.findall("Testing/TestList/Test")])
+        self.assertEqual(["TestTrue", "TestFalse"],
+                         [t.findtext("Name")
+                          for t in site.findall("Testing/Test")])
+        self.assertEqual("Jan 01 00:59 UTC",
+                         site.findtext("Testing/StartDateTime"))
+        self.assertEqual("990", site.findtext("Testing/StartTestTime"))
+        self.assertEqual("Jan 01 01:03 UTC",
+                         site.findtext("Testing/EndDateTime"))
+        self.assertEqual("1200", site.findtext("Testing/EndTestTime"))
+        self.assertEqual("3", site.findtext("Testing/ElapsedMinutes"))
+        self.assertEqual(
+            ["StartDateTime", "StartTestTime", "TestList", "Test", "Test",
+             "EndDateTime", "EndTestTime", "ElapsedMinutes"],
+            [e.tag for e in site.find("Testing")])
+
+    def test_merge_test_xml_rerun(self):
+        paths = [
+            self.write_test_xml(
+                "1.xml", stamp="20200101-0100-Experimental", name="TestFalse",
+                status="failed", start=1000, end=1100,
+                start_date="Jan 01 01:00 UTC", end_date="Jan 01 01:01 UTC"),
+            self.write_test_xml(
+                "2.xml", stamp="20200101-0100-Experimental", name="TestFalse",
+                status="passed", start=1200, end=1300,
+                start_date="Jan 01 01:03 UTC", end_date="Jan 01 01:05 UTC"),
+        ]
+
+        f = io.BytesIO()
+        self.assertEqual(0, testxml.merge_test_xml(paths, f))
+
+        site = xml.etree.ElementTree.fromstring(f.getvalue())
+        self.assertEqual(["./TestFalse"], [
+            t.text for t in site.findall("Testing/TestList/Test")])
+        test = self.get_single_element(site.findall("Testing/Test"))
+        self.assertEqual("passed", test.get("Status"))
+        self.assertEqual("1000", site.findtext("Testing/StartTestTime"))
+        self.assertEqual("1300", site.findtext("Testing/EndTestTime"))
+
+    def test_merge_test_xml_none(self):
+        with self.assertRaisesRegex(ValueError, "No Test.xml files to merge"):
+            testxml.merge_test_xml([], io.BytesIO())
+
+    def write_results_xml(self):
+        path = os.path.join(self.tmp_dir.name, "Test.xml")
+        with open(path, "w") as f:
+            head, tail = TEST_XML.format(
+                stamp="20200101-0000-Experimental", name="TestTrue",
+                status="passed", start=1577836800, end=1577836900,
+                start_date="Jan 01 00:00 UTC",
+                end_date="Jan 01 00:01 UTC").split("\t\t<EndDateTime>")
+            f.write(head.split("\t\t<Test Status")[0])
+            for result in RESULTS:
+                f.write(RESULT_XML.format(**result))
+            f.write("\t\t<EndDateTime>" + tail)
+        return path
+
+    def test_iter_test_xml(self):
+        site = {}
+        with open(self.write_results_xml(), "rb") as f:
+            results = list(testxml.iter_test_xml(f, site))
+
+        self.assertEqual("test", site["BuildName"])
+        self.assertEqual("1577836800", site["StartTestTime"])
+        self.assertEqual([
+            ("TestTrue", testxml.PASSED, None, 0.5, ""),
+            ("TestFalse", testxml.FAILED, "Failed", 2.0, "it <broke>"),
+            ("TestSlow", testxml.TIMEOUT, "Timeout", 10.0, ""),
+            ("TestSkip", testxml.SKIPPED, "SKIP_RETURN_CODE=77", 0.0, ""),
+            ("TestMissing", testxml.NOTRUN, "Unable to find executable",
+             0.0, "Unable to find executable: missing"),
+        ], [(r["name"], r["status"], r["message"], r["time"], r["output"])
+            for r in results])
+
+    def test_merge_test_xml_skipped(self):
+        # Skipped tests are not failures, but tests that could not run are
+        f = io.BytesIO()
+        self.assertEqual(3, testxml.merge_test_xml(
+            [self.write_results_xml()], f))
+
+    def test_count_failed(self):
+        with open(self.write_results_xml(), "rb") as f:
+            self.assertEqual(3, testxml.count_failed(f))
+
+    def test_summarize_test_xml(self):
+        junit = io.BytesIO()
+        with open(self.write_results_xml(), "rb") as f:
+            summary = testxml.summarize_test_xml(f, junit, slowest=2)
+
+        self.assertEqual({
+            testxml.PASSED: 1,
+            testxml.FAILED: 1,
+            testxml.TIMEOUT: 1,
+            testxml.SKIPPED: 1,
+            testxml.NOTRUN: 1,
+        }, summary["counts"])
+        self.assertEqual([("TestSlow", 10.0), ("TestFalse", 2.0)],
+                         summary["slowest"])
+        self.assertEqual([
+            "5 tests: 1 passed, 1 failed, 1 timed out, 1 skipped, 1 not run",
+            "Failed tests:",
+            "\tTestFalse (Failed)",
+            "\tTestSlow (Timeout)",
+            "\tTestMissing (Unable to find executable)",
+            "Slowest tests:",
+            "\t   10.00 s  TestSlow",
+            "\t    2.00 s  TestFalse",
+        ], testxml.format_summary(summary))
+
+        testsuites = xml.etree.ElementTree.fromstring(junit.getvalue())
+        self.assertEqual("5", testsuites.get("tests"))
+        self.assertEqual("2", testsuites.get("failures"))
+        self.assertEqual("1", testsuites.get("errors"))
+        self.assertEqual("1", testsuites.get("skipped"))
+        testsuite = testsuites.find("testsuite")
+        self.assertEqual("test", testsuite.get("name"))
+        self.assertEqual("site", testsuite.get("hostname"))
+        self.assertEqual("2020-01-01T00:00:00", testsuite.get("timestamp"))
+
+        testcases = testsuite.findall("testcase")
+        self.assertEqual(["TestTrue", "TestFalse", "TestSlow", "TestSkip",
+                          "TestMissing"], [t.get("name") for t in testcases])
+        self.assertEqual("./sub", testcases[0].get("classname"))
+        self.assertEqual([], list(testcases[0]))
+        self.assertEqual("it <broke>", testcases[1].findtext("failure"))
+        self.assertEqual("Timeout",
+                         testcases[2].find("failure").get("type"))
+        self.assertEqual("SKIP_RETURN_CODE=77",
+                         testcases[3].find("skipped").get("message"))
+        self.assertEqual("Unable to find executable: missing",
+                         testcases[4].findtext("error"))
@@ -0,0 +1,273 @@
+# This file is part of dh-cmake, and is distributed under the OSI-approved
+# BSD 3-Clause license. See top-level LICENSE file or
+# https://gitlab.kitware.com/debian/dh-cmake/blob/master/LICENSE for details.
+
+import base64
+import heapq
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree
+import xml.sax.saxutils
+import zlib
+
+
+PASSED = "passed"
+FAILED = "failed"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+NOTRUN = "notrun"
+
+STATUSES = [PASSED, FAILED, TIMEOUT, SKIPPED, NOTRUN]
+# The statuses that ctest_test() counts as failures. Skipped and disabled
+# tests are not among them.
+FAILED_STATUSES = [FAILED, TIMEOUT, NOTRUN]
+
+
+def _get_time(testing, name):
+    return int(testing.findtext(name, "0"))
+
+
+def merge_test_xml(paths, f, build_stamp=None):
+    site = None
+    testings = []
+
+    for path in paths:
+        root = xml.etree.ElementTree.parse(path).getroot()
+        if site is None:
+            site = root
+        testings.append(root.find("Testing"))
+
+    if site is None:
+        raise ValueError("No Test.xml files to merge")
+
+    # A test that appears again, such as in a rerun, keeps its place but
+    # takes the later result
+    test_list = {}
+    tests = {}
+    for testing in testings:
+        for t in testing.findall("TestList/Test"):
+            test_list[t.text] = t
+        for t in testing.findall("Test"):
+            tests[t.findtext("Name")] = t
+    test_list = list(test_list.values())
+    tests = list(tests.values())
+    start = min(testings, key=lambda t: _get_time(t, "StartTestTime"))
+    end = max(testings, key=lambda t: _get_time(t, "EndTestTime"))
+
+    if build_stamp is not None:
+        site.set("BuildStamp", build_stamp)
+
+    site.remove(site.find("Testing"))
+    testing = xml.etree.ElementTree.SubElement(site, "Testing")
+    for name, source in [("StartDateTime", start), ("StartTestTime", start)]:
+        xml.etree.ElementTree.SubElement(testing, name).text = \
+            source.findtext(name)
+    list_element = xml.etree.ElementTree.SubElement(testing, "TestList")
+    list_element.extend(test_list)
+    testing.extend(tests)
+    for name, source in [("EndDateTime", end), ("EndTestTime", end)]:
+        xml.etree.ElementTree.SubElement(testing, name).text = \
+            source.findtext(name)
+    elapsed = _get_time(end, "EndTestTime") - _get_time(start, "StartTestTime")
+    xml.etree.ElementTree.SubElement(testing, "ElapsedMinutes").text = \
+        str(elapsed // 60)
+
+    tree = xml.etree.ElementTree.ElementTree(site)
+    xml.etree.ElementTree.indent(tree, space="\t")
+    tree.write(f, encoding="UTF-8", xml_declaration=True)
+
+    return sum(1 for t in tests if _get_status(t)[0] in FAILED_STATUSES)
+
+
+def _get_output(test):
+    value = test.find("Results/Measurement/Value")
+    if value is None or not value.text:
+        return ""
+    if value.get("compression") == "gzip":
+        return zlib.decompress(base64.b64decode(value.text)).decode(
+            "utf-8", "replace")
+    return value.text
+
+
+def _get_measurements(test):
+    return {m.get("name"): m.findtext("Value", "")
+            for m in test.findall("Results/NamedMeasurement")}
+
+
+def _get_status(test, measurements=None):
+    if measurements is None:
+        measurements = _get_measurements(test)
+    exit_code = measurements.get("Exit Code")
+    completion = measurements.get("Completion Status", "")
+
+    status = test.get("Status")
+    if status == "passed":
+        return PASSED, None
+    elif status == "failed" and exit_code == "Timeout":
+        return TIMEOUT, exit_code
+    elif status == "failed":
+        return FAILED, exit_code or completion
+    elif completion.startswith("SKIP") or completion == "Disabled":
+        return SKIPPED, completion
+    else:
+        return NOTRUN, completion
+
+
+def _make_result(test, all_output):
+    measurements = _get_measurements(test)
+    status, message = _get_status(test, measurements)
+
+    try:
+        duration = float(measurements.get("Execution Time", "0"))
+    except ValueError:
+        duration = 0.0
+
+    return {
+        "name": test.findtext("Name", ""),
+        "path": test.findtext("Path", ""),
+        "status": status,
+        "message": message,
+        "time": duration,
+        "output": _get_output(test) if all_output or status != PASSED
+        else "",
+    }
+
+
+def iter_test_xml(f, site=None, all_output=False):
+    # Test.xml can be huge, so look at one test at a time and throw it away
+    # once it has been handled
+    stack = []
+    for event, element in xml.etree.ElementTree.iterparse(
+            f, events=("start", "end")):
+        if event == "start":
+            if not stack and site is not None:
+                site.update(element.attrib)
+            stack.append(element)
+            continue
+
+        stack.pop()
+        if element.tag == "Test" and stack and stack[-1].tag == "Testing":
+            yield _make_result(element, all_output)
+            stack[-1].remove(element)
+        elif element.tag == "StartTestTime" and site is not None:
+            site["StartTestTime"] = element.text
+        elif element.tag == "TestList":
+            stack[-1].remove(element)
+
+
+def count_failed(f):
+    return sum(1 for result in iter_test_xml(f)
+               if result["status"] in FAILED_STATUSES)
+
+
+def _write_junit_test(f, result):
+    testcase = xml.etree.ElementTree.Element("testcase", {
+        "name": result["name"],
+        "classname": result["path"],
+        "time": "%g" % result["time"],
+    })
+    if result["status"] in (FAILED, TIMEOUT):
+        xml.etree.ElementTree.SubElement(testcase, "failure", {
+            "message": result["message"] or "",
+            "type": result["message"] or "",
+        }).text = result["output"]
+    elif result["status"] == SKIPPED:
+        xml.etree.ElementTree.SubElement(testcase, "skipped", {
+            "message": result["message"],
+        })
+    elif result["status"] == NOTRUN:
+        xml.etree.ElementTree.SubElement(testcase, "error", {
+            "message": result["message"],
+        }).text = result["output"]
+    f.write(b"\t\t")
+    f.write(xml.etree.ElementTree.tostring(testcase, encoding="utf-8"))
+    f.write(b"\n")
+
+
+def _write_junit(f, site, counts, total_time, testcases):
+    attrib = {
+        "tests": "%i" % sum(counts.values()),
+        "failures": "%i" % (counts[FAILED] + counts[TIMEOUT]),
+        "errors": "%i" % counts[NOTRUN],
+        "skipped": "%i" % counts[SKIPPED],
+        "time": "%g" % total_time,
+    }
+    suite_attrib = dict(attrib, name=site.get("BuildName", ""),
+                        hostname=site.get("Name", ""))
+    try:
+        suite_attrib["timestamp"] = time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.gmtime(int(site["StartTestTime"])))
+    except (KeyError, ValueError):
+        pass
+
+    def start_tag(tag, attrib):
+        return ("<%s%s>\n" % (tag, "".join(
+            " %s=%s" % (k, xml.sax.saxutils.quoteattr(v))
+            for k, v in attrib.items()))).encode("utf-8")
+
+    f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write(start_tag("testsuites", attrib))
+    f.write(b"\t" + start_tag("testsuite", suite_attrib))
+    testcases.seek(0)
+    shutil.copyfileobj(testcases, f)
+    f.write(b"\t</testsuite>\n</testsuites>\n")
+
+
+def summarize_test_xml(f, junit=None, slowest=10):
+    site = {}
+    counts = {status: 0 for status in STATUSES}
+    problems = []
+    slow = []
+    total_time = 0.0
+
+    # The totals go at the top of the JUnit file, so the test cases are
+    # collected in a temporary file until they are known
+    with tempfile.TemporaryFile() as testcases:
+        for i, result in enumerate(iter_test_xml(f, site)):
+            counts[result["status"]] += 1
+            total_time += result["time"]
+            if result["status"] != PASSED:
+                problems.append((result["name"], result["status"],
+                                 result["message"]))
+
+            entry = (result["time"], -i, result["name"])
+            if len(slow) < slowest:
+                heapq.heappush(slow, entry)
+            elif slowest:
+                heapq.heappushpop(slow, entry)
+
+            if junit is not None:
+                _write_junit_test(testcases, result)
+
+        if junit is not None:
+            _write_junit(junit, site, counts, total_time, testcases)
+
+    return {
+        "counts": counts,
+        "problems": problems,
+        "slowest": [(name, t) for t, i, name in sorted(slow, reverse=True)],
+        "time": total_time,
+    }
+
+
+def format_summary(summary):
+    counts = summary["counts"]
+    lines = ["%i tests: %s" % (sum(counts.values()), ", ".join(
+        "%i %s" % (counts[status], label) for status, label in [
+            (PASSED, "passed"), (FAILED, "failed"), (TIMEOUT, "timed out"),
+            (SKIPPED, "skipped"), (NOTRUN, "not run")]
+        if counts[status]))]
+
+    problems = [p for p in summary["problems"] if p[1] != SKIPPED]
+    if problems:
+        lines.append("Failed tests:")
+        for name, status, message in problems:
+            lines.append("\t%s (%s)" % (name, message or status))
+
+    if summary["slowest"]:
+        lines.append("Slowest tests:")
+        for name, duration in summary["slowest"]:
+            lines.append("\t%8.2f s  %s" % (duration, name))
+
+    return lines
@@ -41,20 +41,29 @@ setup(
     entry_points={
         "console_scripts": [
             "dh_cmake_install=dhcmake.cmake:install",
+            "dh_cmake_installed=dhcmake.cmake:installed",
+            "dh_cmake_history=dhcmake.history:main",
             "dh_ctest_clean=dhcmake.ctest:clean",
             "dh_ctest_start=dhcmake.ctest:start",
             "dh_ctest_update=dhcmake.ctest:update",
             "dh_ctest_configure=dhcmake.ctest:configure",
             "dh_ctest_build=dhcmake.ctest:build",
             "dh_ctest_test=dhcmake.ctest:test",
+            "dh_ctest_coverage=dhcmake.ctest:coverage",
             "dh_ctest_submit=dhcmake.ctest:submit",
+            "dh_ctest_run=dhcmake.ctest:run",
+            "dh_ctest_report=dhcmake.ctest:report",
             "dh_cpack_generate=dhcmake.cpack:generate",
             "dh_cpack_substvars=dhcmake.cpack:substvars",
             "dh_cpack_install=dhcmake.cpack:install",
         ],
     },
     package_data={
-        "dhcmake": ["dh_ctest_driver.cmake"],
+        "dhcmake": [
+            "dh_ctest_driver.cmake",
+            "dh_ctest_rusage.cmake",
+            "dh_ctest_rusage_project.cmake",
+        ],
     },
     data_files=[
         ("share/perl5/Debian/Debhelper/Sequence", [